@@ -14,14 +14,18 @@ import logging
 
 from PyQt5.QtCore import Qt, QFile, QIODevice, QCoreApplication
 from PyQt5.QtGui import QFontDatabase, QFont, QKeySequence, QColor, QPixmap
-from PyQt5.QtWidgets import QApplication, QDialog, QShortcut, QMessageBox, QStyle
+from PyQt5.QtWidgets import QApplication, QDialog, QShortcut, QMessageBox, QStyle, \
+    QProgressDialog
 
 from model.application_settings import ApplicationSettings
 from view.main_window import MainWindow
 from model.sprite import Sprite
+from model.autosave import Autosave, AutosaveJournal, find_orphaned_journals, remove_journal, \
+    set_journal_aside
 from model.resources_cache import ResourcesCache
 import model.appdata as appdata
 import helpers.utils as utils
+from helpers.worker import Worker
 
 
 class Application(QApplication):
@@ -29,7 +33,6 @@ class Application(QApplication):
 
     # TODO add indication if file is modified / saved
     # TODO Decide on resizing logistic
-    # TODO Add tolerance to Filler
     # TODO Layers: Add Change Opacity, Visibility
     # TODO Add Import from Spritesheets
     # TODO Finish Basic Ink Functionality
@@ -78,6 +81,12 @@ class Application(QApplication):
 
         self._currentSprite = None
 
+        self._backgroundWorker = None
+
+        self._progressDialog = None
+
+        self._autosave = Autosave(self._is_painting)
+
         self._connect_with_window_actions()
 
         # Load Stylesheet
@@ -97,6 +106,8 @@ class Application(QApplication):
 
         self._update_top_menu()
 
+        self._offer_recovery()
+
         sys.exit(self.exec_())
 
         # ---------------------------------------------------------------------
@@ -124,6 +135,8 @@ class Application(QApplication):
 
         self._mainWindow.show_workspace()
 
+        self._autosave.start(self._currentSprite)
+
     def load_sprite(self):
 
         last_opened_folder = self._settings.settings_map["last_folder_path"].value
@@ -135,6 +148,9 @@ class Application(QApplication):
 
             sprite = Sprite.load_from_file(sprite_file)
 
+            if self._currentSprite is not None:
+                self.close_sprite()
+
             self.set_sprite(sprite)
 
             self._update_top_menu()
@@ -157,6 +173,9 @@ class Application(QApplication):
 
             if sprite:
 
+                if self._currentSprite is not None:
+                    self.close_sprite()
+
                 self.set_sprite(sprite)
                 self._update_top_menu()
 
@@ -167,7 +186,7 @@ class Application(QApplication):
 
     def save_sprite(self):
 
-        if self._currentSprite is None:
+        if self._currentSprite is None or self._backgroundWorker is not None:
             return
 
         if self._currentSprite.file_path:
@@ -183,11 +202,11 @@ class Application(QApplication):
                                                     last_opened_folder)
 
         if save_path is not None and len(save_path) > 0:
-            Sprite.save(self._currentSprite, save_path)
+            self._save_sprite_in_background(save_path)
 
     def save_sprite_as(self):
 
-        if self._currentSprite is None:
+        if self._currentSprite is None or self._backgroundWorker is not None:
             return
 
         last_opened_path = self._settings.settings_map["last_folder_path"].value
@@ -197,17 +216,11 @@ class Application(QApplication):
                                                     last_opened_path)
 
         if new_save_path:
-            Sprite.save(self._currentSprite, new_save_path)
-
-            self.close_sprite()
-
-            new_sprite = Sprite.load_from_file(new_save_path)
-
-            self.set_sprite(new_sprite)
+            self._save_sprite_in_background(new_save_path)
 
     def export_sprite(self):
 
-        if self._currentSprite is None:
+        if self._currentSprite is None or self._backgroundWorker is not None:
             return
 
         last_opened_path = self._settings.settings_map["last_folder_path"].value
@@ -218,25 +231,31 @@ class Application(QApplication):
 
         if target_folder:
 
-            try:
-
-                # Sprite.export(self._current_sprite, target_folder)
-                Sprite.export_to_spritesheet(self._currentSprite, target_folder)
-
-            except Exception as e:
-
-                self._raise_error('exportSprite', e)
-                return
+            snapshot = self._currentSprite.snapshot()
 
-            utils.show_info_message(self._mainWindow, 'Info', 'Sprite Exported Successfuly.')
+            # Sprite.export(snapshot, target_folder, progress)
+            self._run_in_background(
+                'exportSprite', 'Exporting Sprite...',
+                lambda progress: Sprite.export_to_spritesheet(snapshot, target_folder, progress),
+                lambda _: utils.show_info_message(self._mainWindow, 'Info',
+                                                  'Sprite Exported Successfuly.'))
 
     def close_sprite(self):
 
         # TODO Save Sprite Before Close Test
+        self._cancel_background_work()
+
+        self._autosave.stop()
+
         self._mainWindow.canvas.unload_sprite()
         self._mainWindow.animation_display.unload_sprite()
         self._mainWindow.layer_manager.clear()
         self._mainWindow.animation_manager.clear()
+        self._mainWindow.thumbnail_cache.clear()
+
+        if self._currentSprite is not None:
+            self._currentSprite.close()
+
         self._currentSprite = None
 
         self._mainWindow.hide_workspace()
@@ -255,6 +274,128 @@ class Application(QApplication):
 
     # -------------------------------------------------------------------------
 
+    def _save_sprite_in_background(self, save_path):
+
+        sprite = self._currentSprite
+
+        # Taken on the GUI thread so editing can go on meanwhile. Surfaces changed since the last
+        # save share their pixels until next edited, saved ones are read back from the sprite file
+        snapshot = sprite.snapshot()
+
+        self._run_in_background(
+            'saveSprite', 'Saving Sprite...',
+            lambda progress: Sprite.write(snapshot, save_path, progress),
+            lambda pending_save: self._on_sprite_written(sprite, pending_save))
+
+    def _on_sprite_written(self, sprite, pending_save):
+
+        if sprite is not self._currentSprite:
+            Sprite.discard_save(pending_save)
+            return
+
+        # The file about to be replaced or remapped may be read by a running checkpoint
+        self._autosave.wait()
+
+        try:
+
+            Sprite.finish_save(sprite, pending_save)
+
+        except Exception as e:
+
+            self._raise_error('saveSprite', e)
+
+        else:
+
+            self._autosave.reset()
+
+    def _offer_recovery(self):
+
+        journals = find_orphaned_journals()
+
+        if len(journals) == 0:
+            return
+
+        # Older journals are offered on the next start, one sprite can be open at a time
+        journal_path = journals[0]
+
+        answer = QMessageBox.question(self._mainWindow, 'Recover',
+                                      'Pxeel was not closed properly last time. '
+                                      'Recover unsaved work?',
+                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+
+        if answer != QMessageBox.Yes:
+            remove_journal(journal_path)
+            return
+
+        try:
+
+            sprite = AutosaveJournal.recover(journal_path)
+
+        except Exception as e:
+
+            # The journal is the only copy of the lost work, it is kept rather than removed
+            kept_path = set_journal_aside(journal_path)
+
+            self._raise_error('recoverSprite', '{0}. The autosave journal was kept at {1}'
+                              .format(e, kept_path))
+
+        else:
+
+            self.set_sprite(sprite)
+            self._update_top_menu()
+
+            remove_journal(journal_path)
+
+    def _is_painting(self):
+
+        return self._mainWindow.canvas.is_painting
+
+    def _run_in_background(self, source, label, task, on_success):
+
+        worker = Worker(task)
+
+        self._progressDialog = QProgressDialog(label, 'Cancel', 0, 0, self._mainWindow)
+        self._progressDialog.setWindowModality(Qt.NonModal)
+        self._progressDialog.setMinimumDuration(500)
+        self._progressDialog.canceled.connect(worker.cancel)
+
+        worker.progressed.connect(self._on_background_progress)
+        worker.succeeded.connect(on_success)
+        worker.failed.connect(lambda e: self._raise_error(source, e))
+        worker.released.connect(self._on_background_finished)
+
+        self._backgroundWorker = worker
+
+        worker.start()
+
+    def _on_background_progress(self, done, total):
+
+        if self._progressDialog is not None:
+            self._progressDialog.setMaximum(total)
+            self._progressDialog.setValue(done)
+
+    def _on_background_finished(self):
+
+        if self._progressDialog is not None:
+            self._progressDialog.reset()
+            self._progressDialog.deleteLater()
+            self._progressDialog = None
+
+        self._backgroundWorker = None
+
+    def _cancel_background_work(self):
+
+        if self._backgroundWorker is None:
+            return
+
+        self._backgroundWorker.cancel()
+        self._backgroundWorker.wait()
+
+        # Delivers the queued result (if any) while the sprite it belongs to is still around
+        QCoreApplication.sendPostedEvents()
+
+    # -------------------------------------------------------------------------
+
     def _connect_with_window_actions(self):
 
         self._mainWindow.actionNew.triggered.connect(self.new_sprite)
@@ -349,6 +490,14 @@ class Application(QApplication):
 
                 target.clear()
 
+            elif shortcut_name == 'UNDO':
+
+                target.undo()
+
+            elif shortcut_name == 'REDO':
+
+                target.redo()
+
         # ANIMATION MANAGER
 
         elif holder == 'ANIMATION_MANAGER':
@@ -389,6 +538,10 @@ class Application(QApplication):
 
     def _on_window_close(self):
 
+        self._cancel_background_work()
+
+        self._autosave.stop()
+
         self._settings.write_settings()
 
     def _raise_error(self, source, exception):
@@ -1,82 +1,57 @@
-from io import BytesIO
+# --------------------------------------------------------------------------------------------------
+# Name:        Cropper
+# Purpose:     Trims images down to the area covered by non transparent pixels
+#
+# Created:     17/10/26
+#--------------------------------------------------------------------------------------------------
 
-from PIL import Image, ImageChops, ImageQt
-from PyQt5.QtCore import QBuffer, QIODevice
+import numpy
 
+import helpers.utils as utils
 
-def qimage_to_pil_image(image):
-    buffer = QBuffer()
 
-    buffer.open(QIODevice.ReadWrite)
+def alpha_bounds(pixels):
 
-    image.save(buffer, "PNG")
+    """
+    Smallest (x, y, width, height) rect holding every pixel with some alpha, or None when all
+    pixels are fully transparent. pixels: Height x Width x BGRA array.
+    """
 
-    bytesio = BytesIO()
-    bytesio.write(buffer.data())
+    alpha = pixels[..., 3]
 
-    buffer.close()
+    covered_rows = numpy.flatnonzero(alpha.any(axis=1))
 
-    bytesio.seek(0)
+    if len(covered_rows) == 0:
+        return None
 
-    pil_image = Image.open(bytesio)
+    covered_columns = numpy.flatnonzero(alpha[covered_rows[0]:covered_rows[-1] + 1].any(axis=0))
 
-    return pil_image
+    top = int(covered_rows[0])
+    left = int(covered_columns[0])
 
+    return left, top, int(covered_columns[-1]) + 1 - left, int(covered_rows[-1]) + 1 - top
 
-def _most_popular_edge_color(image):
-    im = image
-    if im.mode != 'RGB':
-        im = image.convert("RGB")
 
-    # Get pixels from the edges of the image:
-    width, height = im.size
-    left = im.crop((0, 1, 1, height - 1))
-    right = im.crop((width - 1, 1, width, height - 1))
-    top = im.crop((0, 0, width, 1))
-    bottom = im.crop((0, height - 1, width, height))
-    pixels = left.tostring() + right.tostring() + top.tostring() + bottom.tostring()
+def trim(pixels):
 
-    # Compute who's the most popular RGB triplet
-    counts = {}
-    for i in range(0, len(pixels), 3):
-        rgb = pixels[i] + pixels[i + 1] + pixels[i + 2]
-        if rgb in counts:
-            counts[rgb] += 1
-        else:
-            counts[rgb] = 1
+    """
+    Returns (trimmed, x, y): a view of the pixels over their alpha bounds, no copy is made, and
+    where it sits within them. Fully transparent pixels trim down to their top left pixel.
+    """
 
-    # Get the colour which is the most popular:
-    most_popular_color = \
-        sorted([(count, rgba) for (rgba, count) in counts.items()], reverse=True)[0][1]
+    bounds = alpha_bounds(pixels)
 
-    return ord(most_popular_color[0]), ord(most_popular_color[1]), ord(most_popular_color[2])
+    if bounds is None:
+        return pixels[:1, :1], 0, 0
 
+    x, y, width, height = bounds
 
-def crop(image, background_color=None):
-    pil_image = qimage_to_pil_image(image)
+    return pixels[y:y + height, x:x + width], x, y
 
-    bbox = None
 
-    # If the image has an alpha (tranparency) layer, we use it to crop the image.
-    # Otherwise, we look at the pixels around the image (top, left, bottom and right)
-    # and use the most used color as the color to crop.
+def crop(image):
 
-    # --- For transparent images -----------------------------------------------
-    if 'A' in pil_image.getbands():  # If the image has a transparency layer, use it.
-        # This works for all modes which have transparency layer
-        bbox = pil_image.split()[list(pil_image.getbands()).index('A')].getbbox()
-    # --- For non-transparent images -------------------------------------------
-    elif pil_image.mode == 'RGB':
-        if not background_color:
-            background_color = _most_popular_edge_color(pil_image)
-        # Crop a non-transparent image.
-        # .getbbox() always crops the black color.
-        # So we need to substract the "background" color from our image.
-        bg = Image.new("RGB", pil_image.size, background_color)
-        diff = ImageChops.difference(pil_image, bg)  # Substract background color from image
-        bbox = diff.getbbox()  # Try to find the real bounding box of the image.
+    # The cropped image is a view over the image's pixels
+    trimmed, _, _ = trim(utils.image_to_pixels(image))
 
-    if bbox:
-        pil_image = pil_image.crop(bbox)
-
-    return ImageQt.ImageQt(pil_image)
+    return utils.pixels_to_image(trimmed)
@@ -8,6 +8,9 @@
 # Copyright:   (c) Rafael 2013
 # Licence:     <your licence>
 #--------------------------------------------------------------------------------------------------
+import math
+
+import numpy
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QPainter
 
@@ -30,33 +33,52 @@ def erase_area_painter_ready(x, y, w, h, painter):
     painter.fillRect(x, y, w, h, Qt.transparent)
 
 
-def draw_line(start, end, size, ink, color, painter):
+def line_stamps(start, end, size):
+
+    # Top left corners of the size x size stamps covering the line, one size step apart along it
     x1 = start.x()
     y1 = start.y()
     x2 = end.x()
     y2 = end.y()
 
-    dx = abs(x2 - x1)
-    dy = abs(y2 - y1)
+    steps = max(math.ceil(abs(x2 - x1) / size), math.ceil(abs(y2 - y1) / size))
+
+    if steps == 0:
+        return numpy.array([x1]), numpy.array([y1])
+
+    progress = numpy.arange(steps + 1) / steps
+
+    xs = x1 + numpy.rint(progress * ((x2 - x1) / size)).astype(numpy.intp) * size
+    ys = y1 + numpy.rint(progress * ((y2 - y1) / size)).astype(numpy.intp) * size
+
+    # The line always ends exactly where it was asked to, even off the size grid
+    xs[-1] = x2
+    ys[-1] = y2
+
+    repeated = numpy.zeros(len(xs), bool)
+    repeated[1:] = (xs[1:] == xs[:-1]) & (ys[1:] == ys[:-1])
+
+    return xs[~repeated], ys[~repeated]
+
+
+def stamps_indices(xs, ys, w, h, width, height, unique=True):
+
+    # Flat indices of the pixels covered by the w x h stamps on a width x height surface. Unique
+    # lists each pixel once however many stamps overlap it, for writes that must not repeat
+    offset_x, offset_y = numpy.meshgrid(numpy.arange(w), numpy.arange(h))
 
-    sx = size if (x1 < x2) else -size
-    sy = size if (y1 < y2) else -size
+    covered_x = (xs[:, None] + offset_x.ravel()).ravel()
+    covered_y = (ys[:, None] + offset_y.ravel()).ravel()
 
-    err = dx - dy
+    inside = (covered_x >= 0) & (covered_x < width) & (covered_y >= 0) & (covered_y < height)
 
-    while True:
+    covered = covered_y[inside] * width + covered_x[inside]
 
-        ink.blit(x1, y1, size, size, color, painter)
+    return numpy.unique(covered) if unique else covered
 
-        if x1 == x2 and y1 == y2:
-            break
 
-        e2 = err * 2
+def draw_line(start, end, size, ink, color, pixels):
 
-        if e2 >= -dy:
-            err -= dy
-            x1 += sx
+    xs, ys = line_stamps(start, end, size)
 
-        if e2 <= dx:
-            err += dx
-            y1 += sy
+    ink.blit_many(xs, ys, size, size, color, pixels)
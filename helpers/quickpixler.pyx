@@ -1,70 +1,204 @@
-import struct
+cimport cython
+from cython.parallel cimport prange
 import numpy as np
 cimport numpy as np
+from libc.stdlib cimport malloc, calloc, realloc, free
+from libc.string cimport memcpy, memset
 
-cdef extern from "math.h":
-
-    double floor(double x)
-
+# Kernels run on raw pixel pointers without the GIL. The cpdef functions below only unpack their
+# arguments, so several surfaces can be processed at once, either from Python threads or through
+# the *Many entry points, which spread a list of surfaces over OpenMP threads.
 
 # -----------------------------------------------------------------------------
 
-cpdef movePixels(object imageData, int w, int h, int shiftX, int shiftY):
-    
-    cdef int length = w * h * 4
+@cython.cdivision(True)
+cdef void _shiftPixels(np.uint32_t* data, np.uint32_t* source, int w, int h,
+                       int shiftX, int shiftY, bint wrap) noexcept nogil:
 
-    cdef np.uint8_t[::1] byteArray = np.frombuffer(imageData, np.uint8).reshape(length)
+    # Writes source moved by (shiftX, shiftY) into data, a whole row segment at a time. Pixels
+    # moved past an edge come back in on the other side when wrapping, and are dropped otherwise,
+    # leaving transparent pixels behind
 
-    cdef np.uint8_t[::1] auxByteArray = np.copy(byteArray)
+    cdef size_t rowBytes = w * sizeof(np.uint32_t)
 
-    cdef Py_ssize_t colorIndex = 0
-    cdef Py_ssize_t colorIndexAux = 0
+    cdef np.uint32_t* row
+    cdef np.uint32_t* sourceRow
 
-    cdef int x = 0
     cdef int y = 0
-    cdef int auxX = 0
-    cdef int auxY = 0
+    cdef int sourceY = 0
+
+    if wrap:
+
+        shiftX %= w
+        shiftY %= h
+
+        if shiftX < 0:
+            shiftX += w
 
-    while x < w:
+        if shiftY < 0:
+            shiftY += h
 
-        auxX = x + shiftX
-        
-        if auxX >= w:
-            auxX -= w
+    while y < h:
 
-        y = 0
+        row = data + <Py_ssize_t>y * w
 
-        while y < h:
+        sourceY = y - shiftY
 
-            auxY = y + shiftY
+        if wrap:
 
-            if auxY >= h:
-                auxY -= h
+            if sourceY < 0:
+                sourceY += h
 
-            colorIndex = (x + y * w)*4
-            colorIndexAux = (auxX + auxY * w)*4
+        elif sourceY < 0 or sourceY >= h or shiftX >= w or shiftX <= -w:
 
-            
-            byteArray[colorIndexAux + 2] = auxByteArray[colorIndex + 2]
-            byteArray[colorIndexAux + 1] = auxByteArray[colorIndex + 1]
-            byteArray[colorIndexAux + 0] = auxByteArray[colorIndex + 0]
-            byteArray[colorIndexAux + 3] = auxByteArray[colorIndex + 3]
+            memset(row, 0, rowBytes)
 
             y += 1
+            continue
 
-        x += 1
+        sourceRow = source + <Py_ssize_t>sourceY * w
 
-# -----------------------------------------------------------------------------
+        if shiftX >= 0:
+
+            memcpy(row + shiftX, sourceRow, (w - shiftX) * sizeof(np.uint32_t))
+
+            if wrap:
+                memcpy(row, sourceRow + w - shiftX, shiftX * sizeof(np.uint32_t))
+            else:
+                memset(row, 0, shiftX * sizeof(np.uint32_t))
+
+        else:
+
+            memcpy(row, sourceRow - shiftX, (w + shiftX) * sizeof(np.uint32_t))
+            memset(row + w + shiftX, 0, -shiftX * sizeof(np.uint32_t))
+
+        y += 1
+
+
+cdef bint _movePixels(np.uint32_t* data, int w, int h, int shiftX, int shiftY,
+                      bint wrap) noexcept nogil:
+
+    cdef size_t byteCount = <size_t>w * h * sizeof(np.uint32_t)
+
+    cdef np.uint32_t* auxData = <np.uint32_t*>malloc(byteCount)
+
+    if auxData == NULL:
+        return False
+
+    memcpy(auxData, data, byteCount)
+
+    _shiftPixels(data, auxData, w, h, shiftX, shiftY, wrap)
 
-cpdef blackWhite(object imageData, int w, int h):
+    free(auxData)
 
-    cdef int length = w * h * 4
+    return True
 
+
+cpdef movePixels(np.uint8_t[:, :, ::1] pixels, int shiftX, int shiftY,
+                 np.uint8_t[:, :, ::1] source=None, bint wrap=True):
+
+    # With a source the pixels become the source moved, which lets a drag keep moving the
+    # untouched pixels it started from, without a copy per step and without losing what a clip
+    # move pushed out. Without one the pixels are moved from a copy of themselves
+
+    cdef int h = pixels.shape[0]
+    cdef int w = pixels.shape[1]
+
+    cdef np.uint32_t* data = <np.uint32_t*>&pixels[0, 0, 0]
+    cdef np.uint32_t* sourceData = NULL
+
+    cdef bint moved = True
+
+    if source is not None:
+
+        if source.shape[0] != h or source.shape[1] != w:
+            raise ValueError('Source size does not match the pixels')
+
+        sourceData = <np.uint32_t*>&source[0, 0, 0]
+
+        if sourceData == data:
+            raise ValueError('Source can not be the pixels themselves')
+
+    with nogil:
+
+        if sourceData != NULL:
+            _shiftPixels(data, sourceData, w, h, shiftX, shiftY, wrap)
+        else:
+            moved = _movePixels(data, w, h, shiftX, shiftY, wrap)
+
+    if not moved:
+        raise MemoryError()
+
+
+cpdef movePixelsMany(list pixelsList, int shiftX, int shiftY, list sourceList=None,
+                     bint wrap=True):
+
+    # movePixels over each surface in the list, sources, when given, pairing up with them
+
+    cdef Py_ssize_t count = len(pixelsList)
     cdef Py_ssize_t i = 0
+    cdef int failures = 0
 
-    cdef unsigned int grayScale = 0
+    cdef np.uint8_t** datas = NULL
+    cdef np.uint8_t** sourceDatas = NULL
+    cdef int* widths = NULL
+    cdef int* heights = NULL
+    cdef int* sourceWidths = NULL
+    cdef int* sourceHeights = NULL
 
-    cdef np.uint8_t[::1] byteArray = np.frombuffer(imageData, np.uint8).reshape(length)
+    if sourceList is not None and len(sourceList) != count:
+        raise ValueError('Source count does not match the pixels')
+
+    if not _gather(pixelsList, &datas, &widths, &heights):
+        raise MemoryError()
+
+    if sourceList is not None:
+
+        try:
+            if not _gather(sourceList, &sourceDatas, &sourceWidths, &sourceHeights):
+                raise MemoryError()
+        except:
+            _release(datas, widths, heights)
+            raise
+
+        while i < count:
+
+            if sourceWidths[i] != widths[i] or sourceHeights[i] != heights[i] or \
+                    sourceDatas[i] == datas[i]:
+                failures += 1
+
+            i += 1
+
+        if failures > 0:
+            _release(datas, widths, heights)
+            _release(sourceDatas, sourceWidths, sourceHeights)
+            raise ValueError('Sources must be apart from the pixels and of their size')
+
+    for i in prange(count, nogil=True, schedule='dynamic'):
+
+        if sourceDatas != NULL:
+            _shiftPixels(<np.uint32_t*>datas[i], <np.uint32_t*>sourceDatas[i], widths[i],
+                         heights[i], shiftX, shiftY, wrap)
+
+        elif not _movePixels(<np.uint32_t*>datas[i], widths[i], heights[i], shiftX, shiftY,
+                             wrap):
+            failures += 1
+
+    _release(datas, widths, heights)
+
+    if sourceDatas != NULL:
+        _release(sourceDatas, sourceWidths, sourceHeights)
+
+    if failures > 0:
+        raise MemoryError()
+
+# -----------------------------------------------------------------------------
+
+cdef void _blackWhite(np.uint8_t* byteArray, Py_ssize_t length) noexcept nogil:
+
+    cdef Py_ssize_t i = 0
+
+    cdef unsigned int grayScale = 0
 
     while i < length:
 
@@ -76,88 +210,328 @@ cpdef blackWhite(object imageData, int w, int h):
 
         i += 4
 
+
+cpdef blackWhite(np.uint8_t[:, :, ::1] pixels):
+
+    cdef Py_ssize_t length = <Py_ssize_t>pixels.shape[0] * pixels.shape[1] * 4
+
+    cdef np.uint8_t* byteArray = &pixels[0, 0, 0]
+
+    with nogil:
+        _blackWhite(byteArray, length)
+
 # -----------------------------------------------------------------------------
 
-cpdef floodFill(object imageData, int x, int y, int w, int h, int r, int g, int b):
-    
-    cdef int length = w*h*4
+cdef inline bint _matches(np.uint32_t pixel, np.uint32_t target, int tolerance) noexcept nogil:
+
+    if tolerance == 0:
+        return pixel == target
+
+    cdef int shift = 0
+    cdef int difference = 0
+
+    while shift < 32:
+
+        difference = <int>((pixel >> shift) & 0xFF) - <int>((target >> shift) & 0xFF)
+
+        if difference > tolerance or difference < -tolerance:
+            return False
+
+        shift += 8
+
+    return True
+
+
+cdef inline bint _fillable(np.uint32_t* data, np.uint8_t* visited, Py_ssize_t index,
+                           np.uint32_t target, int tolerance) noexcept nogil:
+
+    if visited != NULL and visited[index]:
+        return False
 
-    cdef int w4 = w*4
+    return _matches(data[index], target, tolerance)
 
-    cdef np.uint8_t[::1] byteArray = np.frombuffer(imageData, np.uint8).reshape(length)
 
-    cdef Py_ssize_t colorIndex = (x + y * w)*4
+cdef inline bint _push(Py_ssize_t** stack, Py_ssize_t* capacity, Py_ssize_t* count,
+                       Py_ssize_t index) noexcept nogil:
 
-    cdef unsigned int cr = byteArray[colorIndex + 2]
-    cdef unsigned int cg = byteArray[colorIndex + 1]
-    cdef unsigned int cb = byteArray[colorIndex]
-    cdef unsigned int ca = byteArray[colorIndex + 3]
+    cdef Py_ssize_t* grown
 
+    if count[0] == capacity[0]:
 
-    if ca != 0 and r == cr and g == cg and b == cb:
-        return
+        grown = <Py_ssize_t*>realloc(stack[0], capacity[0] * 2 * sizeof(Py_ssize_t))
 
-    cdef list stack = []
+        if grown == NULL:
+            return False
 
+        stack[0] = grown
+        capacity[0] *= 2
+
+    stack[0][count[0]] = index
+    count[0] += 1
+
+    return True
+
+
+@cython.cdivision(True)
+cdef int _floodFill(np.uint32_t* data, int w, int h, int x, int y, np.uint32_t fill,
+                    int tolerance, bint contiguous, bint diagonal, bint write,
+                    int* bounds) noexcept nogil:
+
+    # Returns 1 with the filled (x, y, w, h) in bounds, 0 when nothing changed and -1 when out
+    # of memory. Without write, only finds the bounds and leaves the pixels as they are
+
+    cdef np.uint32_t target = data[x + <Py_ssize_t>y * w]
+
+    cdef Py_ssize_t length = <Py_ssize_t>w * h
+    cdef Py_ssize_t i = 0
+
+    if fill == target and tolerance == 0:
+        return 0
+
+    # Bounds of the filled area, handed back so callers only look at what changed
+    cdef int minX = x
+    cdef int maxX = x
+    cdef int minY = y
+    cdef int maxY = y
+
+    if not contiguous:
+
+        while i < length:
+
+            if _matches(data[i], target, tolerance):
+
+                if write:
+                    data[i] = fill
+
+                minX = min(minX, <int>(i % w))
+                maxX = max(maxX, <int>(i % w))
+                minY = min(minY, <int>(i // w))
+                maxY = max(maxY, <int>(i // w))
+
+            i += 1
+
+        bounds[0] = minX
+        bounds[1] = minY
+        bounds[2] = maxX - minX + 1
+        bounds[3] = maxY - minY + 1
+
+        return 1
+
+    # Pixels already filled may still match within tolerance, and unwritten ones always do, so
+    # visits are tracked apart then. Exact fills need no tracking: a filled pixel never matches
+    # the target again
+    cdef np.uint8_t* visited = NULL
+
+    if tolerance > 0 or not write:
+        visited = <np.uint8_t*>calloc(length, 1)
+
+    cdef Py_ssize_t capacity = 1024
+    cdef Py_ssize_t count = 0
+    cdef Py_ssize_t* stack = <Py_ssize_t*>malloc(capacity * sizeof(Py_ssize_t))
+
+    if ((tolerance > 0 or not write) and visited == NULL) or stack == NULL:
+        free(visited)
+        free(stack)
+        return -1
+
+    cdef Py_ssize_t index = 0
+    cdef Py_ssize_t rowStart = 0
     cdef int left = 0
     cdef int right = 0
+    cdef int spanX = 0
+    cdef int spanEnd = 0
+    cdef int rowY = 0
+    cdef int step = 0
+    cdef bint inSpan = False
+    cdef bint failed = False
+
+    _push(&stack, &capacity, &count, x + <Py_ssize_t>y * w)
+
+    while count > 0 and not failed:
+
+        count -= 1
+        index = stack[count]
+
+        if not _fillable(data, visited, index, target, tolerance):
+            continue
+
+        y = <int>(index // w)
+        rowStart = <Py_ssize_t>y * w
+
+        left = <int>(index - rowStart)
+        right = left
+
+        while left > 0 and _fillable(data, visited, rowStart + left - 1, target, tolerance):
+            left -= 1
+
+        while right < w - 1 and \
+                _fillable(data, visited, rowStart + right + 1, target, tolerance):
+            right += 1
+
+        minX = min(minX, left)
+        maxX = max(maxX, right)
+        minY = min(minY, y)
+        maxY = max(maxY, y)
+
+        spanX = left
+
+        while spanX <= right:
+
+            if write:
+                data[rowStart + spanX] = fill
 
-    cdef int leftBoundary = 0
-    cdef int rightBoundary = 0
+            if visited != NULL:
+                visited[rowStart + spanX] = 1
 
-    stack.append(colorIndex)
+            spanX += 1
 
-    while len(stack) > 0:
+        # Seeds one pixel per run of matching pixels on the rows above and below, reaching one
+        # pixel further to each side for 8 way connectivity
+        spanX = left - 1 if diagonal and left > 0 else left
+        spanEnd = right + 1 if diagonal and right < w - 1 else right
 
-        colorIndex = stack.pop()
-        
-        if byteArray[colorIndex + 2] == cr and byteArray[colorIndex + 1] == cg and byteArray[colorIndex] == cb and byteArray[colorIndex + 3] == ca:
+        step = -1
 
-            left = colorIndex - 4
-            right = colorIndex + 4
+        while step <= 1:
 
-            leftBoundary = <int>(floor(left / w4) * w4)
-            rightBoundary = leftBoundary + w4
+            rowY = y + step
+            step += 2
 
-            if left > 0:
+            if rowY < 0 or rowY >= h:
+                continue
 
-                while left > leftBoundary and byteArray[left + 2] == cr and byteArray[left + 1] == cg and byteArray[left] == cb and byteArray[left + 3] == ca:
+            rowStart = <Py_ssize_t>rowY * w
 
-                    left -= 4
+            inSpan = False
 
-            if right < length:
+            i = spanX
 
-                while right < rightBoundary and byteArray[right + 2] == cr and byteArray[right + 1] == cg and byteArray[right] == cb and byteArray[right + 3] == ca:
-                        
-                    right += 4
+            while i <= spanEnd:
 
-            if byteArray[left + 2] != cr or byteArray[left + 1] != cg or byteArray[left] != cb or byteArray[left + 3] != ca:
+                if _fillable(data, visited, rowStart + i, target, tolerance):
 
-                left += 4
+                    if not inSpan:
 
-            while left < right:
-                
-                byteArray[left + 2] = r
-                byteArray[left + 1] = g
-                byteArray[left] = b
-                byteArray[left + 3] = 255
+                        if not _push(&stack, &capacity, &count, rowStart + i):
+                            failed = True
+                            break
 
-                colorIndex = left - w4
+                        inSpan = True
 
-                if colorIndex >= 0 and byteArray[colorIndex + 2] == cr and byteArray[colorIndex + 1] == cg and byteArray[colorIndex] == cb and byteArray[colorIndex + 3] == ca:
-        
-                    stack.append(colorIndex)
+                else:
 
-                colorIndex = left + w4
+                    inSpan = False
 
-                if colorIndex < length and byteArray[colorIndex + 2] == cr and byteArray[colorIndex + 1] == cg and byteArray[colorIndex] == cb and byteArray[colorIndex + 3] == ca:
+                i += 1
 
-                    stack.append(colorIndex)
+    free(visited)
+    free(stack)
 
-                left += 4
+    if failed:
+        return -1
+
+    bounds[0] = minX
+    bounds[1] = minY
+    bounds[2] = maxX - minX + 1
+    bounds[3] = maxY - minY + 1
+
+    return 1
+
+
+cdef inline np.uint32_t _premultiply(int channel, int alpha) noexcept nogil:
+
+    # Rounded the way QPainter does, as helpers.utils.color_to_pixel, so a fill matches a stroke
+    # of the same color
+    cdef int value = channel * alpha + 128
+
+    return <np.uint32_t>((value + (value >> 8)) >> 8)
+
+
+cdef _fill(np.uint8_t[:, :, ::1] pixels, int x, int y, int r, int g, int b, int a,
+           int tolerance, bint contiguous, bint diagonal, bint write):
+
+    cdef int h = pixels.shape[0]
+    cdef int w = pixels.shape[1]
+
+    if x < 0 or y < 0 or x >= w or y >= h:
+        return None
+
+    # Pixels are premultiplied BGRA in memory, 0xAARRGGBB once read as a 32 bit word
+    cdef np.uint32_t* data = <np.uint32_t*>&pixels[0, 0, 0]
+
+    cdef np.uint32_t fill = (<np.uint32_t>a << 24) | \
+                            (_premultiply(r, a) << 16) | \
+                            (_premultiply(g, a) << 8) | \
+                            _premultiply(b, a)
+
+    cdef int bounds[4]
+    cdef int result
+
+    with nogil:
+        result = _floodFill(data, w, h, x, y, fill, tolerance, contiguous, diagonal, write,
+                            bounds)
+
+    if result < 0:
+        raise MemoryError()
+
+    if result == 0:
+        return None
+
+    return bounds[0], bounds[1], bounds[2], bounds[3]
+
+
+cpdef floodFill(np.uint8_t[:, :, ::1] pixels, int x, int y, int r, int g, int b, int a=255,
+                int tolerance=0, bint contiguous=True, bint diagonal=False):
+
+    return _fill(pixels, x, y, r, g, b, a, tolerance, contiguous, diagonal, True)
+
+
+cpdef fillBounds(np.uint8_t[:, :, ::1] pixels, int x, int y, int r, int g, int b, int a=255,
+                 int tolerance=0, bint contiguous=True, bint diagonal=False):
+
+    # The (x, y, w, h) floodFill would fill, without touching the pixels
+    return _fill(pixels, x, y, r, g, b, a, tolerance, contiguous, diagonal, False)
 
 # -----------------------------------------------------------------------------
 
+cdef bint _gather(list pixelsList, np.uint8_t*** datas, int** widths, int** heights):
+
+    # Pointers and sizes of each pixel array, for use once the GIL is released. The arrays are
+    # kept alive by the list
+    cdef Py_ssize_t count = len(pixelsList)
+    cdef Py_ssize_t i = 0
+    cdef np.uint8_t[:, :, ::1] pixels
+
+    datas[0] = <np.uint8_t**>malloc(max(count, 1) * sizeof(np.uint8_t*))
+    widths[0] = <int*>malloc(max(count, 1) * sizeof(int))
+    heights[0] = <int*>malloc(max(count, 1) * sizeof(int))
+
+    if datas[0] == NULL or widths[0] == NULL or heights[0] == NULL:
+        _release(datas[0], widths[0], heights[0])
+        return False
+
+    try:
+
+        while i < count:
+
+            pixels = pixelsList[i]
+
+            datas[0][i] = &pixels[0, 0, 0]
+            widths[0][i] = pixels.shape[1]
+            heights[0][i] = pixels.shape[0]
+
+            i += 1
+
+    except:
+
+        _release(datas[0], widths[0], heights[0])
+        raise
+
+    return True
 
 
+cdef void _release(np.uint8_t** datas, int* widths, int* heights) noexcept:
 
+    free(datas)
+    free(widths)
+    free(heights)
@@ -1,10 +1,25 @@
+import sys
+
 from setuptools import setup, Extension
 from Cython.Build import cythonize
 import numpy
 
+# The *Many kernels spread surfaces over OpenMP threads, without it they run one after the other
+if sys.platform == 'win32':
+    openmp_compile_args = ['/openmp']
+    openmp_link_args = []
+elif sys.platform == 'darwin':
+    openmp_compile_args = []
+    openmp_link_args = []
+else:
+    openmp_compile_args = ['-fopenmp']
+    openmp_link_args = ['-fopenmp']
+
 ext_modules = [
     Extension("quickpixler", ["quickpixler.pyx"],
-              include_dirs=[numpy.get_include()])
+              include_dirs=[numpy.get_include()],
+              extra_compile_args=openmp_compile_args,
+              extra_link_args=openmp_link_args)
 ]
 
 setup(
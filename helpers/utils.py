@@ -14,6 +14,8 @@ import math
 import random
 import errno
 
+import numpy
+from PyQt5 import sip
 from PyQt5.QtCore import Qt, QDir, QByteArray, QBuffer, QIODevice, QPoint
 from PyQt5.QtGui import QImage, QPainter, QPixmap, QColor
 from PyQt5.QtWidgets import QFileDialog, QMessageBox
@@ -49,12 +51,89 @@ def snap_point(point, increment):
                   round(math.floor(point.y() / increment) * increment))
 
 
+def unite_regions(a, b):
+
+    # Bounds of two (X, Y, Width, Height) regions, None standing for no region at all
+    if a is None:
+        return b
+
+    if b is None:
+        return a
+
+    left = min(a[0], b[0])
+    top = min(a[1], b[1])
+    right = max(a[0] + a[2], b[0] + b[2])
+    bottom = max(a[1] + a[3], b[1] + b[3])
+
+    return left, top, right - left, bottom - top
+
+
 def create_image(width, height):
     new_image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
     new_image.fill(Qt.transparent)
     return new_image
 
 
+def create_pixels(width, height):
+    return numpy.zeros((height, width, 4), numpy.uint8)
+
+
+def pixels_to_image(pixels):
+
+    # The image is a view over the array, which it keeps alive for as long as its wrapper lives.
+    # Rows may be spaced apart, as in a view over part of a larger array
+    height, width = pixels.shape[:2]
+
+    image = QImage(sip.voidptr(pixels.ctypes.data), width, height, pixels.strides[0],
+                   QImage.Format_ARGB32_Premultiplied)
+
+    image.pixels = pixels
+
+    return image
+
+
+def image_to_pixels(image):
+
+    if image.format() != QImage.Format_ARGB32_Premultiplied:
+        image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+
+    width = image.width()
+    height = image.height()
+
+    bits = image.constBits()
+    bits.setsize(image.byteCount())
+
+    rows = numpy.frombuffer(bits, numpy.uint8).reshape(height, image.bytesPerLine())
+
+    return rows[:, :width * 4].reshape(height, width, 4).copy()
+
+
+def color_to_pixel(color):
+
+    # Premultiplied BGRA, rounded the way QPainter does
+    alpha = color.alpha()
+
+    def premultiply(channel):
+        value = channel * alpha + 128
+        return (value + (value >> 8)) >> 8
+
+    return numpy.array([premultiply(color.blue()), premultiply(color.green()),
+                        premultiply(color.red()), alpha], numpy.uint8)
+
+
+def composite_pixels(target, source):
+
+    # Premultiplied Source Over, rounded the way QPainter does
+    inverse_alpha = 255 - source[..., 3:4].astype(numpy.uint16)
+
+    blended = target * inverse_alpha
+    blended += 128
+    blended += blended >> 8
+    blended >>= 8
+
+    numpy.add(source, blended, out=target, casting='unsafe')
+
+
 def load_image(file):
     new_image = QImage(file)
     return new_image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
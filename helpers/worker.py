@@ -0,0 +1,135 @@
+# --------------------------------------------------------------------------------------------------
+# Name:        Worker
+# Purpose:     Runs long operations (saving, exporting) off the GUI thread, reporting progress
+#              and results back through queued signals
+#
+# Created:     17/10/26
+#--------------------------------------------------------------------------------------------------
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+
+class OperationCancelled(Exception):
+    pass
+
+
+class Worker(QThread):
+    """
+    Runs task(progress) on its own thread. The task reports its advance by calling
+    progress(done, total), which raises OperationCancelled once cancel() was requested.
+
+    released is emitted on the owner's thread once the thread is gone, and so the Worker is
+    safe to let go of; connect to it rather than to finished.
+    """
+
+    progressed = pyqtSignal(int, int)
+    succeeded = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    cancelled = pyqtSignal()
+    released = pyqtSignal()
+
+    def __init__(self, task):
+
+        super(Worker, self).__init__()
+
+        self._task = task
+
+        self._cancelRequested = threading.Event()
+
+        self.finished.connect(self._on_finished)
+
+    @property
+    def is_cancel_requested(self):
+        return self._cancelRequested.is_set()
+
+    def cancel(self):
+
+        self._cancelRequested.set()
+
+    def run(self):
+
+        try:
+
+            result = self._task(self._report_progress)
+
+        except OperationCancelled:
+
+            self.cancelled.emit()
+
+        except Exception as e:
+
+            self.failed.emit(e)
+
+        else:
+
+            self.succeeded.emit(result)
+
+    def _on_finished(self):
+
+        # finished is emitted from the thread just before it exits
+        self.wait()
+
+        self.released.emit()
+
+    def _report_progress(self, done, total):
+
+        if self._cancelRequested.is_set():
+            raise OperationCancelled()
+
+        self.progressed.emit(done, total)
+
+
+def run_parallel(task, items, progress=None, max_workers=None, max_in_flight=None):
+
+    """
+    Runs task(item) for every item on a pool of threads, one per core by default, and returns
+    the results in the order of the items. Only max_in_flight items (twice the threads by
+    default) are started ahead of the ones done, which bounds the memory their work holds.
+
+    Progress is reported from the calling thread as progress(done, total), so a Worker's
+    progress can be passed in and cancels the items not yet started.
+    """
+
+    items = list(items)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or max_workers * 2
+
+    results = [None] * len(items)
+
+    with ThreadPoolExecutor(max_workers) as executor:
+
+        # Future -> Index of its item
+        pending = {}
+
+        next_index = 0
+        done_count = 0
+
+        try:
+
+            while done_count < len(items):
+
+                while next_index < len(items) and len(pending) < max_in_flight:
+                    pending[executor.submit(task, items[next_index])] = next_index
+                    next_index += 1
+
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    results[pending.pop(future)] = future.result()
+                    done_count += 1
+
+                if progress is not None:
+                    progress(done_count, len(items))
+
+        finally:
+
+            # Items already running are left to finish, the pool waits for them on exit
+            for future in pending:
+                future.cancel()
+
+    return results
@@ -9,6 +9,67 @@ meta = {
 
 max_texture_size = 4096
 
+# Bytes of clean surface pixels paged in from a sprite file before the least recently used
+# ones are paged back out
+surface_cache_budget = 512 * 1024 * 1024
+
+# Bytes of flattened layers kept for the frames shown on the canvas and the animation preview
+composite_cache_budget = 64 * 1024 * 1024
+
+# Milliseconds between autosave checkpoints
+autosave_interval = 15 * 1000
+
+# Most bytes of compressed tiles written per autosave checkpoint; whatever does not fit is
+# picked up by the following ones
+autosave_write_budget = 2 * 1024 * 1024
+
+# Most bytes of changed pixels copied on the GUI thread per autosave checkpoint, before they
+# are diffed and compressed; well above the write budget since most tiles compress a lot
+autosave_capture_budget = 16 * 1024 * 1024
+
+# Side of the square tiles surfaces are diffed and journaled in
+autosave_tile_size = 64
+
+# Side of the square tiles undo history records edits in
+undo_tile_size = 32
+
+# Undo steps kept in memory, older ones are spilled to a temporary file
+undo_memory_steps = 64
+
+# Bytes of compressed tiles undo history holds in memory before spilling its oldest edits
+undo_memory_budget = 128 * 1024 * 1024
+
+# Bytes of compressed tiles undo history holds overall before dropping its oldest edits
+undo_history_budget = 2 * 1024 * 1024 * 1024
+
+# Milliseconds between the mouse moves a canvas tool gets while active; the moves in between are
+# merged into one, a stroke draws them as a single segment
+canvas_move_interval = 16
+
+# Bytes of pre-scaled frames the animation preview keeps for playback
+playback_cache_budget = 256 * 1024 * 1024
+
+# Bytes of layer and frame thumbnails kept for the frame strip and the layer list
+thumbnail_cache_budget = 32 * 1024 * 1024
+
+# Frames per second animations play and are exported at, for frames without a duration of
+# their own
+default_frame_rate = 16
+
+# Packing engine atlas pages are exported with, one of helpers.packer.PACKERS
+atlas_packer = 'maxrects'
+
+# Empty pixels left between frames on atlas pages
+atlas_padding = 2
+
+# Pixels each frame's edges are repeated out by on atlas pages, so texture filtering doesn't
+# pick up its neighbours
+atlas_extrude = 0
+
+# How exported PNGs are compressed: 'fast' writes quickest (zlib level 1), 'small' writes the
+# smallest files (zlib level 9)
+export_png_compression = 'small'
+
 # SHORTCUTS =========================================================
 
 
@@ -25,7 +86,9 @@ shortcuts = {
         'CLEAR': 'C',
         'TOGGLE_VIEW': 'V',
         'TOGGLE_FIT_IN_VIEW': 'F',
-        'TOGGLE_GRID': 'G'
+        'TOGGLE_GRID': 'G',
+        'UNDO': 'Ctrl+Z',
+        'REDO': 'Ctrl+Y'
     },
 
     'COLORPICKER': {
@@ -0,0 +1,367 @@
+# --------------------------------------------------------------------------------------------------
+# Name:        Atlas
+# Purpose:     Exports every animation of a Sprite to texture atlas pages, with manifests giving
+#              where each frame ended up
+#
+#              Frames are trimmed to their opaque area and packed into as many pages as needed,
+#              frames identical to an earlier one are packed once and share its place.
+#              Each page is written as a PNG with a JSON manifest (TexturePacker's JSON Hash,
+#              read by Phaser, PixiJS and most engines) and an XML one (Starling / Sparrow
+#              TextureAtlas).
+#
+# Created:     17/10/26
+#--------------------------------------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import xml.etree.ElementTree as ElementTree
+
+import numpy
+
+import helpers.cropper as cropper
+import helpers.utils as utils
+from helpers.packer import PACKERS
+from helpers.worker import run_parallel
+import model.appdata as appdata
+
+
+class AtlasFrame(object):
+    """
+    A frame trimmed to its opaque area, ready to be packed. trim_x and trim_y are where the
+    trimmed pixels sit within the untrimmed source_width x source_height frame.
+    """
+
+    def __init__(self, name, animation_name, index, duration, pixels, trim_x, trim_y,
+                 source_width, source_height):
+
+        self.name = name
+        self.animation_name = animation_name
+        self.index = index
+        self.duration = duration
+        self.pixels = pixels
+        self.trim_x = trim_x
+        self.trim_y = trim_y
+        self.source_width = source_width
+        self.source_height = source_height
+
+        # Hash of the trimmed pixels and their size, frames with the same one are identical
+        digest = hashlib.blake2b(self.pixels.tobytes(), digest_size=16)
+        digest.update(numpy.array(self.pixels.shape, numpy.int64).tobytes())
+
+        self.digest = digest.digest()
+
+        # Earlier identical frame this one shares its place on the atlas with
+        self.alias_of = None
+
+        # Set once packed
+        self.page = None
+        self.placement = None
+
+    @property
+    def width(self):
+        return self.pixels.shape[1]
+
+    @property
+    def height(self):
+        return self.pixels.shape[0]
+
+    @property
+    def is_trimmed(self):
+        return self.width != self.source_width or self.height != self.source_height
+
+
+class AtlasPage(object):
+    def __init__(self, packer):
+
+        self.packer = packer
+        self.frames = []
+
+    @property
+    def width(self):
+        return self.packer.actual_packing_area_width()
+
+    @property
+    def height(self):
+        return self.packer.actual_packing_area_height()
+
+
+def export_atlas(sprite, directory, name='atlas', progress=None):
+
+    """
+    Writes every animation of a Sprite (or SpriteSnapshot) to atlas pages in the directory,
+    named name.png, name.json and name.xml, or name-0.png, name-1.png... when frames take more
+    than one page. Packing is set up by the atlas_* values in appdata.
+
+    A Sprite is snapshotted on the calling thread first, which must then be the one it is
+    edited from.
+    """
+
+    # Pool threads only ever read frozen pixels, never the Sprite's caches
+    sprite = sprite.snapshot()
+
+    jobs = [(animation_name, index, frame)
+            for animation, animation_name in zip(sprite.animations,
+                                                 _animation_names(sprite.animations))
+            for index, frame in enumerate(animation.frames)]
+
+    # Frames are flattened and trimmed on a pool of threads
+    frames = run_parallel(lambda job: _trim_frame(sprite, *job), jobs, progress)
+
+    _find_duplicates(frames)
+
+    pages = _pack(frames)
+
+    file_names = _page_file_names(name, len(pages))
+
+    for page, file_name in zip(pages, file_names):
+
+        image = utils.pixels_to_image(_compose_page(page))
+
+        if not image.save(os.path.join(directory, file_name + '.png'), 'PNG'):
+            raise IOError("Can't write atlas page {0}.png".format(file_name))
+
+        related_pages = [other_file_name + '.json' for other_file_name in file_names
+                         if other_file_name != file_name]
+
+        with open(os.path.join(directory, file_name + '.json'), 'w') as manifest_file:
+            json.dump(_json_manifest(page, file_name + '.png', related_pages), manifest_file,
+                      indent=2)
+
+        _xml_manifest(page, file_name + '.png').write(os.path.join(directory, file_name + '.xml'),
+                                                      encoding='utf-8', xml_declaration=True)
+
+    return pages
+
+
+# -------------------------------------------------------------------------------------------------
+
+
+def _animation_names(animations):
+
+    # Animations sharing a name are told apart by their position in the sprite, so neither their
+    # frames nor their entries in the manifests collide
+    names = [animation.name for animation in animations]
+
+    repeated = set(name for name in names if names.count(name) > 1)
+    taken = set(names)
+
+    for position, name in enumerate(names):
+
+        if name not in repeated:
+            continue
+
+        unique_name = '{0}_{1}'.format(name, position)
+
+        while unique_name in taken:
+            unique_name += '_{0}'.format(position)
+
+        taken.add(unique_name)
+
+        names[position] = unique_name
+
+    return names
+
+
+def _trim_frame(sprite, animation_name, index, frame):
+
+    # Fully transparent frames are kept as a single pixel. The trimmed pixels are copied so the
+    # whole frame isn't kept around until packed
+    pixels, trim_x, trim_y = cropper.trim(frame.flatten_pixels())
+
+    pixels = pixels.copy()
+
+    duration = frame.duration if frame.duration is not None else \
+        1000.0 / appdata.default_frame_rate
+
+    return AtlasFrame('{0}_{1:04d}'.format(animation_name, index), animation_name, index,
+                      int(round(duration)), pixels, trim_x, trim_y, sprite.width, sprite.height)
+
+
+def _find_duplicates(frames):
+
+    # Digest -> Frames first seen with it
+    originals = {}
+
+    for frame in frames:
+
+        candidates = originals.setdefault(frame.digest, [])
+
+        # Pixels are still compared, hashes only narrow down what to compare against
+        frame.alias_of = next((original for original in candidates
+                               if numpy.array_equal(original.pixels, frame.pixels)), None)
+
+        if frame.alias_of is None:
+            candidates.append(frame)
+
+
+def _pack(frames):
+
+    packer_class = PACKERS[appdata.atlas_packer]
+
+    def new_page():
+        return AtlasPage(packer_class(appdata.max_texture_size, appdata.max_texture_size,
+                                      padding=appdata.atlas_padding,
+                                      extrude=appdata.atlas_extrude))
+
+    pages = []
+
+    packed_frames = [frame for frame in frames if frame.alias_of is None]
+
+    # Packs tighter placing larger frames first
+    for frame in sorted(packed_frames, key=lambda f: max(f.width, f.height), reverse=True):
+
+        # Smaller frames may still fit in the gaps of pages already full for larger ones
+        for page_index, page in enumerate(pages):
+
+            placement = page.packer.pack(frame.width, frame.height)
+
+            if placement is not None:
+                break
+
+        else:
+
+            pages.append(new_page())
+
+            page_index = len(pages) - 1
+            page = pages[page_index]
+
+            placement = page.packer.pack(frame.width, frame.height)
+
+            if placement is None:
+                raise Exception("Frame {0} doesn't fit in a {1}x{1} atlas page.".format(
+                    frame.name, appdata.max_texture_size))
+
+        frame.page = page_index
+        frame.placement = placement
+
+        page.frames.append(frame)
+
+    # Duplicates are listed where the frame they repeat was packed
+    for frame in frames:
+
+        if frame.alias_of is not None:
+
+            frame.page = frame.alias_of.page
+            frame.placement = frame.alias_of.placement
+
+            pages[frame.page].frames.append(frame)
+
+    # Frames listed back in animation order
+    order = {frame: position for position, frame in enumerate(frames)}
+
+    for page in pages:
+        page.frames.sort(key=order.get)
+
+    return pages
+
+
+def _compose_page(page):
+
+    page_pixels = utils.create_pixels(page.width, page.height)
+
+    extrude = appdata.atlas_extrude
+
+    # Frames never overlap, so they are copied in rather than blended
+    for frame in page.frames:
+
+        if frame.alias_of is not None:
+            continue
+
+        x = frame.placement.x
+        y = frame.placement.y
+
+        if extrude > 0:
+
+            # Edge pixels repeated around the frame keep filtering from bleeding in neighbours
+            page_pixels[y - extrude:y + frame.height + extrude,
+                        x - extrude:x + frame.width + extrude] = \
+                numpy.pad(frame.pixels, ((extrude, extrude), (extrude, extrude), (0, 0)), 'edge')
+
+        else:
+
+            page_pixels[y:y + frame.height, x:x + frame.width] = frame.pixels
+
+    return page_pixels
+
+
+def _page_file_names(name, page_count):
+
+    if page_count == 1:
+        return [name]
+
+    return ['{0}-{1}'.format(name, page) for page in range(page_count)]
+
+
+def _animation_frames(page):
+
+    # Animation Name -> Names of its frames on the page, in order
+    animations = {}
+
+    for frame in page.frames:
+        animations.setdefault(frame.animation_name, []).append(frame.name)
+
+    return animations
+
+
+def _json_manifest(page, image_file_name, related_pages):
+
+    frames = {}
+
+    for frame in page.frames:
+
+        frames[frame.name] = {
+            'frame': {'x': frame.placement.x, 'y': frame.placement.y,
+                      'w': frame.width, 'h': frame.height},
+            'rotated': False,
+            'trimmed': frame.is_trimmed,
+            'spriteSourceSize': {'x': frame.trim_x, 'y': frame.trim_y,
+                                 'w': frame.width, 'h': frame.height},
+            'sourceSize': {'w': frame.source_width, 'h': frame.source_height},
+            'duration': frame.duration
+        }
+
+    meta = {
+        'app': 'pxeel',
+        'version': appdata.meta['VERSION'],
+        'image': image_file_name,
+        'format': 'RGBA8888',
+        'size': {'w': page.width, 'h': page.height},
+        'scale': '1'
+    }
+
+    if len(related_pages) > 0:
+        meta['related_multi_packs'] = related_pages
+
+    return {
+        'frames': frames,
+        'animations': _animation_frames(page),
+        'meta': meta
+    }
+
+
+def _xml_manifest(page, image_file_name):
+
+    atlas = ElementTree.Element('TextureAtlas', imagePath=image_file_name)
+
+    for frame in page.frames:
+
+        sub_texture = ElementTree.SubElement(atlas, 'SubTexture')
+
+        sub_texture.set('name', frame.name)
+        sub_texture.set('x', str(frame.placement.x))
+        sub_texture.set('y', str(frame.placement.y))
+        sub_texture.set('width', str(frame.width))
+        sub_texture.set('height', str(frame.height))
+
+        # Starling places trimmed frames by how far the source frame reaches past them
+        if frame.is_trimmed:
+            sub_texture.set('frameX', str(-frame.trim_x))
+            sub_texture.set('frameY', str(-frame.trim_y))
+            sub_texture.set('frameWidth', str(frame.source_width))
+            sub_texture.set('frameHeight', str(frame.source_height))
+
+        sub_texture.set('animation', frame.animation_name)
+        sub_texture.set('duration', str(frame.duration))
+
+    return ElementTree.ElementTree(atlas)
@@ -0,0 +1,1013 @@
+# --------------------------------------------------------------------------------------------------
+# Name:             Autosave
+# Purpose:          Crash recovery journal for the Sprite being edited.
+#
+#                   Layout:
+#
+#                   [Header][Record 0][Record 1]...[Record N]
+#
+#                   Every Record carries a checksum of its payload. A Base record names the sprite
+#                   file the journal builds on, Structure records hold the Animation / Frame /
+#                   Surface tree, Tiles records hold the pixels of surface tiles that differ from
+#                   what was journaled (or saved) before, and a Commit record closes each
+#                   checkpoint. On recovery only whole checkpoints are replayed, so a crash in the
+#                   middle of writing one loses that checkpoint alone.
+#
+# Date:             17/10/26
+# License:
+# --------------------------------------------------------------------------------------------------
+
+import json
+import logging
+import os
+import struct
+import uuid
+import zlib
+
+import numpy
+from PyQt5.QtCore import QObject, QTimer, QThread, QLockFile, QStandardPaths, QCoreApplication
+
+import helpers.utils as utils
+import model.appdata as appdata
+from helpers.worker import Worker
+from model.sprite import Sprite, Surface
+from model.sprite_file import SpriteFile
+
+JOURNAL_MAGIC = b'PXEELJNL'
+
+JOURNAL_VERSION = 1
+
+JOURNAL_EXTENSION = '.pxj'
+
+# Appended to journals that failed to recover, kept for the user to retrieve by hand
+UNRECOVERED_EXTENSION = '.unrecovered'
+
+# Journals are rewritten with only the latest tiles once superseded ones take more room
+COMPACTION_RATIO = 2.0
+COMPACTION_MIN_SIZE = 4 * 1024 * 1024
+
+# Magic, Version
+_HEADER = struct.Struct('<8sI')
+
+# Type, Payload Length, Payload CRC
+_RECORD = struct.Struct('<BII')
+
+# Surface Key, Tile Count
+_TILES = struct.Struct('<II')
+
+# X, Y, Width, Height, Data Length
+_TILE = struct.Struct('<IIIII')
+
+_RECORD_BASE = 1
+_RECORD_STRUCTURE = 2
+_RECORD_TILES = 3
+_RECORD_COMMIT = 4
+
+
+class JournalError(Exception):
+    pass
+
+
+def journal_directory():
+
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppLocalDataLocation),
+                        'autosave')
+
+
+def find_orphaned_journals():
+
+    """
+    Returns the journals left behind by sessions that did not close properly, newest first.
+    Journals of sessions still running are held locked by them and are left out.
+    """
+
+    directory = journal_directory()
+
+    if not os.path.isdir(directory):
+        return []
+
+    journals = []
+
+    for file_name in os.listdir(directory):
+
+        if not file_name.endswith(JOURNAL_EXTENSION):
+            continue
+
+        journal_path = os.path.join(directory, file_name)
+
+        lock = QLockFile(journal_path + '.lock')
+
+        if lock.tryLock(0):
+            lock.unlock()
+            journals.append(journal_path)
+
+    journals.sort(key=os.path.getmtime, reverse=True)
+
+    return journals
+
+
+def remove_journal(journal_path):
+
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+
+
+def set_journal_aside(journal_path):
+
+    """
+    Renames a journal that could not be recovered so it is no longer offered, and returns where
+    it now is. The journal stays where it was if it can't be renamed.
+    """
+
+    kept_path = journal_path + UNRECOVERED_EXTENSION
+
+    try:
+        os.replace(journal_path, kept_path)
+    except OSError as e:
+        logging.error('[autosave] {0}'.format(e))
+        return journal_path
+
+    return kept_path
+
+
+def _tiles(width, height):
+
+    tile_size = appdata.autosave_tile_size
+
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            yield x, y, min(tile_size, width - x), min(tile_size, height - y)
+
+
+def _base_stamp(sprite_file):
+
+    if sprite_file is None:
+        return None
+
+    stat = os.stat(sprite_file.file_path)
+
+    return {'file_path': sprite_file.file_path, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+class _JournaledSurface(object):
+    def __init__(self, width, height, base):
+
+        self.width = width
+        self.height = height
+        self.base = base
+
+        # (X, Y) -> CRC of the tile as last journaled, filled from the base on first use
+        self.hashes = None
+
+        # (X, Y) -> (Data Offset, Width, Height, Data Length) of the latest journaled tile
+        self.tiles = {}
+
+    @property
+    def signature(self):
+        return self.width, self.height, self.base
+
+
+class _CapturedSurface(object):
+    """
+    Copy of the tiles of a Surface within the region that changed since it was last journaled,
+    as many whole rows of tiles as budget bytes have room for, and at least one. The rows left
+    out are the remaining region.
+    """
+
+    def __init__(self, surface, region, budget):
+
+        tile_size = appdata.autosave_tile_size
+
+        x, y, width, height = region
+
+        left = x // tile_size * tile_size
+        top = y // tile_size * tile_size
+        right = min(surface.width, utils.snap_ceil(x + width, tile_size))
+        bottom = min(surface.height, utils.snap_ceil(y + height, tile_size))
+
+        rows = max(1, budget // ((right - left) * tile_size * 4))
+        split = min(bottom, top + rows * tile_size)
+
+        self.width = surface.width
+        self.height = surface.height
+        self.version = surface.version
+
+        self.left = left
+        self.top = top
+        self.pixels = surface.const_pixels[top:split, left:right].copy()
+
+        self.remaining = (left, split, right - left, bottom - split) if split < bottom else None
+
+    @property
+    def byte_count(self):
+        return self.pixels.nbytes
+
+
+class AutosaveJournal(object):
+    """
+    Writes checkpoints of a Sprite to a journal file. Meant to be driven from a single worker
+    thread at a time; the Sprite itself is only ever seen through snapshots.
+    """
+
+    def __init__(self, file_path):
+
+        self._filePath = file_path
+        self._file = None
+        self._position = 0
+
+        self._baseFile = None
+        self._base = None
+        self._structure = None
+
+        # Surface Key -> _JournaledSurface
+        self._surfaces = {}
+
+        self._liveSize = 0
+
+    @property
+    def file_path(self):
+        return self._filePath
+
+    def begin(self, base_file, structure):
+
+        """
+        Starts the journal over on top of base_file, the sprite file as it was last saved.
+        """
+
+        self.close()
+
+        self._file = open(self._filePath, 'wb')
+        self._file.write(_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION))
+        self._position = _HEADER.size
+
+        self._baseFile = base_file
+        self._base = _base_stamp(base_file)
+        self._structure = None
+        self._surfaces = {}
+        self._liveSize = 0
+
+        self._write_record(_RECORD_BASE, json.dumps(self._base).encode('utf-8'))
+
+        self._set_structure(structure)
+
+        self._commit()
+
+    def append(self, structure, surfaces, budget):
+
+        """
+        Journals a checkpoint: the structure, if it changed, and the tiles of the given
+        (Key, _CapturedSurface) pairs that changed since they were last journaled, compressed
+        bytes of tiles being capped at budget. Returns Key -> Version for the surfaces that
+        were journaled completely; the rest are picked up again on the next checkpoint.
+        """
+
+        if self._file is None:
+            raise JournalError('Journal was not started')
+
+        if structure != self._structure:
+            self._set_structure(structure)
+
+        journaled = {}
+
+        remaining_budget = budget
+
+        for key, captured in surfaces:
+
+            if remaining_budget <= 0:
+                break
+
+            state = self._surfaces.get(key)
+
+            if state is None or state.signature[:2] != (captured.width, captured.height):
+                continue
+
+            tiles, complete, used_budget = self._changed_tiles(state, captured, remaining_budget)
+
+            if len(tiles) > 0:
+                self._write_tiles(key, state, tiles)
+
+            remaining_budget -= used_budget
+
+            if complete:
+                journaled[key] = captured.version
+
+        self._commit()
+
+        if self._needs_compaction():
+            self._compact()
+
+        return journaled
+
+    def close(self):
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+
+        self.close()
+
+        remove_journal(self._filePath)
+
+    # ---------------------------------------------------------------------------------------------
+
+    def _set_structure(self, structure):
+
+        self._structure = structure
+
+        self._write_record(_RECORD_STRUCTURE, json.dumps(structure).encode('utf-8'))
+
+        surfaces = {}
+
+        for entry in _surface_entries(structure):
+
+            key = entry['key']
+            base = tuple(entry['base']) if entry['base'] is not None else None
+
+            state = self._surfaces.get(key)
+
+            # Resized surfaces, or ones no longer backed by the base, start over from scratch
+            if state is None or state.signature != (entry['width'], entry['height'], base):
+                state = _JournaledSurface(entry['width'], entry['height'], base)
+
+            surfaces[key] = state
+
+        self._surfaces = surfaces
+
+        self._liveSize = sum(length for state in surfaces.values()
+                             for _, _, _, length in state.tiles.values())
+
+    def _changed_tiles(self, state, captured, budget):
+
+        if state.hashes is None:
+            state.hashes = self._base_hashes(state)
+
+        captured_height, captured_width = captured.pixels.shape[:2]
+
+        pixels = captured.pixels.reshape(captured_height, captured_width * 4)
+
+        tiles = []
+        used_budget = 0
+
+        # Captured pixels start on a tile and end on one or on the edge of the surface, so
+        # their tiles are the surface's
+        for left, top, width, height in _tiles(captured_width, captured_height):
+
+            data = pixels[top:top + height, left * 4:(left + width) * 4].tobytes()
+
+            x = captured.left + left
+            y = captured.top + top
+
+            crc = zlib.crc32(data)
+
+            if crc == state.hashes[(x, y)]:
+                continue
+
+            if used_budget >= budget:
+                return tiles, False, used_budget
+
+            compressed = zlib.compress(data, 1)
+
+            tiles.append((x, y, width, height, crc, compressed))
+
+            used_budget += len(compressed)
+
+        return tiles, True, used_budget
+
+    def _base_hashes(self, state):
+
+        if state.base is not None:
+
+            offset, length = state.base
+
+            pixels = numpy.frombuffer(self._baseFile.read_chunk(offset, length), numpy.uint8)
+            pixels = pixels.reshape(state.height, state.width * 4)
+
+        else:
+
+            pixels = numpy.zeros((state.height, state.width * 4), numpy.uint8)
+
+        hashes = {}
+
+        for x, y, width, height in _tiles(state.width, state.height):
+            hashes[(x, y)] = zlib.crc32(pixels[y:y + height, x * 4:(x + width) * 4].tobytes())
+
+        return hashes
+
+    def _write_tiles(self, key, state, tiles):
+
+        payload = [_TILES.pack(key, len(tiles))]
+
+        # Data offsets are relative to the payload until the record lands in the file
+        data_offsets = []
+        payload_length = _TILES.size
+
+        for x, y, width, height, _, data in tiles:
+
+            payload.append(_TILE.pack(x, y, width, height, len(data)))
+            payload.append(data)
+
+            data_offsets.append(payload_length + _TILE.size)
+            payload_length += _TILE.size + len(data)
+
+        payload_offset = self._write_record(_RECORD_TILES, b''.join(payload))
+
+        for (x, y, width, height, crc, data), data_offset in zip(tiles, data_offsets):
+
+            previous = state.tiles.get((x, y))
+
+            if previous is not None:
+                self._liveSize -= previous[3]
+
+            state.tiles[(x, y)] = (payload_offset + data_offset, width, height, len(data))
+            state.hashes[(x, y)] = crc
+
+            self._liveSize += len(data)
+
+    def _write_record(self, record_type, payload):
+
+        self._file.write(_RECORD.pack(record_type, len(payload), zlib.crc32(payload)))
+        self._file.write(payload)
+
+        payload_offset = self._position + _RECORD.size
+
+        self._position = payload_offset + len(payload)
+
+        return payload_offset
+
+    def _commit(self):
+
+        self._write_record(_RECORD_COMMIT, b'')
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _needs_compaction(self):
+
+        return self._position >= COMPACTION_MIN_SIZE and \
+            self._position > self._liveSize * COMPACTION_RATIO
+
+    def _compact(self):
+
+        temp_path = self._filePath + '.tmp'
+
+        compacted = AutosaveJournal(temp_path)
+
+        try:
+
+            with open(self._filePath, 'rb') as source:
+
+                compacted._file = open(temp_path, 'wb')
+                compacted._file.write(_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION))
+                compacted._position = _HEADER.size
+
+                compacted._write_record(_RECORD_BASE, json.dumps(self._base).encode('utf-8'))
+                compacted._write_record(_RECORD_STRUCTURE,
+                                        json.dumps(self._structure).encode('utf-8'))
+
+                for key, state in self._surfaces.items():
+
+                    compacted_state = _JournaledSurface(state.width, state.height, state.base)
+                    compacted_state.hashes = state.hashes
+
+                    tiles = []
+
+                    for (x, y), (data_offset, width, height, length) in state.tiles.items():
+
+                        source.seek(data_offset)
+
+                        tiles.append((x, y, width, height, state.hashes[(x, y)],
+                                      source.read(length)))
+
+                    if len(tiles) > 0:
+                        compacted._write_tiles(key, compacted_state, tiles)
+
+                    compacted._surfaces[key] = compacted_state
+
+                compacted._commit()
+                compacted.close()
+
+            self.close()
+
+            os.replace(temp_path, self._filePath)
+
+        except Exception:
+
+            compacted.close()
+            remove_journal(temp_path)
+
+            if self._file is None:
+                self._file = open(self._filePath, 'ab')
+
+            raise
+
+        self._file = open(self._filePath, 'ab')
+        self._position = compacted._position
+        self._surfaces = compacted._surfaces
+        self._liveSize = compacted._liveSize
+
+    # ----- RECOVERY ------------------------------------------------------------------------------
+    # ---------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def recover(journal_path):
+
+        """
+        Rebuilds the Sprite as of the last complete checkpoint of a journal. Surfaces that were
+        never touched since the base file was saved keep being paged in from it.
+        """
+
+        base_file = None
+        structure = None
+
+        # Surface Key -> Pixels and (Width, Height, Base) they were laid out for
+        pixels = {}
+        signatures = {}
+
+        try:
+
+            for record_type, payload in _read_checkpoints(journal_path):
+
+                if record_type == _RECORD_BASE:
+
+                    if base_file is not None:
+                        base_file.close()
+
+                    base_file = _open_base(json.loads(payload.decode('utf-8')))
+
+                    pixels.clear()
+                    signatures.clear()
+
+                elif record_type == _RECORD_STRUCTURE:
+
+                    structure = json.loads(payload.decode('utf-8'))
+
+                    for entry in _surface_entries(structure):
+
+                        key = entry['key']
+                        signature = (entry['width'], entry['height'],
+                                     tuple(entry['base']) if entry['base'] is not None else None)
+
+                        if signatures.get(key) != signature:
+                            signatures[key] = signature
+                            pixels.pop(key, None)
+
+                elif record_type == _RECORD_TILES:
+
+                    key, tile_count = _TILES.unpack_from(payload, 0)
+
+                    if key not in pixels:
+                        pixels[key] = _base_pixels(base_file, *signatures[key])
+
+                    target = pixels[key]
+
+                    position = _TILES.size
+
+                    for _ in range(tile_count):
+
+                        x, y, width, height, length = _TILE.unpack_from(payload, position)
+                        position += _TILE.size
+
+                        data = zlib.decompress(payload[position:position + length])
+                        position += length
+
+                        target[y:y + height, x * 4:(x + width) * 4] = \
+                            numpy.frombuffer(data, numpy.uint8).reshape(height, width * 4)
+
+            if structure is None:
+                raise JournalError('Journal holds no complete checkpoint')
+
+            def create_surface(entry):
+
+                key = entry['key']
+
+                if key in pixels:
+
+                    surface = Surface(entry['name'], entry['width'], entry['height'])
+                    surface.pixels[:] = pixels[key].reshape(entry['height'], entry['width'], 4)
+                    surface.mark_dirty()
+
+                    return surface
+
+                if entry['base'] is not None:
+
+                    return Surface(entry['name'], entry['width'], entry['height'],
+                                   backing=(base_file,) + tuple(entry['base']))
+
+                return Surface(entry['name'], entry['width'], entry['height'])
+
+            sprite = Sprite.from_index(structure, create_surface, base_file)
+
+        except Exception:
+
+            if base_file is not None:
+                base_file.close()
+
+            raise
+
+        sprite.file_path = structure['file_path']
+
+        return sprite
+
+
+def _surface_entries(structure):
+
+    for animation in structure['animations']:
+        for frame in animation['frames']:
+            for entry in frame['surfaces']:
+                yield entry
+
+
+def _read_checkpoints(journal_path):
+
+    with open(journal_path, 'rb') as f:
+
+        header = f.read(_HEADER.size)
+
+        if len(header) != _HEADER.size:
+            raise JournalError('Invalid journal header')
+
+        magic, version = _HEADER.unpack(header)
+
+        if magic != JOURNAL_MAGIC:
+            raise JournalError('Not an autosave journal')
+
+        if version > JOURNAL_VERSION:
+            raise JournalError('Unsupported journal version: {0}'.format(version))
+
+        checkpoint = []
+
+        while True:
+
+            record_header = f.read(_RECORD.size)
+
+            if len(record_header) != _RECORD.size:
+                break
+
+            record_type, length, crc = _RECORD.unpack(record_header)
+
+            payload = f.read(length)
+
+            # A torn record ends the journal, along with the checkpoint it belonged to
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                break
+
+            if record_type == _RECORD_COMMIT:
+
+                for record in checkpoint:
+                    yield record
+
+                checkpoint = []
+
+            else:
+
+                checkpoint.append((record_type, payload))
+
+
+def _open_base(stamp):
+
+    if stamp is None:
+        return None
+
+    if not os.path.exists(stamp['file_path']):
+        raise JournalError('Sprite file {0} no longer exists'.format(stamp['file_path']))
+
+    stat = os.stat(stamp['file_path'])
+
+    if stat.st_size != stamp['size'] or stat.st_mtime_ns != stamp['mtime']:
+        raise JournalError('Sprite file {0} was saved again since'.format(stamp['file_path']))
+
+    return SpriteFile(stamp['file_path'])
+
+
+def _base_pixels(base_file, width, height, base):
+
+    if base is not None:
+
+        offset, length = base
+
+        return numpy.frombuffer(base_file.read_chunk(offset, length), numpy.uint8) \
+            .reshape(height, width * 4).copy()
+
+    return numpy.zeros((height, width * 4), numpy.uint8)
+
+
+class Autosave(QObject):
+    """
+    Checkpoints the current Sprite to its journal every appdata.autosave_interval milliseconds,
+    on a worker thread. Checkpoints are skipped while is_busy() says the user is painting, and
+    each one copies the tiles that changed, at most appdata.autosave_capture_budget bytes of
+    them, then writes at most appdata.autosave_write_budget bytes.
+    """
+
+    def __init__(self, is_busy):
+
+        super(Autosave, self).__init__()
+
+        self._isBusy = is_busy
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(appdata.autosave_interval)
+        self._timer.timeout.connect(self._on_timer_tick)
+
+        self._sprite = None
+        self._journal = None
+        self._lock = None
+        self._worker = None
+        self._needsBegin = False
+
+        # id(Surface) -> Key, Key -> Surface. Surfaces are held on to so ids stay unique
+        self._keys = {}
+        self._surfaces = {}
+        self._nextKey = 0
+
+        # Key -> Chunk the Surface was saved to in the base file
+        self._bases = {}
+
+        # Key -> Surface Version as of the last checkpoint
+        self._journaledVersions = {}
+
+        # Key -> (X, Y, Width, Height) bounds of the changes not journaled yet, None if there
+        # are none. Surfaces missing here are journaled whole
+        self._pendingRegions = {}
+
+        self._lastStructure = None
+
+    def start(self, sprite):
+
+        self.stop()
+
+        directory = journal_directory()
+
+        os.makedirs(directory, exist_ok=True)
+
+        journal_path = os.path.join(directory, uuid.uuid4().hex + JOURNAL_EXTENSION)
+
+        self._lock = QLockFile(journal_path + '.lock')
+
+        if not self._lock.tryLock(0):
+            self._lock = None
+            logging.error('[autosave] Could not lock journal {0}'.format(journal_path))
+            return
+
+        self._journal = AutosaveJournal(journal_path)
+        self._sprite = sprite
+
+        self.reset()
+
+        self._timer.start()
+
+    def stop(self):
+
+        self._timer.stop()
+
+        self.wait()
+
+        if self._journal is not None:
+            self._journal.remove()
+            self._journal = None
+
+        if self._lock is not None:
+            self._lock.unlock()
+            self._lock = None
+
+        self._sprite = None
+        self._keys.clear()
+        self._surfaces.clear()
+        self._bases.clear()
+        self._journaledVersions.clear()
+        self._pendingRegions.clear()
+        self._lastStructure = None
+
+    def wait(self):
+
+        if self._worker is None:
+            return
+
+        self._worker.wait()
+
+        # Delivers the result of the checkpoint before anything else touches the journal
+        QCoreApplication.sendPostedEvents()
+
+    def reset(self):
+
+        """
+        Makes the sprite file, as just saved, the new base of the journal.
+        """
+
+        self.wait()
+
+        if self._sprite is None:
+            return
+
+        sprite_file = self._sprite.sprite_file
+
+        self._bases.clear()
+        self._journaledVersions.clear()
+        self._pendingRegions.clear()
+
+        for surface in self._all_surfaces():
+
+            key = self._key_for(surface)
+
+            if sprite_file is not None and surface.is_saved_in(sprite_file):
+
+                self._bases[key] = list(surface.chunk)
+                self._journaledVersions[key] = surface.version
+
+                # Nothing left to journal on top of the base
+                surface.take_changed_region()
+                self._pendingRegions[key] = None
+
+        self._lastStructure = None
+        self._needsBegin = True
+
+    # ---------------------------------------------------------------------------------------------
+
+    def _on_timer_tick(self):
+
+        if self._worker is not None or self._sprite is None or self._isBusy():
+            return
+
+        structure, captures = self._capture()
+
+        if not self._needsBegin and structure == self._lastStructure and len(captures) == 0:
+            return
+
+        journal = self._journal
+        base_file = self._sprite.sprite_file if self._needsBegin else None
+        needs_begin = self._needsBegin
+
+        budget = appdata.autosave_write_budget
+
+        def checkpoint(_):
+
+            if needs_begin:
+                journal.begin(base_file, structure)
+
+            return journal.append(structure, captures, budget)
+
+        remaining = {key: captured.remaining for key, captured in captures}
+
+        worker = Worker(checkpoint)
+
+        worker.succeeded.connect(lambda journaled: self._on_checkpoint_written(structure,
+                                                                               journaled,
+                                                                               remaining))
+        worker.failed.connect(self._on_checkpoint_failed)
+        worker.released.connect(self._on_checkpoint_finished)
+
+        self._needsBegin = False
+        self._worker = worker
+
+        worker.start(QThread.LowPriority)
+
+    def _on_checkpoint_written(self, structure, journaled, remaining):
+
+        self._lastStructure = structure
+
+        for key, version in journaled.items():
+
+            if key not in self._surfaces:
+                continue
+
+            # Rows of tiles that did not fit in the capture are picked up by the next one
+            self._pendingRegions[key] = remaining[key]
+
+            if remaining[key] is None:
+                self._journaledVersions[key] = version
+
+    def _on_checkpoint_failed(self, exception):
+
+        logging.error('[autosave] {0}'.format(exception))
+
+        # Whatever made it to the journal may no longer match what is tracked here
+        self.reset()
+
+    def _on_checkpoint_finished(self):
+
+        self._worker = None
+
+    def _capture(self):
+
+        sprite = self._sprite
+
+        live_keys = set()
+        captures = []
+
+        # Only the changed tiles are copied, and no more of them than the budget has room for;
+        # whatever is left waits for the next checkpoint
+        capture_budget = appdata.autosave_capture_budget
+
+        animations = []
+
+        for animation in sprite.animations:
+
+            frames = []
+
+            for frame in animation.frames:
+
+                surfaces = []
+
+                for surface in frame.surfaces:
+
+                    key = self._key_for(surface)
+
+                    live_keys.add(key)
+
+                    base = self._bases.get(key)
+
+                    if base is not None and base[1] != surface.byte_count:
+                        base = None
+
+                    if self._journaledVersions.get(key) != surface.version and \
+                            capture_budget > 0:
+
+                        region = self._pending_region(key, surface)
+
+                        if region is not None:
+
+                            captured = _CapturedSurface(surface, region, capture_budget)
+                            capture_budget -= captured.byte_count
+
+                            captures.append((key, captured))
+
+                        else:
+                            self._journaledVersions[key] = surface.version
+
+                    surfaces.append({
+                        'key': key,
+                        'name': surface.name,
+                        'id': surface.id,
+                        'opacity': surface.opacity,
+                        'width': surface.width,
+                        'height': surface.height,
+                        'base': base
+                    })
+
+                frames.append({
+                    'current_surface': frame.current_surface_index,
+                    'duration': frame.duration,
+                    'surfaces': surfaces
+                })
+
+            animations.append({
+                'name': animation.name,
+                'current_frame': animation.current_frame_index,
+                'frames': frames
+            })
+
+        for key in list(self._surfaces.keys()):
+
+            if key not in live_keys:
+
+                del self._keys[id(self._surfaces.pop(key))]
+
+                self._bases.pop(key, None)
+                self._journaledVersions.pop(key, None)
+                self._pendingRegions.pop(key, None)
+
+        structure = {
+            'file_path': sprite.file_path,
+            'width': sprite.width,
+            'height': sprite.height,
+            'current_animation': sprite.current_animation_index,
+            'animations': animations
+        }
+
+        return structure, captures
+
+    def _pending_region(self, key, surface):
+
+        changed = surface.take_changed_region()
+
+        if key in self._pendingRegions:
+            region = utils.unite_regions(self._pendingRegions[key], changed)
+        else:
+            region = (0, 0, surface.width, surface.height)
+
+        self._pendingRegions[key] = region
+
+        return region
+
+    def _all_surfaces(self):
+
+        for animation in self._sprite.animations:
+            for frame in animation.frames:
+                for surface in frame.surfaces:
+                    yield surface
+
+    def _key_for(self, surface):
+
+        key = self._keys.get(id(surface))
+
+        if key is None:
+
+            key = self._nextKey
+            self._nextKey += 1
+
+            self._keys[id(surface)] = key
+            self._surfaces[key] = surface
+
+        return key
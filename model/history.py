@@ -0,0 +1,508 @@
+# --------------------------------------------------------------------------------------------------
+# Name:             History
+# Purpose:          Undo / Redo of pixel edits made to Surfaces.
+#
+#                   Edits are recorded as the tiles they touched, each stored compressed as it
+#                   was before and after the edit, so undoing a small edit on a large Surface
+#                   costs about as much as the edit itself.
+#
+#                   Older edits are spilled to a temporary file and read back when undone, only
+#                   their labels and tile layout stay in memory.
+#
+# Date:             17/10/26
+# License:
+# --------------------------------------------------------------------------------------------------
+
+import os
+import tempfile
+import zlib
+
+import numpy
+
+import helpers.utils as utils
+import model.appdata as appdata
+
+# The spill file is rewritten once dropped entries take more room than live ones
+SPILL_COMPACTION_RATIO = 2.0
+SPILL_COMPACTION_MIN_SIZE = 64 * 1024 * 1024
+
+
+def _tile_grid(x, y, width, height, surface_width, surface_height):
+
+    tile_size = appdata.undo_tile_size
+
+    left = max(0, x) // tile_size * tile_size
+    top = max(0, y) // tile_size * tile_size
+    right = min(surface_width, x + width)
+    bottom = min(surface_height, y + height)
+
+    for tile_y in range(top, bottom, tile_size):
+        for tile_x in range(left, right, tile_size):
+            yield tile_x, tile_y
+
+
+def _changed_tiles(before, after, region=None):
+
+    tile_size = appdata.undo_tile_size
+
+    height, width = before.shape[:2]
+
+    # Only the tiles overlapping the region can have changed
+    left, top, right, bottom = 0, 0, width, height
+
+    if region is not None:
+        x, y, region_width, region_height = region
+        left = max(0, x) // tile_size * tile_size
+        top = max(0, y) // tile_size * tile_size
+        right = min(width, x + region_width)
+        bottom = min(height, y + region_height)
+
+        if left >= right or top >= bottom:
+            return
+
+    before = before[top:bottom, left:right]
+    after = after[top:bottom, left:right]
+
+    height, width = before.shape[:2]
+
+    # One 32 bit compare per pixel
+    changed = before.view(numpy.uint32)[..., 0] != after.view(numpy.uint32)[..., 0]
+
+    changed_rows = numpy.logical_or.reduceat(changed, numpy.arange(0, height, tile_size),
+                                             axis=0)
+    changed_tiles = numpy.logical_or.reduceat(changed_rows, numpy.arange(0, width, tile_size),
+                                              axis=1)
+
+    for row, column in zip(*numpy.nonzero(changed_tiles)):
+        yield left + int(column) * tile_size, top + int(row) * tile_size
+
+
+class HistorySpill(object):
+    """
+    Append only temporary file holding the tiles of spilled history entries. The file is
+    deleted by the system once closed.
+    """
+
+    def __init__(self):
+
+        self._file = None
+        self._size = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    def write(self, data):
+
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='pxeel-undo-')
+
+        self._file.seek(0, os.SEEK_END)
+
+        offset = self._file.tell()
+
+        self._file.write(data)
+
+        self._size = offset + len(data)
+
+        return offset, len(data)
+
+    def read(self, offset, length):
+
+        self._file.flush()
+        self._file.seek(offset)
+
+        return self._file.read(length)
+
+    def compact(self, entries):
+
+        # Rewrites the data of the entries still around into a fresh file
+        blobs = [(entry, self.read(*entry.spill_location)) for entry in entries]
+
+        self.close()
+
+        for entry, data in blobs:
+            entry.spill_location = self.write(data)
+
+    def close(self):
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        self._size = 0
+
+
+class HistoryEntry(object):
+    def __init__(self, surfaces, label, tiles):
+
+        self._surfaces = surfaces
+        self._label = label
+
+        # Surface sizes the tiles were taken at
+        self._sizes = [(surface.width, surface.height) for surface in surfaces]
+
+        # (Surface Index, X, Y, Width, Height, Compressed Before Length, Compressed After Length)
+        self._layout = [(index, x, y, width, height, len(before), len(after))
+                        for index, x, y, width, height, before, after in tiles]
+
+        # Compressed (Before, After) tiles while held in memory, None once spilled
+        self._data = [(before, after) for _, _, _, _, _, before, after in tiles]
+
+        self._size = sum(before + after for _, _, _, _, _, before, after in self._layout)
+
+        self._spill = None
+        self.spill_location = None
+
+    @property
+    def surface(self):
+        return self._surfaces[0]
+
+    @property
+    def surfaces(self):
+        return self._surfaces
+
+    @property
+    def label(self):
+        return self._label
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def is_in_memory(self):
+        return self._data is not None
+
+    @property
+    def is_applicable(self):
+
+        # Tiles no longer line up once a Surface was resized or scaled
+        return all((surface.width, surface.height) == size
+                   for surface, size in zip(self._surfaces, self._sizes))
+
+    def spill_to(self, spill):
+
+        if self._data is None:
+            return
+
+        # Entries brought back for an undo are still in the spill, no need to write them again
+        if self.spill_location is None:
+            self.spill_location = spill.write(b''.join(before + after
+                                                       for before, after in self._data))
+
+        self._spill = spill
+        self._data = None
+
+    def undo(self):
+
+        self._restore(before=True)
+
+    def redo(self):
+
+        self._restore(before=False)
+
+    def mark_dirty(self):
+
+        regions = [None] * len(self._surfaces)
+
+        for index, x, y, width, height, _, _ in self._layout:
+            regions[index] = utils.unite_regions(regions[index], (x, y, width, height))
+
+        for surface, region in zip(self._surfaces, regions):
+            if region is not None:
+                surface.mark_dirty(region)
+
+    def _restore(self, before):
+
+        if self._data is None:
+            self._fault_in()
+
+        surfaces_pixels = [surface.pixels for surface in self._surfaces]
+
+        for (index, x, y, width, height, _, _), (tile_before, tile_after) in \
+                zip(self._layout, self._data):
+
+            data = zlib.decompress(tile_before if before else tile_after)
+
+            surfaces_pixels[index][y:y + height, x:x + width] = \
+                numpy.frombuffer(data, numpy.uint8).reshape(height, width, 4)
+
+        self.mark_dirty()
+
+    def _fault_in(self):
+
+        blob = self._spill.read(*self.spill_location)
+
+        self._data = []
+
+        position = 0
+
+        for _, _, _, _, _, before_length, after_length in self._layout:
+
+            before_end = position + before_length
+            after_end = before_end + after_length
+
+            self._data.append((blob[position:before_end], blob[before_end:after_end]))
+
+            position = after_end
+
+
+class _PendingEdit(object):
+    def __init__(self, surface, before):
+
+        self.surface = surface
+
+        # Pixels as they were, for edits that cannot tell up front what they will touch
+        self.before = before
+
+        # (X, Y) -> Tile as it was before the edit first wrote to it
+        self.tiles = {}
+
+
+class UndoHistory(object):
+    """
+    Records pixel edits to Surfaces. An edit is opened with begin_edit, and each write to the
+    Surface is announced beforehand with capture(x, y, w, h) so the tiles below are kept as they
+    were. Edits whose extent is not known in advance (moves) pass the pixels as they were
+    instead, a copy they keep anyway, and get diffed against it when closed with end_edit, which
+    can be given the (x, y, w, h) region the edit ended up touching to keep the diff small.
+
+    begin_group_edit opens an edit of several Surfaces at once, undone as a single step; each
+    of them passes its pixels as they were.
+    """
+
+    def __init__(self):
+
+        self._undoEntries = []
+        self._redoEntries = []
+
+        self._size = 0
+
+        self._pendingEdits = []
+        self._pendingLabel = None
+
+        self._spill = HistorySpill()
+
+    @property
+    def can_undo(self):
+        return len(self._undoEntries) > 0
+
+    @property
+    def can_redo(self):
+        return len(self._redoEntries) > 0
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def memory_size(self):
+        return sum(entry.size for entry in self._undoEntries + self._redoEntries
+                   if entry.is_in_memory)
+
+    @property
+    def undo_labels(self):
+        return [entry.label for entry in self._undoEntries]
+
+    @property
+    def redo_labels(self):
+        return [entry.label for entry in reversed(self._redoEntries)]
+
+    @property
+    def is_editing(self):
+        return len(self._pendingEdits) > 0
+
+    def begin_edit(self, surface, label, before=None):
+
+        self.begin_group_edit([surface], label, [before])
+
+    def begin_group_edit(self, surfaces, label, befores):
+
+        if self.is_editing:
+            self.end_edit()
+
+        # Kept in memory while the edit is open, the editing tool holds on to their pixels
+        for surface in surfaces:
+            surface.pin()
+
+        self._pendingEdits = [_PendingEdit(surface, before)
+                              for surface, before in zip(surfaces, befores)]
+        self._pendingLabel = label
+
+    def capture(self, x, y, width, height):
+
+        if len(self._pendingEdits) != 1 or self._pendingEdits[0].before is not None:
+            return
+
+        edit = self._pendingEdits[0]
+
+        surface = edit.surface
+        pixels = surface.pixels
+
+        tile_size = appdata.undo_tile_size
+
+        for tile_x, tile_y in _tile_grid(x, y, width, height, surface.width, surface.height):
+
+            if (tile_x, tile_y) not in edit.tiles:
+                edit.tiles[(tile_x, tile_y)] = \
+                    pixels[tile_y:tile_y + tile_size, tile_x:tile_x + tile_size].copy()
+
+    def end_edit(self, region=None):
+
+        edits = self._pendingEdits
+
+        if len(edits) == 0:
+            return None
+
+        self._pendingEdits = []
+
+        surfaces = []
+        tiles = []
+
+        for edit in edits:
+
+            edit_tiles = self._record(edit, region)
+
+            if len(edit_tiles) > 0:
+                tiles.extend((len(surfaces),) + tile for tile in edit_tiles)
+                surfaces.append(edit.surface)
+
+        entry = HistoryEntry(surfaces, self._pendingLabel, tiles) if len(tiles) > 0 else None
+
+        # Changed pixels are dirty before the surfaces go back to being paged
+        if entry is not None:
+            entry.mark_dirty()
+
+        for edit in edits:
+            edit.surface.unpin()
+
+        if entry is not None:
+            self._push(entry)
+
+        return entry
+
+    def cancel_edit(self):
+
+        for edit in self._pendingEdits:
+            edit.surface.unpin()
+
+        self._pendingEdits = []
+
+    def undo(self):
+
+        return self._step(self._undoEntries, self._redoEntries, HistoryEntry.undo)
+
+    def redo(self):
+
+        return self._step(self._redoEntries, self._undoEntries, HistoryEntry.redo)
+
+    def clear(self):
+
+        self._undoEntries.clear()
+        self._redoEntries.clear()
+        self._size = 0
+
+        self.cancel_edit()
+
+        self._spill.close()
+
+    # ---------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def _record(edit, region):
+
+        pixels = edit.surface.pixels
+
+        if edit.before is not None:
+
+            if edit.before.shape != pixels.shape:
+                return []
+
+            tile_size = appdata.undo_tile_size
+
+            before_tiles = ((x, y, edit.before[y:y + tile_size, x:x + tile_size])
+                            for x, y in _changed_tiles(edit.before, pixels, region))
+
+        else:
+
+            before_tiles = ((x, y, before) for (x, y), before in edit.tiles.items())
+
+        tiles = []
+
+        for x, y, before in before_tiles:
+
+            height, width = before.shape[:2]
+
+            after = pixels[y:y + height, x:x + width]
+
+            if numpy.array_equal(before, after):
+                continue
+
+            tiles.append((x, y, width, height,
+                          zlib.compress(before.tobytes(), 1), zlib.compress(after.tobytes(), 1)))
+
+        return tiles
+
+    def _push(self, entry):
+
+        for discarded_entry in self._redoEntries:
+            self._size -= discarded_entry.size
+
+        self._redoEntries.clear()
+
+        self._undoEntries.append(entry)
+        self._size += entry.size
+
+        self._trim()
+
+    def _step(self, source, target, apply):
+
+        while len(source) > 0:
+
+            entry = source.pop()
+
+            if entry.is_applicable:
+
+                apply(entry)
+                target.append(entry)
+
+                self._trim()
+
+                return entry
+
+            self._size -= entry.size
+
+        return None
+
+    def _trim(self):
+
+        entries = self._undoEntries
+
+        # Only the latest steps are kept in memory, and fewer when they take too much of it
+        for entry in entries[:-appdata.undo_memory_steps]:
+            entry.spill_to(self._spill)
+
+        memory_size = self.memory_size
+
+        for entry in entries[:-1]:
+
+            if memory_size <= appdata.undo_memory_budget:
+                break
+
+            if entry.is_in_memory:
+                entry.spill_to(self._spill)
+                memory_size -= entry.size
+
+        # The latest edit is kept even when it alone is over budget
+        while self._size > appdata.undo_history_budget and len(entries) > 1:
+            self._size -= entries.pop(0).size
+
+        spilled_entries = [entry for entry in entries + self._redoEntries
+                           if entry.spill_location is not None]
+
+        spilled_size = sum(entry.spill_location[1] for entry in spilled_entries)
+
+        if self._spill.size > max(SPILL_COMPACTION_MIN_SIZE,
+                                  spilled_size * SPILL_COMPACTION_RATIO):
+            self._spill.compact(spilled_entries)
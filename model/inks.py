@@ -9,9 +9,13 @@
 # Licence:     <your licence>
 #--------------------------------------------------------------------------------------------------
 
+import numpy
+from PyQt5.QtGui import QPainter
+
 from model.properties import PropertyHolder
 
 import helpers.drawing as drawing
+import helpers.utils as utils
 
 
 class Ink(PropertyHolder):
@@ -27,6 +31,21 @@ class Ink(PropertyHolder):
     def blit(self, x, y, w, h, color, painter):
         return
 
+    def blit_many(self, xs, ys, w, h, color, pixels):
+
+        # Blits a w x h stamp at each of the xs, ys positions onto the pixels. Inks that can, write
+        # the covered pixels at once instead of painting stamps one by one
+        image = utils.pixels_to_image(pixels)
+
+        painter = QPainter()
+
+        painter.begin(image)
+
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            self.blit(x, y, w, h, color, painter)
+
+        painter.end()
+
 
 class Solid(Ink):
     def __init__(self):
@@ -37,6 +56,35 @@ class Solid(Ink):
     def blit(self, x, y, w, h, color, painter):
         painter.fillRect(x, y, w, h, color)
 
+    def blit_many(self, xs, ys, w, h, color, pixels):
+
+        if color.alpha() == 0:
+            return
+
+        height, width = pixels.shape[:2]
+
+        pixel = utils.color_to_pixel(color)
+
+        # Overlapping stamps blend once, a translucent stroke does not darken where it crosses
+        if color.alpha() == 255:
+
+            covered = drawing.stamps_indices(xs, ys, w, h, width, height, unique=False)
+
+            pixels.view(numpy.uint32).reshape(-1)[covered] = pixel.view(numpy.uint32)[0]
+
+        else:
+
+            covered = drawing.stamps_indices(xs, ys, w, h, width, height)
+
+            words = pixels.view(numpy.uint32).reshape(-1)
+
+            covered_words = words[covered]
+            covered_pixels = covered_words.view(numpy.uint8).reshape(-1, 4)
+
+            utils.composite_pixels(covered_pixels, numpy.broadcast_to(pixel, covered_pixels.shape))
+
+            words[covered] = covered_words
+
 
 class Eraser(Ink):
     def __init__(self):
@@ -46,3 +94,10 @@ class Eraser(Ink):
     def blit(self, x, y, w, h, color, painter):
 
         drawing.erase_area_painter_ready(x, y, w, h, painter)
+
+    def blit_many(self, xs, ys, w, h, color, pixels):
+
+        covered = drawing.stamps_indices(xs, ys, w, h, pixels.shape[1], pixels.shape[0],
+                                         unique=False)
+
+        pixels.view(numpy.uint32).reshape(-1)[covered] = 0
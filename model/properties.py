@@ -33,11 +33,11 @@ class Property(object):
 
 class NumberProperty(Property):
     def __init__(self, name, description=None, value=None, ):
-        super(NumberProperty, self).__init__(name, value, description)
+        super(NumberProperty, self).__init__(name, description, value)
 
     def build_property_widget(self):
         number_input = QSpinBox()
-        number_input.setValue(self.value())
+        number_input.setValue(self.value)
         number_input.valueChanged.connect(lambda v: self._set_value(v))
 
         return number_input
@@ -122,8 +122,8 @@ class RangedProperty(Property):
 
     def build_property_widget(self):
 
-        ranged_input = Slider(self.min(), self.max())
-        ranged_input.set_value(self.value())
+        ranged_input = Slider(self.min, self.max)
+        ranged_input.set_value(self.value)
         ranged_input.valueChanged.connect(lambda v: self._set_value(v))
 
         return ranged_input
@@ -9,14 +9,27 @@
 #--------------------------------------------------------------------------------------------------
 import pickle
 import os
+import weakref
+from collections import OrderedDict
 
-from PyQt5.QtCore import QPoint, QSize
+import numpy
+from PyQt5.QtCore import QSize
 from PyQt5.QtGui import QPainter
 
 import helpers.utils as utils
 import helpers.cropper as cropper
+from helpers.worker import run_parallel
 import model.appdata as appdata
-from helpers.packer import RectanglePacker
+import model.atlas as atlas
+from model.sprite_file import SpriteFile, SpriteFileWriter, SpriteFileUpdater, is_sprite_file
+from model.history import UndoHistory
+
+# PNG quality frames are exported with for each compression setting, Qt maps qualities
+# 0 - 100 to zlib levels 9 - 0
+PNG_QUALITY = {
+    'fast': 80,
+    'small': 0
+}
 
 
 class Sprite(object):
@@ -27,6 +40,9 @@ class Sprite(object):
         self._animations = []
         self._filePath = ""
         self._currentAnimationIndex = -1
+        self._spriteFile = None
+        self._history = UndoHistory()
+        self._compositeCache = CompositeCache(appdata.composite_cache_budget)
 
     @property
     def file_path(self):
@@ -36,6 +52,18 @@ class Sprite(object):
     def file_path(self, value):
         self._filePath = value
 
+    @property
+    def sprite_file(self):
+        return self._spriteFile
+
+    @property
+    def history(self):
+        return self._history
+
+    @property
+    def composite_cache(self):
+        return self._compositeCache
+
     @property
     def active_surface(self):
         if (
@@ -49,9 +77,17 @@ class Sprite(object):
             return None
 
     @property
-    def active_surface_pixel_data(self):
+    def current_surface(self):
+
+        if self.current_animation and self.current_animation.current_frame:
+            return self.current_animation.current_frame.current_surface
+
+        return None
+
+    @property
+    def active_surface_pixels(self):
 
-        return self.current_animation.current_frame.current_surface.pixel_data
+        return self.current_animation.current_frame.current_surface.pixels
 
     @property
     def current_animation(self):
@@ -119,6 +155,15 @@ class Sprite(object):
 
         self.current_animation.current_frame.paste_image(image)
 
+    def close(self):
+
+        self._history.clear()
+        self._compositeCache.clear()
+
+        if self._spriteFile is not None:
+            self._spriteFile.close()
+            self._spriteFile = None
+
     # ----- STATIC METHODS ------------------------------------------------------------------------
     # ---------------------------------------------------------------------------------------------
 
@@ -133,8 +178,25 @@ class Sprite(object):
     @staticmethod
     def load_from_file(file):
 
-        with open(file, 'rb') as spriteFile:
-            new_sprite = pickle.load(spriteFile)
+        if is_sprite_file(file):
+
+            sprite_file = SpriteFile(file)
+
+            try:
+                new_sprite = Sprite.from_index(
+                    sprite_file.index,
+                    lambda entry: Surface(entry['name'], entry['width'], entry['height'],
+                                          backing=(sprite_file,) + tuple(entry['chunk'])),
+                    sprite_file)
+            except Exception:
+                sprite_file.close()
+                raise
+
+        else:
+
+            # Sprites saved before the chunked format were pickled whole
+            with open(file, 'rb') as spriteFile:
+                new_sprite = pickle.load(spriteFile)
 
         if new_sprite is not None:
 
@@ -148,10 +210,78 @@ class Sprite(object):
     @staticmethod
     def save(sprite, save_path):
 
-        sprite.file_path = save_path
+        pending_save = Sprite.write(sprite.snapshot(), save_path)
+
+        Sprite.finish_save(sprite, pending_save)
+
+    @staticmethod
+    def write(snapshot, save_path, progress=None):
+
+        """
+        Writes a SpriteSnapshot to disk. Safe to run off the GUI thread: the returned PendingSave
+        must then be handed to finish_save on the GUI thread to make the new file current.
+        """
+
+        sprite_file = snapshot.sprite_file
+
+        if sprite_file is not None and sprite_file.is_same_file(save_path) and \
+                not sprite_file.needs_compaction:
+
+            # Only surfaces changed since they were last written get a new chunk, everything
+            # else keeps pointing at the chunk it already has in this file
+            with SpriteFileUpdater(sprite_file.file_path) as updater:
+
+                index, chunks = snapshot.build_index(updater, sprite_file, progress)
+
+                updater.finish(index)
+
+            return PendingSave(save_path, index, chunks)
+
+        writer = SpriteFileWriter(save_path)
+
+        with writer:
+
+            index, chunks = snapshot.build_index(writer, progress=progress)
+
+            writer.finish(index)
+
+        return PendingSave(save_path, index, chunks, writer)
+
+    @staticmethod
+    def finish_save(sprite, pending_save):
+
+        if pending_save.writer is None:
+
+            sprite._spriteFile.refresh(pending_save.index)
+
+        else:
+
+            old_file = sprite._spriteFile
+
+            # The file being replaced may be the one still backing unloaded surfaces
+            if old_file is not None:
+                old_file.close()
+
+            try:
+                pending_save.writer.commit()
+            except Exception:
+                pending_save.writer.abort()
+                if old_file is not None:
+                    old_file.reopen()
+                raise
+
+            sprite._spriteFile = SpriteFile(pending_save.save_path)
 
-        with open(save_path, 'wb+') as outFile:
-            pickle.dump(sprite, outFile)
+        sprite.file_path = pending_save.save_path
+
+        for surface, version, (offset, length) in pending_save.chunks:
+            surface.bind(sprite._spriteFile, offset, length, version)
+
+    @staticmethod
+    def discard_save(pending_save):
+
+        if pending_save.writer is not None:
+            pending_save.writer.abort()
 
     @staticmethod
     def import_from_image_files(image_files):
@@ -185,7 +315,19 @@ class Sprite(object):
         pass
 
     @staticmethod
-    def export(sprite, directory):
+    def export(sprite, directory, progress=None, compression=None):
+
+        """
+        Writes each animation's frames, trimmed, to animation_name/frameN.png under the
+        directory. Frames are flattened, trimmed and encoded on a pool of threads. compression
+        is 'fast' or 'small', appdata.export_png_compression by default.
+
+        sprite: Sprite or SpriteSnapshot. A Sprite is snapshotted on the calling thread first,
+        which must then be the one it is edited from.
+        """
+
+        # Pool threads only ever read frozen pixels, never the Sprite's caches
+        sprite = sprite.snapshot()
 
         created_folder_successfuly = True
 
@@ -193,11 +335,11 @@ class Sprite(object):
 
         for animation in sprite.animations:
 
-            directory = utils.make_directory(directory, animation.name)
+            animation_directory = utils.make_directory(directory, animation.name)
 
-            if directory is not None:
+            if animation_directory is not None:
 
-                directories[animation] = directory
+                directories[animation] = animation_directory
 
             else:
 
@@ -207,116 +349,113 @@ class Sprite(object):
 
         if created_folder_successfuly:
 
-            for animation, animationDirectory in directories.items():
-
-                for index, frame in enumerate(animation.frames):
-
-                    flattened_frame_image = frame.flatten()
+            quality = PNG_QUALITY[compression or appdata.export_png_compression]
 
-                    flattened_frame_image = cropper.crop(flattened_frame_image)
+            def export_frame(job):
 
-                    file_path = os.path.join(animationDirectory, ('frame{0}.png'.format(index)))
+                frame, file_path = job
 
-                    try:
+                trimmed_pixels, _, _ = cropper.trim(frame.flatten_pixels())
 
-                        flattened_frame_image.save(file_path, "PNG")
+                if not utils.pixels_to_image(trimmed_pixels).save(file_path, "PNG", quality):
+                    raise IOError("Can't write {0}".format(file_path))
 
-                    except Exception as e:
+            jobs = [(frame, os.path.join(animation_directory, 'frame{0}.png'.format(index)))
+                    for animation, animation_directory in directories.items()
+                    for index, frame in enumerate(animation.frames)]
 
-                        raise e
+            run_parallel(export_frame, jobs, progress)
 
     @staticmethod
-    def export_to_spritesheet(sprite, directory):
+    def export_to_spritesheet(sprite, directory, progress=None):
 
-        packer = RectanglePacker(appdata.max_texture_size, appdata.max_texture_size)
+        return atlas.export_atlas(sprite, directory, progress=progress)
 
-        animation = sprite.animations[0]
-
-        frames = animation.frames
+    # ---------------------------------------------------------------------------------------------
+    # ---------------------------------------------------------------------------------------------
 
-        cropped_images = []
+    def set_animation(self, index):
 
-        spritesheet_regions = []
+        index = utils.clamp(index, 0, len(self._animations) - 1)
 
-        for frame in frames:
-            flattened_frame_image = frame.flatten()
+        self._currentAnimationIndex = index
 
-            cropped_frame_image = cropper.crop(flattened_frame_image)
+    def add_animation(self):
 
-            cropped_images.append(cropped_frame_image)
+        name = 'Animation ' + str(len(self._animations) + 1)
+        new_animation = Animation(name, self)
 
-        images_remaining = len(cropped_images)
+        self._animations.append(new_animation)
 
-        while images_remaining > 0:
+        self._currentAnimationIndex = len(self._animations) - 1
 
-            for image in cropped_images:
+    def remove_current_animation(self):
 
-                image_width = image.width()
-                image_height = image.height()
+        previous_length = len(self._animations)
 
-                point = packer.pack(image_width, image_height)
+        for frame in self._animations[self._currentAnimationIndex].frames:
+            self._compositeCache.discard_frame(frame)
 
-                if point is None:
-                    raise Exception("Can't fit all sprite frames. Max image size is 4096x4096.")
+        del self._animations[self._currentAnimationIndex]
 
-                images_remaining -= 1
+        if len(self._animations) > 0 and self._currentAnimationIndex == previous_length - 1:
+            self._currentAnimationIndex -= 1
 
-                spritesheet_regions.append((image, point))
+        elif len(self._animations) == 0:
 
-        spritesheet = utils.create_image(packer.actual_packing_area_width(),
-                                         packer.actual_packing_area_height())
-        painter = QPainter()
+            self.add_animation()
 
-        painter.begin(spritesheet)
+    # ----- SERIALIZATION -------------------------------------------------------------------------
 
-        for sprRegion in spritesheet_regions:
-            spr_image = sprRegion[0]
-            target_point = QPoint(sprRegion[1].x, sprRegion[1].y)
+    def snapshot(self):
 
-            painter.drawImage(target_point, spr_image)
+        return SpriteSnapshot(self)
 
-        painter.end()
+    @staticmethod
+    def from_index(index, create_surface, sprite_file=None):
 
-        file_path = os.path.join(directory, ('{0}Sheet.png'.format(animation.name)))
+        sprite = Sprite(index['width'], index['height'])
 
-        try:
+        for animation_entry in index['animations']:
 
-            spritesheet.save(file_path, "PNG")
+            animation = Animation(animation_entry['name'], sprite)
 
-        except Exception as e:
+            for frame_entry in animation_entry['frames']:
 
-            raise e
+                frame = Frame(animation)
 
-    # ---------------------------------------------------------------------------------------------
-    # ---------------------------------------------------------------------------------------------
+                for surface_entry in frame_entry['surfaces']:
 
-    def set_animation(self, index):
+                    surface = create_surface(surface_entry)
 
-        index = utils.clamp(index, 0, len(self._animations) - 1)
+                    surface._id = surface_entry['id']
+                    surface.opacity = surface_entry['opacity']
 
-        self._currentAnimationIndex = index
+                    frame.surfaces.append(surface)
 
-    def add_animation(self):
+                frame.set_surface(frame_entry['current_surface'])
 
-        name = 'Animation ' + str(len(self._animations) + 1)
-        new_animation = Animation(name, self)
+                frame.duration = frame_entry.get('duration')
 
-        self._animations.append(new_animation)
+                animation.frames.append(frame)
 
-        self._currentAnimationIndex = len(self._animations) - 1
+            animation._frameWidth = sprite.width
+            animation._frameHeight = sprite.height
+            animation.set_frame(animation_entry['current_frame'])
 
-    def remove_current_animation(self):
+            sprite.animations.append(animation)
 
-        previous_length = len(self._animations)
+        sprite.set_animation(index['current_animation'])
 
-        del self._animations[self._currentAnimationIndex]
+        sprite._spriteFile = sprite_file
 
-        if len(self._animations) > 0 and self._currentAnimationIndex == previous_length - 1:
-            self._currentAnimationIndex -= 1
+        return sprite
 
-        elif len(self._animations) == 0:
-
-            self.add_animation()
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._spriteFile = None
+        self._history = UndoHistory()
+        self._compositeCache = CompositeCache(appdata.composite_cache_budget)
 
 
 class Animation(object):
@@ -426,6 +565,8 @@ class Animation(object):
             if self.is_on_last_frame:
                 new_index -= 1
 
+        self._sprite.composite_cache.discard_frame(self._frames[index])
+
         del self._frames[index]
 
         if len(self._frames) > 0:
@@ -475,6 +616,70 @@ class Animation(object):
         self.set_frame(self._current_frameIndex - 1)
 
 
+class CompositeCache(object):
+    """
+    Flattened runs of layers of the Frames of a Sprite, by Frame and by what they cover
+    ('below' / 'above' the current layer, 'all'), least recently used first. Entries are dropped
+    once their images exceed the memory budget and when their Frame is removed.
+    """
+
+    def __init__(self, budget):
+
+        self._budget = budget
+
+        # (Frame id, Key) -> (Frame, Stamp, Image), the stamp being the (surface, version) list
+        # the image was made from
+        self._entries = OrderedDict()
+        self._size = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, frame, key, stamp):
+
+        entry = self._entries.get((id(frame), key))
+
+        if entry is None or entry[1] != stamp:
+            return None
+
+        self._entries.move_to_end((id(frame), key))
+
+        return entry[2]
+
+    def put(self, frame, key, stamp, image):
+
+        self._discard((id(frame), key))
+
+        self._entries[(id(frame), key)] = (frame, stamp, image)
+        self._size += image.byteCount()
+
+        self._trim()
+
+    def discard_frame(self, frame):
+
+        for key in [entry_key for entry_key in self._entries if entry_key[0] == id(frame)]:
+            self._discard(key)
+
+    def clear(self):
+
+        self._entries.clear()
+        self._size = 0
+
+    def _discard(self, key):
+
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            self._size -= entry[2].byteCount()
+
+    def _trim(self):
+
+        # The entry just put is kept even when over budget on its own
+        while self._size > self._budget and len(self._entries) > 1:
+            self._discard(next(iter(self._entries)))
+
+
 class Frame(object):
     def __init__(self, animation, image=None):
 
@@ -482,9 +687,16 @@ class Frame(object):
         self._current_surface_index = -1
         self._animation = animation
 
+        # Milliseconds the frame is held for on playback, None to follow the playback frame rate
+        self._duration = None
+
         if image is not None:
             self.add_surface(image)
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._duration = state.get('_duration')
+
     @property
     def surfaces(self):
         return self._surfaces
@@ -493,6 +705,14 @@ class Frame(object):
     def surface_count(self):
         return len(self._surfaces)
 
+    @property
+    def duration(self):
+        return self._duration
+
+    @duration.setter
+    def duration(self, value):
+        self._duration = value
+
     @property
     def current_surface(self):
 
@@ -505,6 +725,23 @@ class Frame(object):
     def current_surface_index(self):
         return self._current_surface_index
 
+    @property
+    def surface_versions(self):
+        # Changes whenever a layer is edited, added, removed or moved
+        return [(surface, surface.version) for surface in self._surfaces]
+
+    @property
+    def composite_below(self):
+        return self._composite('below', self._surfaces[:max(0, self._current_surface_index)])
+
+    @property
+    def composite_above(self):
+        return self._composite('above', self._surfaces[self._current_surface_index + 1:])
+
+    @property
+    def composite(self):
+        return self._composite('all', self._surfaces)
+
     def surface_at(self, index):
 
         index = utils.clamp(index, 0, len(self._surfaces) - 1)
@@ -518,9 +755,11 @@ class Frame(object):
 
     def add_empty_surface(self, at=None):
 
-        surface_image = utils.create_image(self._animation.sprite.width,
-                                           self._animation.sprite.height)
-        self.add_surface(surface_image, at)
+        new_surface = Surface('Layer ' + str(len(self._surfaces)),
+                              self._animation.sprite.width,
+                              self._animation.sprite.height)
+
+        self._insert_surface(new_surface, at)
 
     def paste_image(self, image):
 
@@ -547,12 +786,16 @@ class Frame(object):
 
         new_surface.paste(image)
 
-        new_surface._id = sid
+        self._insert_surface(new_surface, at)
+
+    def _insert_surface(self, surface, at=None):
+
+        surface._id = len(self._surfaces)
 
         if at is None:
-            self._surfaces.append(new_surface)
+            self._surfaces.append(surface)
         else:
-            self._surfaces.append(new_surface)
+            self._surfaces.append(surface)
 
         self._current_surface_index = len(self._surfaces) - 1
 
@@ -562,6 +805,8 @@ class Frame(object):
 
         del self._surfaces[self._current_surface_index]
 
+        self._animation.sprite.composite_cache.discard_frame(self)
+
         if len(self._surfaces) > 0 and self._current_surface_index == previous_length - 1:
             self._current_surface_index -= 1
 
@@ -585,28 +830,26 @@ class Frame(object):
 
         clone = Frame(self._animation)
 
+        clone.duration = self._duration
+
         for surface in self._surfaces:
-            clone.add_surface(surface.image.copy())
+            clone._insert_surface(surface.copy())
 
         return clone
 
     def flatten(self):
 
-        if len(self._surfaces) == 1:
-            return self._surfaces[0].image
+        composite = self.composite
 
-        flattened_image = utils.create_image(self._animation.frame_width(),
-                                             self._animation.frame_height())
+        if composite is None:
+            sprite = self._animation.sprite
+            return utils.pixels_to_image(utils.create_pixels(sprite.width, sprite.height))
 
-        painter = QPainter()
-        painter.begin(flattened_image)
+        return composite.copy()
 
-        for surface in self._surfaces:
-            painter.drawImage(0, 0, surface.image)
+    def flatten_pixels(self):
 
-        painter.end()
-
-        return flattened_image
+        return utils.image_to_pixels(self.flatten())
 
     def resize(self, width, height):
 
@@ -618,12 +861,68 @@ class Frame(object):
         for surface in self._surfaces:
             surface.scale(scale_width, scale_height)
 
+    def _composite(self, key, surfaces):
+
+        if len(surfaces) == 0:
+            return None
+
+        if len(surfaces) == 1:
+            return surfaces[0].image
+
+        # Rebuilt only once one of its layers changed, was moved or was replaced
+        stamp = [(surface, surface.version) for surface in surfaces]
+
+        composite_cache = self._animation.sprite.composite_cache
+
+        cached = composite_cache.get(self, key, stamp)
+
+        if cached is not None:
+            return cached
+
+        flattened_pixels = surfaces[0].const_pixels.copy()
+
+        for surface in surfaces[1:]:
+            utils.composite_pixels(flattened_pixels, surface.const_pixels)
+
+        image = utils.pixels_to_image(flattened_pixels)
+
+        composite_cache.put(self, key, stamp, image)
+
+        return image
+
 
 class Surface(object):
-    def __init__(self, name, width, height):
-        self._image = utils.create_image(width, height)
-        self._pixelData = self._image.bits()
-        self._pixelData.setsize(self._image.byteCount())
+    def __init__(self, name, width, height, backing=None):
+
+        self._width = width
+        self._height = height
+
+        # (SpriteFile, Offset, Length) of the last chunk these pixels were written to
+        self._backing = backing
+
+        self._pinned = False
+
+        # Snapshots reading the pixels in place, they get copied before the next write
+        self._sharingSnapshots = weakref.WeakSet()
+
+        # (X, Y, Width, Height) bounds of the changes since take_changed_region, None if none
+        self._changedRegion = None
+
+        # Bumped on every change to the pixels, compared against the version last written
+        self._version = 0
+        self._savedVersion = 0
+
+        if backing is None:
+
+            # Height x Width x BGRA, the image is a view over it
+            self._pixels = utils.create_pixels(width, height)
+            self._image = utils.pixels_to_image(self._pixels)
+
+        else:
+
+            # Pixels are paged in on first access
+            self._pixels = None
+            self._image = None
 
         self._byteArray = None
 
@@ -633,16 +932,47 @@ class Surface(object):
 
     @property
     def width(self):
-        return self._image.width() if self._image is not None else 0
+        return self._width
 
     @property
     def height(self):
-        return self._image.height() if self._image is not None else 0
+        return self._height
+
+    @property
+    def byte_count(self):
+        return self._width * self._height * 4
 
     @property
     def image(self):
+
+        if self._pixels is None:
+            self._load()
+
+        elif self._backing is not None:
+            self._backing[0].surface_cache.touch(self)
+
         return self._image
 
+    @property
+    def is_loaded(self):
+        return self._pixels is not None
+
+    @property
+    def is_pinned(self):
+        return self._pinned
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def is_dirty(self):
+        return self._backing is None or self._version != self._savedVersion
+
+    @property
+    def chunk(self):
+        return self._backing[1:] if self._backing is not None else None
+
     @property
     def name(self):
         return self._name
@@ -652,62 +982,484 @@ class Surface(object):
         return self._id
 
     @property
-    def pixel_data(self):
-        return self._pixelData
+    def opacity(self):
+        return self._opacity
 
-    def resize(self, width, height):
+    @opacity.setter
+    def opacity(self, value):
+        self._opacity = value
 
-        new_image = utils.create_image(width, height)
+    @property
+    def pixels(self):
 
-        painter = QPainter(new_image)
+        # Writers mark the surface dirty right after, which keeps it in memory until saved
+        if self._pixels is None:
+            self._load()
 
-        painter.drawImage(0, 0, self._image)
+        self._sync_pixels()
+        self._copy_on_write()
 
-        self._image = new_image
+        return self._pixels
 
-        self._resize_pixel_buffer()
+    @property
+    def const_pixels(self):
 
-    def scale(self, scale_width, scale_height):
+        # For reading only, writing through these would bypass the dirty tracking
+        if self._pixels is None:
+            self._load()
+
+        self._sync_pixels()
+
+        return self._pixels
+
+    def pin(self):
+
+        # Held for the length of an edit, whoever edits may keep a handle on the pixels
+        if self._pinned:
+            return
+
+        self._pinned = True
+
+        # Edits may paint on the image rather than go through pixels
+        self._copy_on_write()
+
+        if self._backing is not None:
+            self._backing[0].surface_cache.discard(self)
+
+    def unpin(self):
+
+        if not self._pinned:
+            return
+
+        self._pinned = False
+
+        if self._pixels is not None and not self.is_dirty:
+            self._backing[0].surface_cache.add(self)
+
+    def mark_dirty(self, region=None):
+
+        # Changes that don't say which (X, Y, Width, Height) region they touched count as a
+        # change to all of the surface
+        if region is None:
+            region = (0, 0, self._width, self._height)
+
+        self._changedRegion = utils.unite_regions(self._changedRegion, region)
+
+        # Dirty pixels exist only in memory until the next save, they can't be paged out
+        if self._backing is not None:
+            self._backing[0].surface_cache.discard(self)
+
+        self._copy_on_write()
+
+        self._version += 1
+        self._byteArray = None
+
+    def share_pixels(self, snapshot):
+
+        # Hands the pixels to the snapshot as they are, the surface moves to a copy of its own
+        # the first time it is written to while any snapshot sharing them is alive
+        if self._pixels is None:
+            self._load()
+
+        self._sync_pixels()
+
+        self._sharingSnapshots.add(snapshot)
+
+        return self._pixels
+
+    def take_changed_region(self):
+
+        region = self._changedRegion
+
+        self._changedRegion = None
+
+        if region is None:
+            return None
+
+        x, y, width, height = region
+
+        left, top = max(0, x), max(0, y)
+        right, bottom = min(self._width, x + width), min(self._height, y + height)
+
+        if left >= right or top >= bottom:
+            return None
 
-        cur_width = self.width()
-        cur_height = self.height()
+        return left, top, right - left, bottom - top
 
-        new_width = cur_width * scale_width
-        new_height = cur_height * scale_height
+    def is_saved_in(self, sprite_file):
 
-        self._image = self._image.scaled(new_width, new_height)
+        return not self.is_dirty and self._backing[0] is sprite_file
 
-        self._resize_pixel_buffer()
+    def bind(self, sprite_file, offset, length, version=None):
+
+        self._backing = (sprite_file, offset, length)
+        self._savedVersion = self._version if version is None else version
+
+        # Clean again, so it can be paged out, unless an edit still holds it (see unpin)
+        if self._pixels is not None and not self._pinned and not self.is_dirty:
+            sprite_file.surface_cache.add(self)
+
+    def evict(self):
+
+        if self._pixels is None or self._pinned or self.is_dirty:
+            return False
+
+        self._pixels = None
+        self._image = None
+
+        # Read back into new pixels, the ones snapshots share are theirs alone now
+        self._sharingSnapshots.clear()
+
+        return True
+
+    def to_bytes(self):
+
+        if self._pixels is None:
+
+            sprite_file, offset, length = self._backing
+
+            return sprite_file.read_chunk(offset, length)
+
+        self._sync_pixels()
+
+        return self._pixels.tobytes()
+
+    def snapshot(self):
+
+        return SurfaceSnapshot(self)
+
+    def copy(self):
+
+        new_surface = Surface(self._name, self._width, self._height)
+
+        if self._pixels is None:
+
+            sprite_file, offset, length = self._backing
+
+            sprite_file.read_chunk_into(offset, length, new_surface._pixels.reshape(-1))
+
+        else:
+
+            self._sync_pixels()
+
+            new_surface._pixels[:] = self._pixels
+
+        new_surface._opacity = self._opacity
+
+        return new_surface
+
+    def resize(self, width, height):
+
+        new_pixels = utils.create_pixels(width, height)
+
+        kept_width = min(width, self._width)
+        kept_height = min(height, self._height)
+
+        new_pixels[:kept_height, :kept_width] = self.pixels[:kept_height, :kept_width]
+
+        self._set_pixels(new_pixels)
+
+    def scale(self, scale_width, scale_height):
+
+        new_width = int(round(self._width * scale_width))
+        new_height = int(round(self._height * scale_height))
+
+        # Nearest neighbour, sampling each target pixel at its center
+        rows = ((numpy.arange(new_height) + 0.5) * self._height / new_height).astype(numpy.intp)
+        columns = ((numpy.arange(new_width) + 0.5) * self._width / new_width).astype(numpy.intp)
+
+        self._set_pixels(self.pixels[rows[:, None], columns])
 
     def paste(self, image, x=None, y=None):
 
-        painter = QPainter(self._image)
+        target = self.image
+
+        self.mark_dirty()
+
+        painter = QPainter(target)
 
         if x is None:
-            x = self._image.width() // 2 - image.width() // 2
+            x = target.width() // 2 - image.width() // 2
 
         if y is None:
-            y = self._image.height() // 2 - image.height() // 2
+            y = target.height() // 2 - image.height() // 2
 
         painter.drawImage(x, y, image)
 
-    def _resize_pixel_buffer(self):
+        painter.end()
+
+    def _load(self):
+
+        sprite_file, offset, length = self._backing
+
+        pixels = numpy.empty((self._height, self._width, 4), numpy.uint8)
+
+        sprite_file.read_chunk_into(offset, length, pixels.reshape(-1))
+
+        self._pixels = pixels
+        self._image = utils.pixels_to_image(pixels)
 
-        self._pixelData = self._image.bits()
-        self._pixelData.setsize(self._image.byteCount())
+        if not self._pinned:
+            sprite_file.surface_cache.add(self)
+
+    def _set_image(self, image):
+
+        self._set_pixels(utils.image_to_pixels(image))
+
+    def _set_pixels(self, pixels):
+
+        self._pixels = numpy.ascontiguousarray(pixels)
+        self._image = utils.pixels_to_image(self._pixels)
+
+        self._height, self._width = pixels.shape[:2]
+
+        # Replaced rather than written to, whatever snapshot shares the old pixels keeps them
+        self._sharingSnapshots.clear()
+
+        self.mark_dirty()
+
+    def _copy_on_write(self):
+
+        if len(self._sharingSnapshots) == 0:
+            return
+
+        if self._pixels is not None:
+            self._sync_pixels()
+            self._pixels = self._pixels.copy()
+            self._image = utils.pixels_to_image(self._pixels)
+
+        self._sharingSnapshots.clear()
+
+    def _sync_pixels(self):
+
+        # Painting on the image while some shallow copy of it is alive makes Qt detach the
+        # image from the array; take the painted pixels back in that case
+        if int(self._image.constBits()) != self._pixels.ctypes.data:
+            self._pixels = utils.image_to_pixels(self._image)
+            self._image = utils.pixels_to_image(self._pixels)
 
     def __getstate__(self):
-        if self._byteArray is None or self._byteArray.is_empty():
-            self._byteArray = utils.image_to_byte_array(self._image)
+        if self._byteArray is None or self._byteArray.isEmpty():
+            self._byteArray = utils.image_to_byte_array(self.image)
 
         state = self.__dict__.copy()
 
         del state['_image']
-        del state['_pixelData']
+        del state['_pixels']
+        del state['_backing']
+        del state['_sharingSnapshots']
 
         return state
 
     def __setstate__(self, state):
         self.__dict__.update(state)
-        self._image = utils.byte_array_to_image(self._byteArray)
-        self._byteArray.clear()
\ No newline at end of file
+        self._pixels = utils.image_to_pixels(utils.byte_array_to_image(self._byteArray))
+        self._image = utils.pixels_to_image(self._pixels)
+        self._byteArray.clear()
+        self._height, self._width = self._pixels.shape[:2]
+        self._backing = None
+        self._pinned = False
+        self._sharingSnapshots = weakref.WeakSet()
+        self._changedRegion = None
+        self._version = 0
+        self._savedVersion = 0
+
+
+class PendingSave(object):
+    def __init__(self, save_path, index, chunks, writer=None):
+
+        self.save_path = save_path
+        self.index = index
+        self.chunks = chunks
+
+        # Set when a new file awaits being moved over save_path, None for in place updates
+        self.writer = writer
+
+
+class SpriteSnapshot(object):
+    """
+    Frozen copy of a Sprite's structure and pixels, taken on the GUI thread and safe to read
+    from a worker thread while the Sprite keeps being edited. Only pixels that were not saved
+    yet are kept, shared with the Surface until it is next written to, everything else is read
+    back from the sprite file.
+    """
+
+    def __init__(self, sprite):
+
+        self.width = sprite.width
+        self.height = sprite.height
+        self.current_animation_index = sprite.current_animation_index
+        self.sprite_file = sprite._spriteFile
+        self.animations = [AnimationSnapshot(animation) for animation in sprite.animations]
+
+    @property
+    def surface_count(self):
+        return sum(frame.surface_count for animation in self.animations
+                   for frame in animation.frames)
+
+    def snapshot(self):
+
+        # Already frozen, so exporters can snapshot whatever they are given
+        return self
+
+    def build_index(self, writer, reuse_file=None, progress=None):
+
+        animations = []
+        chunks = []
+
+        total_surfaces = self.surface_count
+        written_surfaces = 0
+
+        for animation in self.animations:
+
+            frames = []
+
+            for frame in animation.frames:
+
+                surfaces = []
+
+                for surface in frame.surfaces:
+
+                    if progress is not None:
+                        progress(written_surfaces, total_surfaces)
+
+                    written_surfaces += 1
+
+                    if reuse_file is not None and surface.is_saved_in(reuse_file):
+                        offset, length = surface.chunk
+                    else:
+                        offset, length = writer.add_chunk(surface.to_bytes())
+
+                    chunks.append((surface.surface, surface.version, (offset, length)))
+
+                    surfaces.append({
+                        'name': surface.name,
+                        'id': surface.id,
+                        'opacity': surface.opacity,
+                        'width': surface.width,
+                        'height': surface.height,
+                        'chunk': [offset, length]
+                    })
+
+                frames.append({
+                    'current_surface': frame.current_surface_index,
+                    'duration': frame.duration,
+                    'surfaces': surfaces
+                })
+
+            animations.append({
+                'name': animation.name,
+                'current_frame': animation.current_frame_index,
+                'frames': frames
+            })
+
+        index = {
+            'width': self.width,
+            'height': self.height,
+            'current_animation': self.current_animation_index,
+            'animations': animations
+        }
+
+        return index, chunks
+
+
+class AnimationSnapshot(object):
+    def __init__(self, animation):
+
+        self.name = animation.name
+        self.current_frame_index = animation.current_frame_index
+        self.frames = [FrameSnapshot(frame, animation.sprite) for frame in animation.frames]
+
+    @property
+    def frame_count(self):
+        return len(self.frames)
+
+
+class FrameSnapshot(object):
+    def __init__(self, frame, sprite):
+
+        self.width = sprite.width
+        self.height = sprite.height
+        self.current_surface_index = frame.current_surface_index
+        self.duration = frame.duration
+        self.surfaces = [surface.snapshot() for surface in frame.surfaces]
+
+    @property
+    def surface_count(self):
+        return len(self.surfaces)
+
+    def flatten(self):
+
+        return utils.pixels_to_image(self.flatten_pixels())
+
+    def flatten_pixels(self):
+
+        flattened_pixels = utils.create_pixels(self.width, self.height)
+
+        # Pixels read back from the sprite file are let go once composited, so flattening
+        # frame after frame only holds one frame's layers at a time
+        for surface in self.surfaces:
+            utils.composite_pixels(flattened_pixels, surface.pixels)
+            surface.release()
+
+        return flattened_pixels
+
+
+class SurfaceSnapshot(object):
+    def __init__(self, surface):
+
+        self.surface = surface
+        self.name = surface.name
+        self.id = surface.id
+        self.opacity = surface.opacity
+        self.width = surface.width
+        self.height = surface.height
+        self.version = surface.version
+
+        self._backing = surface._backing
+        self._isSaved = not surface.is_dirty
+
+        # Saved pixels are read back from their chunk when needed, unsaved ones live only in
+        # memory and are shared, copy on write
+        self._pixels = None if self._isSaved else surface.share_pixels(self)
+
+    @property
+    def chunk(self):
+        return self._backing[1:]
+
+    @property
+    def pixels(self):
+
+        if self._pixels is None:
+
+            sprite_file, offset, length = self._backing
+
+            self._pixels = numpy.empty((self.height, self.width, 4), numpy.uint8)
+
+            sprite_file.read_chunk_into(offset, length, self._pixels.reshape(-1))
+
+        return self._pixels
+
+    @property
+    def image(self):
+        return utils.pixels_to_image(self.pixels)
+
+    def release(self):
+
+        # Saved pixels are read back again when next needed
+        if self._isSaved:
+            self._pixels = None
+
+    def is_saved_in(self, sprite_file):
+
+        return self._isSaved and self._backing[0] is sprite_file
+
+    def to_bytes(self):
+
+        if self._pixels is None:
+
+            sprite_file, offset, length = self._backing
+
+            return sprite_file.read_chunk(offset, length)
+
+        return self._pixels.tobytes()
@@ -0,0 +1,383 @@
+# --------------------------------------------------------------------------------------------------
+# Name:             SpriteFile
+# Purpose:          Chunked binary container used to store Sprites on disk (.spr).
+#
+#                   Layout:
+#
+#                   [Header][Chunk 0][Chunk 1]...[Chunk N][Index]
+#
+#                   The Header holds the format version and the position of the Index. Each Chunk
+#                   holds the raw pixel data of one Surface. The Index is a JSON table describing
+#                   the Animation / Frame / Surface structure of the Sprite and where each Surface
+#                   payload lives inside the file.
+#
+# Date:             17/10/26
+# License:
+# --------------------------------------------------------------------------------------------------
+
+import json
+import mmap
+import os
+import struct
+from collections import OrderedDict
+
+import model.appdata as appdata
+
+MAGIC = b'PXEELSPR'
+
+VERSION = 1
+
+CHUNK_ALIGNMENT = 16
+
+# Files are rewritten from scratch once superseded chunks take more room than live data
+COMPACTION_RATIO = 2.0
+COMPACTION_MIN_SIZE = 1024 * 1024
+
+# Magic, Version, Flags, Index Offset, Index Length
+_HEADER = struct.Struct('<8sIIQQ')
+
+
+class SpriteFileError(Exception):
+    pass
+
+
+def is_sprite_file(file_path):
+
+    with open(file_path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class SurfaceCache(object):
+    """
+    Keeps track of the Surfaces that were paged in from a SpriteFile, least recently used
+    first, and pages clean ones back out once their pixels exceed the memory budget.
+    """
+
+    def __init__(self, budget):
+
+        self._budget = budget
+        self._surfaces = OrderedDict()
+        self._size = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    def add(self, surface):
+
+        key = id(surface)
+
+        if key not in self._surfaces:
+            self._surfaces[key] = surface
+            self._size += surface.byte_count
+
+        self._trim(keep=surface)
+
+    def touch(self, surface):
+
+        key = id(surface)
+
+        if key in self._surfaces:
+            self._surfaces.move_to_end(key)
+
+    def discard(self, surface):
+
+        if self._surfaces.pop(id(surface), None) is not None:
+            self._size -= surface.byte_count
+
+    def clear(self):
+
+        self._surfaces.clear()
+        self._size = 0
+
+    def _trim(self, keep):
+
+        for key, surface in list(self._surfaces.items()):
+
+            if self._size <= self._budget:
+                break
+
+            if surface is keep:
+                continue
+
+            # Surfaces pinned for an edit or holding unsaved edits stop being candidates until
+            # they are clean and unpinned again, which adds them back
+            if surface.evict() or surface.is_pinned or surface.is_dirty:
+                del self._surfaces[key]
+                self._size -= surface.byte_count
+
+
+class SpriteFile(object):
+    def __init__(self, file_path):
+
+        self._filePath = file_path
+        self._file = open(file_path, 'rb')
+        self._mapping = None
+
+        try:
+            self._index = self._read_index()
+            self._mapping = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        self._surfaceCache = SurfaceCache(appdata.surface_cache_budget)
+
+    @property
+    def file_path(self):
+        return self._filePath
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def surface_cache(self):
+        return self._surfaceCache
+
+    @property
+    def needs_compaction(self):
+
+        file_size = len(self._mapping)
+
+        if file_size < COMPACTION_MIN_SIZE:
+            return False
+
+        live_size = _HEADER.size
+
+        for animation in self._index['animations']:
+            for frame in animation['frames']:
+                for surface in frame['surfaces']:
+                    live_size += surface['chunk'][1]
+
+        return file_size > live_size * COMPACTION_RATIO
+
+    def is_same_file(self, file_path):
+
+        return os.path.normcase(os.path.abspath(file_path)) == \
+            os.path.normcase(os.path.abspath(self._filePath))
+
+    def read_chunk(self, offset, length):
+
+        if self._mapping is None:
+            raise SpriteFileError('Sprite file is closed')
+
+        if offset + length > len(self._mapping):
+            raise SpriteFileError('Truncated chunk at offset {0}'.format(offset))
+
+        return self._mapping[offset:offset + length]
+
+    def read_chunk_into(self, offset, length, target):
+
+        if self._mapping is None:
+            raise SpriteFileError('Sprite file is closed')
+
+        if offset + length > len(self._mapping):
+            raise SpriteFileError('Truncated chunk at offset {0}'.format(offset))
+
+        with memoryview(self._mapping) as view:
+            with view[offset:offset + length] as chunk:
+                target[:length] = chunk
+
+    def close(self):
+
+        self._surfaceCache.clear()
+
+        self._close_mapping()
+
+    def reopen(self):
+
+        self._close_mapping()
+        self._open_mapping()
+
+    def refresh(self, index):
+
+        # Chunks appended since the file was mapped lie past the end of the current mapping
+        self._index = index
+        self.reopen()
+
+    def _open_mapping(self):
+
+        self._file = open(self._filePath, 'rb')
+        self._mapping = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _close_mapping(self):
+
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_index(self):
+
+        header = self._file.read(_HEADER.size)
+
+        if len(header) != _HEADER.size:
+            raise SpriteFileError('Invalid sprite file header')
+
+        magic, version, _, index_offset, index_length = _HEADER.unpack(header)
+
+        if magic != MAGIC:
+            raise SpriteFileError('Not a sprite file')
+
+        if version > VERSION:
+            raise SpriteFileError('Unsupported sprite file version: {0}'.format(version))
+
+        self._file.seek(index_offset)
+
+        index_data = self._file.read(index_length)
+
+        if len(index_data) != index_length:
+            raise SpriteFileError('Truncated sprite file index')
+
+        return json.loads(index_data.decode('utf-8'))
+
+
+class _ChunkWriter(object):
+    def __init__(self, file, position):
+
+        self._file = file
+        self._position = position
+
+    def add_chunk(self, data):
+
+        padding = -self._position % CHUNK_ALIGNMENT
+
+        if padding:
+            self._file.write(b'\0' * padding)
+            self._position += padding
+
+        offset = self._position
+        length = len(data)
+
+        self._file.write(data)
+        self._position += length
+
+        return offset, length
+
+    def _write_index(self, index):
+
+        index_data = json.dumps(index, separators=(',', ':')).encode('utf-8')
+
+        index_offset = self._position
+
+        self._file.write(index_data)
+        self._position += len(index_data)
+
+        return index_offset, len(index_data)
+
+    def _write_header(self, index_offset, index_length):
+
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(MAGIC, VERSION, 0, index_offset, index_length))
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+class SpriteFileWriter(_ChunkWriter):
+    """
+    Writes a new sprite file. Data is written to a temporary file that only replaces the
+    target path on commit, once the index and header are safely on disk, so an interrupted
+    save never leaves a half written file behind.
+    """
+
+    def __init__(self, file_path):
+
+        self._filePath = file_path
+        self._tempPath = file_path + '.tmp'
+
+        super(SpriteFileWriter, self).__init__(open(self._tempPath, 'wb'), _HEADER.size)
+
+        self._file.write(b'\0' * _HEADER.size)
+
+    def finish(self, index):
+
+        index_offset, index_length = self._write_index(index)
+
+        self._file.flush()
+
+        self._write_header(index_offset, index_length)
+
+        self._file.close()
+        self._file = None
+
+    def commit(self):
+
+        os.replace(self._tempPath, self._filePath)
+
+    def abort(self):
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        if os.path.exists(self._tempPath):
+            os.remove(self._tempPath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is not None:
+            self.abort()
+
+        return False
+
+
+class SpriteFileUpdater(_ChunkWriter):
+    """
+    Appends chunks and a new index to the end of an existing sprite file. Chunks that did
+    not change are referenced by the new index where they already are. The header is only
+    repointed to the new index once everything else is on disk, so until then the file
+    still describes the previous save.
+    """
+
+    def __init__(self, file_path):
+
+        file = open(file_path, 'r+b')
+        file.seek(0, os.SEEK_END)
+
+        super(SpriteFileUpdater, self).__init__(file, file.tell())
+
+        self._originalSize = self._position
+
+    def finish(self, index):
+
+        index_offset, index_length = self._write_index(index)
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        self._write_header(index_offset, index_length)
+
+        self._file.close()
+        self._file = None
+
+    def abort(self):
+
+        if self._file is None:
+            return
+
+        try:
+            self._file.truncate(self._originalSize)
+        except OSError:
+            # Trailing bytes past the last index are ignored by readers anyway
+            pass
+
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is not None:
+            self.abort()
+
+        return False
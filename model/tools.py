@@ -6,6 +6,7 @@
 # License:          
 # --------------------------------------------------------------------------------------------------
 
+import numpy
 from PyQt5.QtCore import Qt, QPoint, QRect
 from PyQt5.QtGui import QPen, QColor, QIcon, QPixmap, QPainter
 
@@ -321,25 +322,27 @@ class Pen(Tool):
 
         if ink is not None and color is not None:
 
-            painter = QPainter()
+            start = mouse_state.last_sprite_pos if not just_pressed else mouse_state.sprite_pos
+            end = mouse_state.sprite_pos
 
-            painter.begin(canvas.sprite_object.active_surface)
+            changed_rect = QRect(min(start.x(), end.x()), min(start.y(), end.y()),
+                                 abs(end.x() - start.x()) + size, abs(end.y() - start.y()) + size)
+
+            canvas.sprite_object.sprite.history.capture(changed_rect.x(), changed_rect.y(),
+                                                        changed_rect.width(),
+                                                        changed_rect.height())
+
+            pixels = canvas.sprite_object.active_surface_pixels
 
             if delta_x > 1 or delta_y > 1:
                 drawing.draw_line(mouse_state.last_sprite_pos, mouse_state.sprite_pos, size, ink,
-                                  color, painter)
+                                  color, pixels)
             elif delta_x == 1 or delta_y == 1 or just_pressed:
 
-                ink.blit(mouse_state.sprite_pos.x(), mouse_state.sprite_pos.y(), size, size, color,
-                         painter)
-
-            self._canvas.surfaceChanging.emit()
-
-            painter.end()
-
-
-
+                ink.blit_many(numpy.array([end.x()]), numpy.array([end.y()]), size, size, color,
+                              pixels)
 
+            self._canvas.surfaceChanging.emit(changed_rect)
 
     def on_mouse_press(self):
 
@@ -347,6 +350,10 @@ class Pen(Tool):
 
         self._isDrawing = True
 
+        sprite = self._canvas.sprite_object.sprite
+
+        sprite.history.begin_edit(sprite.current_surface, self._name)
+
         self._blit(just_pressed=True)
 
     def on_mouse_move(self):
@@ -382,6 +389,8 @@ class Pen(Tool):
 
         self._lockHorizontal = self._lockVertical = False
 
+        self._canvas.sprite_object.sprite.history.end_edit()
+
         self._canvas.surfaceChanged.emit()
 
 # =================================================================================================
@@ -398,6 +407,10 @@ class Filler(Tool):
 
         self._refreshWaitTime = 500
 
+        self.add_ranged_property('tolerance', 0, 255, 0, 'Tolerance')
+        self.add_property('contiguous', True, 'Contiguous')
+        self.add_property('diagonal', False, 'Spread Diagonally')
+
     def draw_untransformed(self, painter):
 
         if not self._enablePointerDraw:
@@ -475,9 +488,9 @@ class Filler(Tool):
 
         if image is not None:
 
-            image_data = canvas.sprite_object.active_surface_pixel_data
+            pixels = canvas.sprite_object.active_surface_pixels
 
-            if image_data is None:
+            if pixels is None:
                 return
 
             color = None
@@ -491,9 +504,31 @@ class Filler(Tool):
                 color = canvas.secondary_color
 
             if color is not None:
-                quickpixler.floodFill(image_data, mouse_pos.x(), mouse_pos.y(), image.width(),
-                                      image.height(),
-                                      color.red(), color.green(), color.blue())
+
+                fill_arguments = (pixels, mouse_pos.x(), mouse_pos.y(),
+                                  color.red(), color.green(), color.blue(), color.alpha())
+
+                fill_options = {
+                    'tolerance': self.property_value('tolerance'),
+                    'contiguous': self.property_value('contiguous'),
+                    'diagonal': self.property_value('diagonal')
+                }
+
+                # Where a fill spreads is found first, so only the tiles it covers are kept for
+                # undoing it
+                filled_region = quickpixler.fillBounds(*fill_arguments, **fill_options)
+
+                if filled_region is None:
+                    return
+
+                history = canvas.sprite_object.sprite.history
+
+                history.begin_edit(canvas.sprite_object.sprite.current_surface, self._name)
+                history.capture(*filled_region)
+
+                quickpixler.floodFill(*fill_arguments, **fill_options)
+
+                history.end_edit(filled_region)
 
                 self._canvas.surfaceChanged.emit()
 
@@ -527,6 +562,11 @@ class Manipulator(Tool):
         self._cutOnSelection = True
         self._doEraseOnSelectionMove = False
 
+        # Layers the current drag moves, and their pixels as they were when it started, moved
+        # from on each step
+        self._moveSurfaces = None
+        self._moveSources = None
+
         self._selectionBorderPen = QPen()
         self._selectionBorderPen.setWidth(0)
         self._selectionBorderPen.setStyle(Qt.DashLine)
@@ -538,6 +578,9 @@ class Manipulator(Tool):
 
         self._state = ManipulatorState.Idle
 
+        self.add_property('wrap', True, 'Wrap Around')
+        self.add_property('alllayers', False, 'Move All Layers')
+
     def draw_transformed(self, painter):
 
         if not self._selectionRectangle.isEmpty():
@@ -619,7 +662,21 @@ class Manipulator(Tool):
 
             if self._selectionRectangle.isEmpty():
 
-                self._state = ManipulatorState.MovingPixels
+                sprite = canvas.sprite_object.sprite
+
+                if sprite.current_surface is not None:
+
+                    self._state = ManipulatorState.MovingPixels
+
+                    if self.property_value('alllayers'):
+                        self._moveSurfaces = list(sprite.current_animation.current_frame.surfaces)
+                    else:
+                        self._moveSurfaces = [sprite.current_surface]
+
+                    self._moveSources = [surface.pixels.copy() for surface in self._moveSurfaces]
+
+                    # The pixels moves start from are what undoing goes back to
+                    sprite.history.begin_group_edit(self._moveSurfaces, 'Move', self._moveSources)
 
             else:
 
@@ -655,22 +712,31 @@ class Manipulator(Tool):
             self._curMousePos.setX(round(mouse_pos.x()))
             self._curMousePos.setY(round(mouse_pos.y()))
 
-            dx = self._curMousePos.x() - self._lastMousePos.x()
-            dy = self._curMousePos.y() - self._lastMousePos.y()
+            if self._curMousePos == self._lastMousePos:
+                return
 
+            pixels_list = [surface.pixels for surface in self._moveSurfaces]
 
-            image = canvas.sprite_object.active_surface
+            if any(pixels.shape != source.shape
+                   for pixels, source in zip(pixels_list, self._moveSources)):
+                return
 
-            if image is not None:
+            # Always moved from where the drag started, so pixels clipped at an edge come back
+            # when dragged back in. Layers are spread over threads when moved together
+            dx = self._curMousePos.x() - self._pressMousePos.x()
+            dy = self._curMousePos.y() - self._pressMousePos.y()
 
-                image_data = canvas.sprite_object.active_surface_pixel_data
+            quickpixler.movePixelsMany(pixels_list, dx, dy, self._moveSources,
+                                       wrap=self.property_value('wrap'))
 
-                if image_data is None:
-                    return
+            # The canvas marks the current layer changed, the others moved along are marked here
+            current_surface = canvas.sprite_object.sprite.current_surface
 
-                quickpixler.movePixels(image_data, image.width(), image.height(), dx, dy)
+            for surface in self._moveSurfaces:
+                if surface is not current_surface:
+                    surface.mark_dirty()
 
-                self._canvas.surfaceChanging.emit()
+            self._canvas.surfaceChanging.emit(QRect())
 
         elif self._state == ManipulatorState.Selecting:
             top_left = QPoint(round(min(mouse_pos.x(), self._pressMousePos.x())),
@@ -709,6 +775,9 @@ class Manipulator(Tool):
                     self._doEraseOnSelectionMove = True
 
         elif self._state == ManipulatorState.MovingPixels:
+            self._moveSurfaces = None
+            self._moveSources = None
+            self._canvas.sprite_object.sprite.history.end_edit()
             self._canvas.surfaceChanged.emit()
 
         self._state = ManipulatorState.Idle
@@ -774,12 +843,20 @@ class Manipulator(Tool):
         sprite_rect_to_erase = self._canvas.map_global_rect_to_sprite_local_rect(
             self._selectionRectangle)
 
+        sprite = self._canvas.sprite_object.sprite
+
+        sprite.history.begin_edit(sprite.current_surface, 'Cut')
+        sprite.history.capture(sprite_rect_to_erase.left(), sprite_rect_to_erase.top(),
+                               sprite_rect_to_erase.width(), sprite_rect_to_erase.height())
+
         drawing.erase_area(self._canvas.sprite_object.active_surface,
                            sprite_rect_to_erase.left(),
                            sprite_rect_to_erase.top(),
                            sprite_rect_to_erase.width(),
                            sprite_rect_to_erase.height())
 
+        sprite.history.end_edit()
+
         self._canvas.surfaceChanged.emit()
 
     def _paste_selection(self):
@@ -789,6 +866,12 @@ class Manipulator(Tool):
 
         sprite_rect = self._canvas.map_global_rect_to_sprite_local_rect(self._selectionRectangle)
 
+        sprite = self._canvas.sprite_object.sprite
+
+        sprite.history.begin_edit(sprite.current_surface, 'Paste')
+        sprite.history.capture(sprite_rect.left(), sprite_rect.top(),
+                               sprite_rect.width(), sprite_rect.height())
+
         painter = QPainter()
         painter.begin(self._canvas.sprite_object.active_surface)
 
@@ -798,4 +881,6 @@ class Manipulator(Tool):
 
         painter.end()
 
+        sprite.history.end_edit()
+
         self._canvas.surfaceChanged.emit()
\ No newline at end of file
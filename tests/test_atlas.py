@@ -0,0 +1,76 @@
+# --------------------------------------------------------------------------------------------------
+# Name:             Atlas Tests
+# Purpose:          Atlas export of sprites whose animations share a name.
+#
+# Date:             18/10/26
+# License:
+# --------------------------------------------------------------------------------------------------
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from xml.etree import ElementTree
+
+from model.atlas import export_atlas
+from model.sprite import Sprite
+
+
+class AtlasExportTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self._directory = tempfile.mkdtemp(prefix='pxeel-test-')
+
+        self._sprite = Sprite.create(8, 8)
+
+        for _ in range(2):
+            self._sprite.add_animation()
+            self._sprite.current_animation.add_empty_frame()
+
+        # Two animations named alike, then one named as the first would be told apart
+        for animation, name, frame_count in zip(self._sprite.animations,
+                                                ['Walk', 'Walk', 'Walk_0'], [2, 3, 1]):
+
+            animation.name = name
+
+            while animation.frame_count < frame_count:
+                animation.add_empty_frame()
+
+            for value, frame in enumerate(animation.frames):
+                frame.current_surface.pixels[value:, value:] = 255
+                frame.current_surface.mark_dirty()
+
+    def tearDown(self):
+
+        self._sprite.close()
+
+        shutil.rmtree(self._directory)
+
+    def test_animations_sharing_a_name_are_kept_apart(self):
+
+        export_atlas(self._sprite, self._directory)
+
+        with open(os.path.join(self._directory, 'atlas.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+
+        animations = manifest['animations']
+
+        self.assertEqual(len(animations), 3)
+        self.assertEqual(sorted(len(names) for names in animations.values()), [1, 2, 3])
+        self.assertEqual(animations['Walk_0'], ['Walk_0_0000'])
+
+        frame_names = [name for names in animations.values() for name in names]
+
+        self.assertEqual(len(set(frame_names)), 6)
+        self.assertEqual(set(manifest['frames']), set(frame_names))
+
+        sub_textures = ElementTree.parse(os.path.join(self._directory, 'atlas.xml')).getroot()
+
+        self.assertEqual(sorted(sub_texture.get('name') for sub_texture in sub_textures),
+                         sorted(frame_names))
+
+
+if __name__ == '__main__':
+    unittest.main()
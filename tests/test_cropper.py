@@ -0,0 +1,72 @@
+# --------------------------------------------------------------------------------------------------
+# Name:             Cropper Tests
+# Purpose:          Trimming down to the pixels with some alpha, and where the trimmed pixels sit
+#                   within the original ones.
+#
+# Date:             18/10/26
+# License:
+# --------------------------------------------------------------------------------------------------
+
+import unittest
+
+import numpy
+
+import helpers.cropper as cropper
+
+
+class TrimTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self._pixels = numpy.zeros((20, 30, 4), numpy.uint8)
+
+    def test_offsets(self):
+
+        # Barely visible pixels count as covered, color without alpha doesn't
+        self._pixels[4, 7, 3] = 1
+        self._pixels[12:15, 20:25] = 255
+        self._pixels[0, 0, :3] = 255
+
+        trimmed, x, y = cropper.trim(self._pixels)
+
+        self.assertEqual((x, y), (7, 4))
+        self.assertEqual(trimmed.shape, (11, 18, 4))
+        self.assertEqual(cropper.alpha_bounds(self._pixels), (7, 4, 18, 11))
+
+        numpy.testing.assert_array_equal(trimmed, self._pixels[4:15, 7:25])
+
+        # A view, not a copy
+        self.assertTrue(numpy.shares_memory(trimmed, self._pixels))
+
+    def test_fully_covered_is_kept_whole(self):
+
+        self._pixels[..., 3] = 255
+
+        trimmed, x, y = cropper.trim(self._pixels)
+
+        self.assertEqual((x, y), (0, 0))
+        self.assertEqual(trimmed.shape, self._pixels.shape)
+
+    def test_edge_pixels(self):
+
+        self._pixels[19, 29, 3] = 255
+
+        trimmed, x, y = cropper.trim(self._pixels)
+
+        self.assertEqual((x, y), (29, 19))
+        self.assertEqual(trimmed.shape, (1, 1, 4))
+
+    def test_fully_transparent(self):
+
+        self._pixels[..., :3] = 128
+
+        self.assertIsNone(cropper.alpha_bounds(self._pixels))
+
+        trimmed, x, y = cropper.trim(self._pixels)
+
+        self.assertEqual((x, y), (0, 0))
+        self.assertEqual(trimmed.shape, (1, 1, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
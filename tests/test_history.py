@@ -0,0 +1,224 @@
+# --------------------------------------------------------------------------------------------------
+# Name:             History Tests
+# Purpose:          Undo / Redo round trips, with edits held in memory, spilled to the temporary
+#                   file and read back after the spill file was compacted.
+#
+# Date:             18/10/26
+# License:
+# --------------------------------------------------------------------------------------------------
+
+import unittest
+from unittest import mock
+
+import numpy
+
+import model.appdata as appdata
+import model.history as history_module
+from model.history import UndoHistory
+from model.sprite import Surface
+
+
+class UndoHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self._surface = Surface('Layer', 100, 70)
+        self._history = UndoHistory()
+
+        # Pixels as they were before each edit, then after the last one
+        self._states = []
+
+    def tearDown(self):
+
+        self._history.clear()
+
+    def _edit(self, x, y, width, height, value, keep_before=False):
+
+        before = self._surface.pixels.copy()
+
+        self._states.append(before)
+
+        self._history.begin_edit(self._surface, 'Edit', before=before if keep_before else None)
+
+        if not keep_before:
+            self._history.capture(x, y, width, height)
+
+        self._surface.pixels[y:y + height, x:x + width] = value
+        self._surface.mark_dirty()
+
+        return self._history.end_edit()
+
+    def _assert_pixels(self, expected):
+
+        numpy.testing.assert_array_equal(self._surface.pixels, expected)
+
+    def _assert_round_trip(self):
+
+        final = self._surface.pixels.copy()
+
+        for expected in reversed(self._states):
+            self.assertIsNotNone(self._history.undo())
+            self._assert_pixels(expected)
+
+        self.assertFalse(self._history.can_undo)
+
+        for expected in self._states[1:] + [final]:
+            self.assertIsNotNone(self._history.redo())
+            self._assert_pixels(expected)
+
+        self.assertFalse(self._history.can_redo)
+
+    def test_undo_redo_in_memory(self):
+
+        self._edit(0, 0, 10, 10, 50)
+        self._edit(5, 5, 60, 40, 120)
+        self._edit(90, 60, 10, 10, 255)
+
+        self.assertTrue(all(entry.is_in_memory for entry in self._history._undoEntries))
+
+        self._assert_round_trip()
+
+    def test_edit_only_keeps_touched_tiles(self):
+
+        entry = self._edit(1, 1, 3, 3, 80)
+
+        self.assertEqual(len(entry._layout), 1)
+
+        # Edits handing over the pixels as they were are diffed down to the tiles that changed
+        entry = self._edit(40, 40, 2, 2, 90, keep_before=True)
+
+        self.assertEqual(len(entry._layout), 1)
+
+        self._assert_round_trip()
+
+    def test_unchanged_edit_is_not_recorded(self):
+
+        self._history.begin_edit(self._surface, 'Nothing')
+        self._history.capture(0, 0, 10, 10)
+
+        self.assertIsNone(self._history.end_edit())
+        self.assertFalse(self._history.can_undo)
+
+    def test_undo_redo_across_spill(self):
+
+        with mock.patch.object(appdata, 'undo_memory_steps', 2):
+
+            for value in range(1, 8):
+                self._edit(value * 7, value * 5, 30, 20, value * 30)
+
+            entries = self._history._undoEntries
+
+            self.assertEqual([entry.is_in_memory for entry in entries],
+                             [False] * 5 + [True] * 2)
+            self.assertGreater(self._history._spill.size, 0)
+
+            self._assert_round_trip()
+
+            # Undone twice over, read back from the spill each time
+            self._assert_round_trip()
+
+    def test_undo_redo_after_spill_compaction(self):
+
+        noise = numpy.random.default_rng(0)
+
+        compact = history_module.HistorySpill.compact
+
+        with mock.patch.object(appdata, 'undo_memory_steps', 1), \
+                mock.patch.object(history_module, 'SPILL_COMPACTION_MIN_SIZE', 0), \
+                mock.patch.object(history_module.HistorySpill, 'compact', autospec=True,
+                                  side_effect=compact) as compact_spy:
+
+            # Noise doesn't compress, so these edits take up most of the spill
+            for _ in range(5):
+                self._edit(0, 0, 100, 70, noise.integers(0, 256, (70, 100, 4), numpy.uint8))
+
+            # Undoing most of the way then editing again drops the redo entries, leaving their
+            # data in the spill to compact away
+            for _ in range(4):
+                self._history.undo()
+
+            self._states = self._states[:1]
+
+            compact_spy.assert_not_called()
+
+            for value in range(6, 9):
+                self._edit(value, value, 50, 50, value * 20)
+
+            compact_spy.assert_called()
+
+            self._assert_round_trip()
+
+    def test_group_edit_is_one_step(self):
+
+        other_surface = Surface('Other', 100, 70)
+        untouched_surface = Surface('Untouched', 100, 70)
+
+        surfaces = [self._surface, other_surface, untouched_surface]
+        befores = [surface.pixels.copy() for surface in surfaces]
+
+        self._history.begin_group_edit(surfaces, 'Move', befores)
+
+        self.assertTrue(all(surface.is_pinned for surface in surfaces))
+
+        self._surface.pixels[10:20, 10:20] = 40
+        other_surface.pixels[60:70, 90:100] = 80
+
+        entry = self._history.end_edit()
+
+        self.assertEqual(entry.surfaces, [self._surface, other_surface])
+        self.assertFalse(any(surface.is_pinned for surface in surfaces))
+
+        afters = [surface.pixels.copy() for surface in surfaces]
+
+        self.assertIs(self._history.undo(), entry)
+
+        for surface, before in zip(surfaces, befores):
+            numpy.testing.assert_array_equal(surface.pixels, before)
+
+        self.assertFalse(self._history.can_undo)
+
+        self._history.redo()
+
+        for surface, after in zip(surfaces, afters):
+            numpy.testing.assert_array_equal(surface.pixels, after)
+
+        # Resizing any of them makes the whole step inapplicable
+        other_surface.resize(50, 50)
+
+        self.assertIsNone(self._history.undo())
+
+    def test_new_edit_drops_redo(self):
+
+        self._edit(0, 0, 10, 10, 50)
+        self._edit(0, 0, 10, 10, 60)
+
+        self._history.undo()
+
+        self.assertTrue(self._history.can_redo)
+
+        self._edit(20, 20, 10, 10, 70)
+
+        self.assertFalse(self._history.can_redo)
+        self.assertEqual(len(self._history.undo_labels), 2)
+
+    def test_edits_of_resized_surface_are_skipped(self):
+
+        other_surface = Surface('Other', 20, 20)
+
+        self._edit(0, 0, 10, 10, 50)
+
+        self._history.begin_edit(other_surface, 'Other Edit')
+        self._history.capture(0, 0, 5, 5)
+        other_surface.pixels[:5, :5] = 60
+        self._history.end_edit()
+
+        # Tiles of the first edit no longer line up once its surface changed size
+        self._surface.resize(50, 50)
+
+        self.assertIs(self._history.undo().surface, other_surface)
+        self.assertIsNone(self._history.undo())
+        self.assertFalse(self._history.can_undo)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+# --------------------------------------------------------------------------------------------------
+# Name:             Packer Tests
+# Purpose:          Every packing engine keeps rectangles apart by their padding, with room for
+#                   their extrusion, inside the sheet size it reports.
+#
+# Date:             18/10/26
+# License:
+# --------------------------------------------------------------------------------------------------
+
+import itertools
+import unittest
+
+import numpy
+
+from helpers.packer import PACKERS, MaxRectsPacker, SkylinePacker
+
+
+class PackerTest(unittest.TestCase):
+
+    def setUp(self):
+
+        noise = numpy.random.default_rng(0)
+
+        self._sizes = [(int(width), int(height))
+                       for width, height in noise.integers(1, 40, (120, 2))]
+
+    def _pack_all(self, packer, sizes):
+
+        placements = []
+
+        for width, height in sizes:
+
+            placement = packer.pack(width, height)
+
+            self.assertIsNotNone(placement, (width, height))
+
+            if placement.rotated:
+                self.assertEqual((placement.width, placement.height), (height, width))
+            else:
+                self.assertEqual((placement.width, placement.height), (width, height))
+
+            placements.append(placement)
+
+        return placements
+
+    def _assert_laid_out(self, packer, placements, max_width, max_height, padding, extrude):
+
+        # Rectangles with their extrusion around them
+        rects = [(placement.x - extrude, placement.y - extrude,
+                  placement.x + placement.width + extrude,
+                  placement.y + placement.height + extrude) for placement in placements]
+
+        used_width = packer.actual_packing_area_width()
+        used_height = packer.actual_packing_area_height()
+
+        self.assertLessEqual(used_width, max_width)
+        self.assertLessEqual(used_height, max_height)
+
+        for left, top, right, bottom in rects:
+            self.assertGreaterEqual(left, 0)
+            self.assertGreaterEqual(top, 0)
+            self.assertLessEqual(right, used_width)
+            self.assertLessEqual(bottom, used_height)
+
+        # Apart by at least the padding along one axis or the other
+        for first, second in itertools.combinations(rects, 2):
+
+            gap_x = max(second[0] - first[2], first[0] - second[2])
+            gap_y = max(second[1] - first[3], first[1] - second[3])
+
+            self.assertGreaterEqual(max(gap_x, gap_y), padding, (first, second))
+
+    def test_rectangles_do_not_overlap(self):
+
+        for name, padding, extrude, rotation in itertools.product(
+                sorted(PACKERS), (0, 2), (0, 1), (False, True)):
+
+            with self.subTest(packer=name, padding=padding, extrude=extrude, rotation=rotation):
+
+                packer = PACKERS[name](1024, 1024, padding=padding, extrude=extrude,
+                                       allow_rotation=rotation)
+
+                placements = self._pack_all(packer, self._sizes)
+
+                self._assert_laid_out(packer, placements, 1024, 1024, padding, extrude)
+
+    def test_fills_sheet_exactly(self):
+
+        # Sixteen squares fill a sheet of four by four, with padding only between them
+        for packer_class in (MaxRectsPacker, SkylinePacker):
+            for padding in (0, 3):
+
+                with self.subTest(packer=packer_class.__name__, padding=padding):
+
+                    size = 4 * 16 + 3 * padding
+
+                    packer = packer_class(size, size, padding=padding)
+
+                    placements = self._pack_all(packer, [(16, 16)] * 16)
+
+                    self._assert_laid_out(packer, placements, size, size, padding, 0)
+
+                    self.assertEqual((packer.actual_packing_area_width(),
+                                      packer.actual_packing_area_height()), (size, size))
+
+                    self.assertIsNone(packer.pack(1, 1))
+
+    def test_too_large_is_refused(self):
+
+        for packer_class in (MaxRectsPacker, SkylinePacker):
+
+            with self.subTest(packer=packer_class.__name__):
+
+                # Extrusion has to fit within the sheet as well
+                packer = packer_class(64, 64, extrude=1)
+
+                self.assertIsNone(packer.pack(64, 10))
+                self.assertIsNotNone(packer.pack(62, 10))
+
+                packer = packer_class(64, 32, allow_rotation=True)
+
+                self.assertTrue(packer.pack(10, 64).rotated)
+
+    def test_power_of_two_size(self):
+
+        packer = MaxRectsPacker(256, 256, power_of_two=True)
+
+        self._pack_all(packer, [(33, 20)])
+
+        self.assertEqual((packer.actual_packing_area_width(),
+                          packer.actual_packing_area_height()), (64, 32))
+
+
+if __name__ == '__main__':
+    unittest.main()
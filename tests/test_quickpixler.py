@@ -0,0 +1,238 @@
+# --------------------------------------------------------------------------------------------------
+# Name:             Quickpixler Tests
+# Purpose:          Checks the floodFill kernel against a plain Python fill, in every mode, and
+#                   the batch movePixelsMany against movePixels one surface at a time.
+#
+# Date:             18/10/26
+# License:
+# --------------------------------------------------------------------------------------------------
+
+import unittest
+from collections import deque
+
+import numpy
+from PyQt5.QtGui import QColor, QImage, QPainter
+
+import helpers.utils as utils
+
+try:
+    import helpers.quickpixler as quickpixler
+except ImportError:
+    quickpixler = None
+
+
+def _reference_fill(pixels, x, y, fill, tolerance, contiguous, diagonal):
+
+    # Pixels within tolerance of the seed on every channel, reached from it one neighbour at a
+    # time when contiguous
+    words = pixels.view(numpy.uint32)[..., 0]
+
+    channels = pixels.astype(numpy.int32)
+    matching = (numpy.abs(channels - channels[y, x]) <= tolerance).all(axis=2)
+
+    if contiguous:
+
+        filled = numpy.zeros_like(matching)
+        filled[y, x] = True
+
+        steps = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+        if diagonal:
+            steps += [(-1, -1), (1, -1), (-1, 1), (1, 1)]
+
+        queue = deque([(x, y)])
+
+        while len(queue) > 0:
+
+            pixel_x, pixel_y = queue.popleft()
+
+            for step_x, step_y in steps:
+
+                next_x, next_y = pixel_x + step_x, pixel_y + step_y
+
+                if 0 <= next_x < words.shape[1] and 0 <= next_y < words.shape[0] and \
+                        matching[next_y, next_x] and not filled[next_y, next_x]:
+                    filled[next_y, next_x] = True
+                    queue.append((next_x, next_y))
+
+    else:
+        filled = matching
+
+    result = pixels.copy()
+    result[filled] = fill
+
+    return result
+
+
+@unittest.skipIf(quickpixler is None, 'quickpixler extension is not built')
+class FloodFillTest(unittest.TestCase):
+
+    def setUp(self):
+
+        noise = numpy.random.default_rng(0)
+
+        # Few distinct colors, with near ones for the tolerance to merge, in regions that only
+        # touch diagonally here and there
+        palette = numpy.array([[0, 0, 0, 0], [20, 40, 60, 255], [24, 36, 64, 255],
+                               [200, 100, 50, 255]], numpy.uint8)
+
+        self._pixels = palette[noise.integers(0, len(palette), (37, 53))]
+
+    def _assert_fill(self, x, y, color, tolerance=0, contiguous=True, diagonal=False):
+
+        pixels = self._pixels.copy()
+
+        fill = utils.color_to_pixel(color)
+
+        expected = _reference_fill(pixels, x, y, fill, tolerance, contiguous, diagonal)
+
+        arguments = (x, y, color.red(), color.green(), color.blue(), color.alpha())
+        options = {'tolerance': tolerance, 'contiguous': contiguous, 'diagonal': diagonal}
+
+        bounds = quickpixler.fillBounds(pixels, *arguments, **options)
+
+        numpy.testing.assert_array_equal(pixels, self._pixels)
+
+        self.assertEqual(quickpixler.floodFill(pixels, *arguments, **options), bounds)
+
+        numpy.testing.assert_array_equal(pixels, expected)
+
+        changed_rows, changed_columns = numpy.nonzero((pixels != self._pixels).any(axis=2))
+
+        if len(changed_rows) == 0:
+            self.assertIsNone(bounds)
+            return
+
+        left, top = changed_columns.min(), changed_rows.min()
+
+        self.assertEqual(bounds, (left, top, changed_columns.max() - left + 1,
+                                  changed_rows.max() - top + 1))
+
+    def test_every_mode_matches_reference(self):
+
+        for tolerance in (0, 5, 255):
+            for contiguous in (True, False):
+                for diagonal in (False, True):
+                    for x, y in ((0, 0), (26, 18), (52, 36)):
+
+                        with self.subTest(tolerance=tolerance, contiguous=contiguous,
+                                          diagonal=diagonal, x=x, y=y):
+                            self._assert_fill(x, y, QColor(90, 180, 30), tolerance, contiguous,
+                                              diagonal)
+
+    def test_fill_with_seed_color_changes_nothing(self):
+
+        pixels = self._pixels.copy()
+
+        blue, green, red, alpha = (int(channel) for channel in pixels[5, 5])
+
+        self.assertIsNone(quickpixler.floodFill(pixels, 5, 5, red, green, blue, alpha))
+        self.assertIsNone(quickpixler.floodFill(pixels, 5, 5, red, green, blue, alpha,
+                                                contiguous=False))
+
+        numpy.testing.assert_array_equal(pixels, self._pixels)
+
+    def test_seed_outside_does_nothing(self):
+
+        pixels = self._pixels.copy()
+
+        self.assertIsNone(quickpixler.floodFill(pixels, -1, 0, 255, 0, 0))
+        self.assertIsNone(quickpixler.fillBounds(pixels, 0, 37, 255, 0, 0))
+
+        numpy.testing.assert_array_equal(pixels, self._pixels)
+
+    def test_translucent_fill_is_premultiplied_as_painted(self):
+
+        for color in (QColor(255, 128, 7, 128), QColor(33, 200, 250, 1), QColor(10, 20, 30, 0)):
+
+            with self.subTest(color=color.getRgb()):
+
+                self._assert_fill(26, 18, color, contiguous=False)
+
+                # A stroke of the same color, as QPainter draws it
+                image = QImage(1, 1, QImage.Format_ARGB32_Premultiplied)
+
+                painter = QPainter(image)
+                painter.setCompositionMode(QPainter.CompositionMode_Source)
+                painter.fillRect(0, 0, 1, 1, color)
+                painter.end()
+
+                pixels = numpy.zeros((1, 1, 4), numpy.uint8)
+
+                quickpixler.floodFill(pixels, 0, 0, color.red(), color.green(), color.blue(),
+                                      color.alpha())
+
+                numpy.testing.assert_array_equal(pixels, utils.image_to_pixels(image))
+
+
+@unittest.skipIf(quickpixler is None, 'quickpixler extension is not built')
+class MovePixelsManyTest(unittest.TestCase):
+
+    def setUp(self):
+
+        noise = numpy.random.default_rng(0)
+
+        self._pixelsList = [noise.integers(0, 256, (height, width, 4), numpy.uint8)
+                            for width, height in ((31, 17), (64, 64), (5, 90), (31, 17))]
+
+    def test_matches_one_at_a_time(self):
+
+        for wrap in (True, False):
+            for shift_x, shift_y in ((0, 0), (3, -2), (-40, 7), (100, 100)):
+
+                with self.subTest(wrap=wrap, shift_x=shift_x, shift_y=shift_y):
+
+                    expected = [pixels.copy() for pixels in self._pixelsList]
+
+                    for pixels in expected:
+                        quickpixler.movePixels(pixels, shift_x, shift_y, wrap=wrap)
+
+                    moved = [pixels.copy() for pixels in self._pixelsList]
+
+                    quickpixler.movePixelsMany(moved, shift_x, shift_y, wrap=wrap)
+
+                    for moved_pixels, expected_pixels in zip(moved, expected):
+                        numpy.testing.assert_array_equal(moved_pixels, expected_pixels)
+
+    def test_moves_from_sources(self):
+
+        sources = [pixels.copy() for pixels in self._pixelsList]
+        moved = [numpy.zeros_like(pixels) for pixels in self._pixelsList]
+
+        # Moved out past the edge and back from the same sources, nothing is lost
+        quickpixler.movePixelsMany(moved, 50, 0, sources, wrap=False)
+        quickpixler.movePixelsMany(moved, 0, 0, sources, wrap=False)
+
+        for moved_pixels, source in zip(moved, sources):
+            numpy.testing.assert_array_equal(moved_pixels, source)
+
+        quickpixler.movePixelsMany(moved, 4, 1, sources, wrap=True)
+
+        for moved_pixels, source in zip(moved, sources):
+
+            expected = source.copy()
+            quickpixler.movePixels(expected, 4, 1, wrap=True)
+
+            numpy.testing.assert_array_equal(moved_pixels, expected)
+
+    def test_mismatched_sources_are_refused(self):
+
+        moved = [pixels.copy() for pixels in self._pixelsList]
+
+        with self.assertRaises(ValueError):
+            quickpixler.movePixelsMany(moved, 1, 1, moved[:1])
+
+        with self.assertRaises(ValueError):
+            quickpixler.movePixelsMany(moved, 1, 1, list(reversed(moved)))
+
+        with self.assertRaises(ValueError):
+            quickpixler.movePixelsMany(moved, 1, 1, moved)
+
+        for moved_pixels, pixels in zip(moved, self._pixelsList):
+            numpy.testing.assert_array_equal(moved_pixels, pixels)
+
+        quickpixler.movePixelsMany([], 1, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
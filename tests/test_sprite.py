@@ -0,0 +1,114 @@
+# --------------------------------------------------------------------------------------------------
+# Name:             Sprite Tests
+# Purpose:          Flattened layers of frames kept within their budget and let go along with
+#                   their frames, and pixels shared copy on write with several readers.
+#
+# Date:             18/10/26
+# License:
+# --------------------------------------------------------------------------------------------------
+
+import unittest
+from unittest import mock
+
+import numpy
+
+import model.appdata as appdata
+from model.sprite import Sprite, Surface
+
+
+def _paint(surface, value):
+
+    surface.pixels[:] = value
+    surface.mark_dirty()
+
+
+class CompositeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+
+        # Room for the flattened layers of two frames
+        with mock.patch.object(appdata, 'composite_cache_budget', 2 * 16 * 8 * 4):
+            self._sprite = Sprite.create(16, 8)
+
+        self._animation = self._sprite.current_animation
+
+        for _ in range(3):
+            self._animation.add_empty_frame()
+
+        for value, frame in enumerate(self._animation.frames):
+            frame.add_empty_surface()
+            _paint(frame.surfaces[0], value + 1)
+
+    def tearDown(self):
+
+        self._sprite.close()
+
+    def test_stays_within_budget(self):
+
+        cache = self._sprite.composite_cache
+
+        composites = [frame.composite for frame in self._animation.frames]
+
+        self.assertEqual(cache.size, 2 * 16 * 8 * 4)
+
+        # The last ones flattened are kept, the others are flattened again
+        last_frame = self._animation.last_frame
+
+        self.assertIs(last_frame.composite, composites[-1])
+        self.assertIsNot(self._animation.frames[0].composite, composites[0])
+
+        # Edits flatten again in place of the old entry
+        _paint(last_frame.surfaces[1], 255)
+
+        numpy.testing.assert_array_equal(last_frame.flatten_pixels(), 255)
+        self.assertEqual(cache.size, 2 * 16 * 8 * 4)
+
+    def test_removed_frames_are_dropped(self):
+
+        cache = self._sprite.composite_cache
+
+        self._animation.frames[0].composite
+
+        self._animation.remove_frame(0)
+
+        self.assertEqual(cache.size, 0)
+
+        self._animation.frames[0].composite
+        self._sprite.remove_current_animation()
+
+        self.assertEqual(cache.size, 0)
+
+
+class SharedPixelsTest(unittest.TestCase):
+
+    class _Reader(object):
+        pass
+
+    def test_pixels_are_copied_while_any_reader_is_alive(self):
+
+        surface = Surface('Layer', 16, 8)
+        _paint(surface, 10)
+
+        first_reader, second_reader = self._Reader(), self._Reader()
+
+        first_pixels = surface.share_pixels(first_reader)
+        second_pixels = surface.share_pixels(second_reader)
+
+        # Gone before the surface is written to, the other reader still needs the pixels kept
+        del second_reader, second_pixels
+
+        _paint(surface, 20)
+
+        numpy.testing.assert_array_equal(first_pixels, 10)
+        self.assertFalse(numpy.shares_memory(first_pixels, surface.const_pixels))
+
+        # Written to in place once nobody shares them any more
+        pixels = surface.const_pixels
+
+        _paint(surface, 30)
+
+        self.assertIs(surface.const_pixels, pixels)
+
+
+if __name__ == '__main__':
+    unittest.main()
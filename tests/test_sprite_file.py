@@ -0,0 +1,342 @@
+# --------------------------------------------------------------------------------------------------
+# Name:             SpriteFile Tests
+# Purpose:          Round trips through the chunked .spr container: new files, in place updates,
+#                   aborted writes and compaction.
+#
+# Date:             18/10/26
+# License:
+# --------------------------------------------------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy
+
+import model.appdata as appdata
+import model.sprite_file as sprite_file_module
+from model.sprite import Sprite
+from model.sprite_file import SpriteFile, SpriteFileWriter, SpriteFileUpdater, SpriteFileError, \
+    is_sprite_file
+
+
+def _write_file(file_path, chunks, index=None):
+
+    with SpriteFileWriter(file_path) as writer:
+
+        locations = [writer.add_chunk(chunk) for chunk in chunks]
+
+        writer.finish(index if index is not None else {'chunks': locations})
+
+    writer.commit()
+
+    return locations
+
+
+def _paint(surface, value):
+
+    surface.pixels[:] = value
+    surface.mark_dirty()
+
+
+class SpriteFileTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self._directory = tempfile.mkdtemp(prefix='pxeel-test-')
+        self._filePath = os.path.join(self._directory, 'test.spr')
+
+    def tearDown(self):
+
+        shutil.rmtree(self._directory)
+
+    def test_write_and_read_back(self):
+
+        chunks = [b'first', b'second chunk', os.urandom(1000)]
+
+        locations = _write_file(self._filePath, chunks)
+
+        self.assertTrue(is_sprite_file(self._filePath))
+        self.assertFalse(os.path.exists(self._filePath + '.tmp'))
+
+        sprite_file = SpriteFile(self._filePath)
+
+        try:
+
+            self.assertEqual(sprite_file.index['chunks'], [list(location)
+                                                           for location in locations])
+
+            for chunk, (offset, length) in zip(chunks, locations):
+
+                self.assertEqual(offset % sprite_file_module.CHUNK_ALIGNMENT, 0)
+                self.assertEqual(sprite_file.read_chunk(offset, length), chunk)
+
+                target = bytearray(length)
+                sprite_file.read_chunk_into(offset, length, target)
+                self.assertEqual(bytes(target), chunk)
+
+        finally:
+            sprite_file.close()
+
+    def test_read_past_end_fails(self):
+
+        (offset, length), = _write_file(self._filePath, [b'chunk'])
+
+        sprite_file = SpriteFile(self._filePath)
+
+        try:
+            with self.assertRaises(SpriteFileError):
+                sprite_file.read_chunk(offset, os.path.getsize(self._filePath))
+        finally:
+            sprite_file.close()
+
+    def test_aborted_write_keeps_previous_file(self):
+
+        _write_file(self._filePath, [b'kept'], {'version': 'old'})
+
+        with self.assertRaises(RuntimeError):
+            with SpriteFileWriter(self._filePath) as writer:
+                writer.add_chunk(b'lost')
+                raise RuntimeError()
+
+        self.assertFalse(os.path.exists(self._filePath + '.tmp'))
+
+        sprite_file = SpriteFile(self._filePath)
+
+        try:
+            self.assertEqual(sprite_file.index, {'version': 'old'})
+        finally:
+            sprite_file.close()
+
+    def test_update_appends_and_keeps_old_chunks(self):
+
+        (old_offset, old_length), = _write_file(self._filePath, [b'unchanged'])
+
+        with SpriteFileUpdater(self._filePath) as updater:
+            new_offset, new_length = updater.add_chunk(b'appended')
+            updater.finish({'chunks': [[old_offset, old_length], [new_offset, new_length]]})
+
+        sprite_file = SpriteFile(self._filePath)
+
+        try:
+            self.assertGreater(new_offset, old_offset)
+            self.assertEqual(sprite_file.read_chunk(old_offset, old_length), b'unchanged')
+            self.assertEqual(sprite_file.read_chunk(new_offset, new_length), b'appended')
+            self.assertEqual(len(sprite_file.index['chunks']), 2)
+        finally:
+            sprite_file.close()
+
+    def test_aborted_update_truncates_back(self):
+
+        _write_file(self._filePath, [b'unchanged'], {'version': 'old'})
+
+        size = os.path.getsize(self._filePath)
+
+        with self.assertRaises(RuntimeError):
+            with SpriteFileUpdater(self._filePath) as updater:
+                updater.add_chunk(os.urandom(4096))
+                raise RuntimeError()
+
+        self.assertEqual(os.path.getsize(self._filePath), size)
+
+        sprite_file = SpriteFile(self._filePath)
+
+        try:
+            self.assertEqual(sprite_file.index, {'version': 'old'})
+        finally:
+            sprite_file.close()
+
+    def test_needs_compaction_once_mostly_superseded(self):
+
+        def index_of(chunk):
+            return {'animations': [{'frames': [{'surfaces': [{'chunk': list(chunk)}]}]}]}
+
+        with SpriteFileWriter(self._filePath) as writer:
+            writer.finish(index_of(writer.add_chunk(bytes(1024))))
+
+        writer.commit()
+
+        with mock.patch.object(sprite_file_module, 'COMPACTION_MIN_SIZE', 0):
+
+            sprite_file = SpriteFile(self._filePath)
+
+            try:
+
+                self.assertFalse(sprite_file.needs_compaction)
+
+                # Each update supersedes the only chunk the index refers to
+                for _ in range(3):
+                    with SpriteFileUpdater(self._filePath) as updater:
+                        index = index_of(updater.add_chunk(bytes(1024)))
+                        updater.finish(index)
+
+                sprite_file.refresh(index)
+
+                self.assertTrue(sprite_file.needs_compaction)
+
+            finally:
+                sprite_file.close()
+
+
+class SpriteSaveTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self._directory = tempfile.mkdtemp(prefix='pxeel-test-')
+        self._filePath = os.path.join(self._directory, 'test.spr')
+
+        self._sprite = Sprite.create(32, 24)
+
+        animation = self._sprite.current_animation
+        animation.add_empty_frame()
+        animation.frames[0].add_empty_surface()
+
+        for value, surface in enumerate(self._surfaces(self._sprite)):
+            _paint(surface, value + 1)
+
+    def tearDown(self):
+
+        self._sprite.close()
+
+        shutil.rmtree(self._directory)
+
+    @staticmethod
+    def _surfaces(sprite):
+
+        return [surface for animation in sprite.animations for frame in animation.frames
+                for surface in frame.surfaces]
+
+    def _assert_loads_as_saved(self):
+
+        loaded = Sprite.load_from_file(self._filePath)
+
+        try:
+
+            self.assertEqual((loaded.width, loaded.height), (32, 24))
+
+            saved_surfaces = self._surfaces(self._sprite)
+            loaded_surfaces = self._surfaces(loaded)
+
+            self.assertEqual(len(loaded_surfaces), len(saved_surfaces))
+
+            for saved, loaded_surface in zip(saved_surfaces, loaded_surfaces):
+                numpy.testing.assert_array_equal(loaded_surface.pixels, saved.pixels)
+
+        finally:
+            loaded.close()
+
+    def test_save_and_load(self):
+
+        Sprite.save(self._sprite, self._filePath)
+
+        self.assertFalse(any(surface.is_dirty for surface in self._surfaces(self._sprite)))
+
+        self._assert_loads_as_saved()
+
+    def test_saved_surfaces_are_paged_out_unless_edited(self):
+
+        surfaces = self._surfaces(self._sprite)
+
+        history = self._sprite.history
+        history.begin_edit(surfaces[0], 'Edit')
+
+        self.assertTrue(surfaces[0].is_pinned)
+
+        with mock.patch.object(appdata, 'surface_cache_budget', 0):
+
+            Sprite.save(self._sprite, self._filePath)
+
+            # Only the surface under edit and the last one paged stay in memory
+            self.assertTrue(surfaces[0].is_loaded)
+            self.assertEqual([surface.is_loaded for surface in surfaces[1:]],
+                             [False] * (len(surfaces) - 2) + [True])
+
+            history.capture(0, 0, 4, 4)
+            surfaces[0].pixels[:4, :4] = 255
+
+            self.assertIsNotNone(history.end_edit())
+            self.assertFalse(surfaces[0].is_pinned)
+            self.assertTrue(surfaces[0].is_dirty)
+
+            # Reading pages the pixels back in without pinning them
+            numpy.testing.assert_array_equal(surfaces[1].const_pixels, 2)
+            self.assertFalse(surfaces[1].is_pinned)
+            self.assertTrue(surfaces[0].is_loaded)
+
+            Sprite.save(self._sprite, self._filePath)
+
+            self.assertFalse(surfaces[0].is_dirty)
+
+        self._assert_loads_as_saved()
+
+    def test_snapshot_shares_pixels_until_edited(self):
+
+        surface, edited_surface = self._surfaces(self._sprite)[:2]
+
+        snapshot = self._sprite.snapshot()
+
+        unchanged, edited = snapshot.animations[0].frames[0].surfaces[:2]
+
+        history = self._sprite.history
+        history.begin_edit(edited_surface, 'Edit')
+        history.capture(0, 0, 8, 8)
+        edited_surface.pixels[:8, :8] = 255
+        history.end_edit()
+
+        self.assertTrue(numpy.shares_memory(unchanged.pixels, surface.const_pixels))
+        self.assertFalse(numpy.shares_memory(edited.pixels, edited_surface.const_pixels))
+        numpy.testing.assert_array_equal(edited.pixels, 2)
+
+        Sprite.finish_save(self._sprite, Sprite.write(snapshot, self._filePath))
+
+        self.assertFalse(surface.is_dirty)
+        self.assertTrue(edited_surface.is_dirty)
+
+        loaded = Sprite.load_from_file(self._filePath)
+
+        try:
+            numpy.testing.assert_array_equal(self._surfaces(loaded)[1].pixels, 2)
+        finally:
+            loaded.close()
+
+    def test_save_again_only_appends_changed_surfaces(self):
+
+        Sprite.save(self._sprite, self._filePath)
+
+        surfaces = self._surfaces(self._sprite)
+        unchanged_chunk = surfaces[0].chunk
+
+        size = os.path.getsize(self._filePath)
+
+        _paint(surfaces[1], 200)
+
+        Sprite.save(self._sprite, self._filePath)
+
+        self.assertEqual(surfaces[0].chunk, unchanged_chunk)
+        self.assertLess(os.path.getsize(self._filePath) - size, 2 * 32 * 24 * 4)
+
+        self._assert_loads_as_saved()
+
+    def test_save_compacts_superseded_chunks(self):
+
+        Sprite.save(self._sprite, self._filePath)
+
+        surface = self._surfaces(self._sprite)[0]
+
+        with mock.patch.object(sprite_file_module, 'COMPACTION_MIN_SIZE', 0):
+
+            for value in range(10, 20):
+                _paint(surface, value)
+                Sprite.save(self._sprite, self._filePath)
+
+        self.assertLess(os.path.getsize(self._filePath),
+                        sprite_file_module.COMPACTION_RATIO * len(self._surfaces(self._sprite)) *
+                        32 * 24 * 4 + 4096)
+
+        self._assert_loads_as_saved()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,14 +9,320 @@
 # Licence:
 # ------------------------------------------------------------------------------
 
+import bisect
 import math
+import time
+from collections import deque
 
-from PyQt5.QtCore import QTimer, Qt, QSize
+from PyQt5.QtCore import QTimer, Qt, QSize, QObject, pyqtSignal
 from PyQt5.QtGui import QColor, QPen, QIcon, QPixmap
 from PyQt5.QtWidgets import QVBoxLayout, QHBoxLayout, QPushButton, QSlider, \
     QLabel, QFrame
 
 from view.display_base_widget import Display
+import model.appdata as appdata
+
+# -----------------------------------------------------------------------------
+
+
+class PlaybackCache(object):
+    """
+    Flattened frames of an Animation already scaled to the display zoom, so playback only blits
+    them. Frames are rendered one at a time whenever the application is idle, the one last asked
+    for first, and again once their layers change. Nothing is rendered while is_busy() says the
+    layers are being painted on, frames are drawn from their layers meanwhile. Once the budget is
+    full the frames kept stay the same, the others are drawn from their layers too.
+    """
+
+    def __init__(self):
+
+        # Frame -> (Surface Versions, Pixmap), all at the current zoom
+        self._pixmaps = {}
+
+        self._size = 0
+
+        self._animation = None
+
+        self._zoom = 1.0
+
+        # Frame asked for last that wasn't ready
+        self._requestedFrame = None
+
+        self._isBusy = None
+
+        self._builder = QTimer()
+        self._builder.setInterval(0)
+        self._builder.timeout.connect(self._build_next)
+
+    @property
+    def is_busy(self):
+        return self._isBusy
+
+    @is_busy.setter
+    def is_busy(self, value):
+        self._isBusy = value
+
+    def set_target(self, animation, zoom):
+
+        if animation is not self._animation or zoom != self._zoom:
+            self.clear()
+        else:
+            self._drop_removed_frames()
+
+        self._animation = animation
+        self._zoom = zoom
+
+    def pixmap(self, frame):
+
+        # None while the frame is still to be rendered at the current zoom, it will be shortly
+        if not self._is_fresh(frame):
+
+            self._requestedFrame = frame
+
+            if self._animation is not None and not self._builder.isActive() and \
+                    not self._is_busy():
+                self._builder.start()
+
+            return None
+
+        return self._pixmaps[frame][1]
+
+    def clear(self):
+
+        self._builder.stop()
+
+        self._pixmaps.clear()
+        self._size = 0
+
+        self._animation = None
+        self._requestedFrame = None
+
+    def _drop_removed_frames(self):
+
+        if len(self._pixmaps) == 0:
+            return
+
+        frames = set(self._animation.frames)
+
+        # Frames removed from the animation are let go along with their pixmaps
+        for frame in [frame for frame in self._pixmaps if frame not in frames]:
+
+            pixmap = self._pixmaps.pop(frame)[1]
+            self._size -= pixmap.width() * pixmap.height() * 4
+
+        if self._requestedFrame is not None and self._requestedFrame not in frames:
+            self._requestedFrame = None
+
+    def _build_next(self):
+
+        # Started again on the next paint once painting is over
+        if self._is_busy():
+            self._builder.stop()
+            return
+
+        frame = self._next_to_build()
+
+        if frame is None:
+            self._builder.stop()
+            return
+
+        if frame is self._requestedFrame:
+            self._requestedFrame = None
+
+        image = frame.composite
+
+        width, height = self._pixmap_size()
+
+        pixmap = QPixmap.fromImage(image.scaled(width, height, Qt.IgnoreAspectRatio,
+                                                Qt.FastTransformation))
+
+        old_entry = self._pixmaps.get(frame)
+
+        if old_entry is not None:
+            self._size -= old_entry[1].width() * old_entry[1].height() * 4
+
+        self._pixmaps[frame] = (frame.surface_versions, pixmap)
+        self._size += width * height * 4
+
+    def _next_to_build(self):
+
+        if self._animation is None:
+            return None
+
+        self._drop_removed_frames()
+
+        width, height = self._pixmap_size()
+
+        frame_size = width * height * 4
+
+        # Frames too large to keep are left to be drawn from their layers
+        if frame_size > appdata.playback_cache_budget / 4:
+            return None
+
+        has_room = self._size + frame_size <= appdata.playback_cache_budget
+
+        # Frames already kept are rendered again in place, others only while there is room, so
+        # a full cache never drops one frame to render another
+        def can_build(frame):
+            return not self._is_fresh(frame) and (has_room or frame in self._pixmaps)
+
+        requested_frame = self._requestedFrame
+
+        if requested_frame is not None and requested_frame in self._animation.frames and \
+                can_build(requested_frame):
+            return requested_frame
+
+        return next((frame for frame in self._animation.frames if can_build(frame)), None)
+
+    def _pixmap_size(self):
+
+        sprite = self._animation.sprite
+
+        return max(1, int(round(sprite.width * self._zoom))), \
+            max(1, int(round(sprite.height * self._zoom)))
+
+    def _is_busy(self):
+
+        return self._isBusy is not None and self._isBusy()
+
+    def _is_fresh(self, frame):
+
+        entry = self._pixmaps.get(frame)
+
+        return entry is not None and entry[0] == frame.surface_versions
+
+# -----------------------------------------------------------------------------
+
+
+class PlaybackScheduler(QObject):
+    """
+    Decides which frame is on screen from the time elapsed on a monotonic clock since playback
+    started, so timing does not drift with timer jitter and frames are skipped when running
+    behind. Each frame is held for its own duration in milliseconds.
+    """
+
+    frameChanged = pyqtSignal(int)
+    finished = pyqtSignal()
+
+    def __init__(self):
+
+        super(PlaybackScheduler, self).__init__()
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.timeout.connect(self._tick)
+
+        # Milliseconds from the start of the animation to the end of each frame
+        self._frameEnds = []
+
+        self._loop = True
+
+        self._startTime = 0.0
+        self._frameIndex = 0
+
+        # Clock times frames were shown at during the last second
+        self._shownTimes = deque()
+
+    @property
+    def is_running(self):
+        return self._timer.isActive()
+
+    @property
+    def loop(self):
+        return self._loop
+
+    @loop.setter
+    def loop(self, value):
+        self._loop = value
+
+    @property
+    def measured_fps(self):
+
+        self._forget_shown_before(time.perf_counter() - 1.0)
+
+        return len(self._shownTimes)
+
+    def start(self, durations, frame_index=0, loop=True):
+
+        self._loop = loop
+
+        self._shownTimes.clear()
+
+        self._set_durations(durations, frame_index)
+
+        self._tick()
+
+    def set_durations(self, durations):
+
+        # Carries on from the frame on screen, as if it had just been reached
+        if self.is_running:
+            self._set_durations(durations, self._frameIndex)
+            self._tick()
+
+    def stop(self):
+
+        self._timer.stop()
+
+    def _set_durations(self, durations, frame_index):
+
+        self._frameEnds = []
+
+        end = 0.0
+
+        for duration in durations:
+            end += max(1.0, duration)
+            self._frameEnds.append(end)
+
+        self._frameIndex = min(frame_index, len(self._frameEnds) - 1)
+
+        frame_start = self._frameEnds[self._frameIndex - 1] if self._frameIndex > 0 else 0.0
+
+        self._startTime = time.perf_counter() - frame_start / 1000.0
+
+    def _tick(self):
+
+        if len(self._frameEnds) == 0:
+            return
+
+        now = time.perf_counter()
+
+        position = (now - self._startTime) * 1000.0
+
+        total = self._frameEnds[-1]
+
+        if position >= total:
+
+            if not self._loop:
+                self._show(len(self._frameEnds) - 1, now)
+                self.finished.emit()
+                return
+
+            position %= total
+
+        frame_index = bisect.bisect_right(self._frameEnds, position)
+
+        self._show(frame_index, now)
+
+        # Wakes up right when the frame on screen is due to end
+        self._timer.start(max(1, int(math.ceil(self._frameEnds[frame_index] - position))))
+
+    def _show(self, frame_index, now):
+
+        if frame_index == self._frameIndex and len(self._shownTimes) > 0:
+            return
+
+        self._frameIndex = frame_index
+
+        self._shownTimes.append(now)
+        self._forget_shown_before(now - 1.0)
+
+        self.frameChanged.emit(frame_index)
+
+    def _forget_shown_before(self, clock_time):
+
+        while len(self._shownTimes) > 0 and self._shownTimes[0] < clock_time:
+            self._shownTimes.popleft()
 
 # -----------------------------------------------------------------------------
 
@@ -48,7 +354,7 @@ class AnimationDisplay(Display):
 
         self.setStyleSheet(style_sheet)
 
-        self._animationFrameInterval = 60
+        self._animationFrameRate = appdata.default_frame_rate
 
         self._loopEnabled = True
 
@@ -61,9 +367,13 @@ class AnimationDisplay(Display):
         self._pen.setWidth(2)
         self._pen.setJoinStyle(Qt.MiterJoin)
 
-        self._animationTimer = QTimer()
-        self._animationTimer.timeout.connect(self._animate_event)
-        self._animationTimer.stop()
+        self._scheduler = PlaybackScheduler()
+        self._scheduler.frameChanged.connect(self._on_scheduled_frame)
+        self._scheduler.finished.connect(self.pause)
+
+        self._playbackCache = PlaybackCache()
+
+        self._spriteObject.playback_cache = self._playbackCache
 
         self._layout = QVBoxLayout(self)
         self._layout.setAlignment(Qt.AlignBottom)
@@ -132,7 +442,7 @@ class AnimationDisplay(Display):
         self._frameRateSlider.valueChanged.connect(
             self._on_animation_rate_changed)
 
-        self._frameRateSlider.setValue(16)
+        self._frameRateSlider.setValue(appdata.default_frame_rate)
 
         self._frameRateLayout.addWidget(self._frameRateLabel)
         self._frameRateLayout.addWidget(self._frameRateSlider)
@@ -152,57 +462,77 @@ class AnimationDisplay(Display):
     @looping_enabled.setter
     def looping_enabled(self, value):
         self._loopEnabled = value
+        self._scheduler.loop = value
 
     @property
     def animation_speed(self):
-        return self._animationFrameInterval
+        return self._animationFrameRate
 
     @animation_speed.setter
     def animation_speed(self, value):
-        self._animationFrameInterval = value
+        self._frameRateSlider.setValue(value)
+
+    @property
+    def measured_frame_rate(self):
+        return self._scheduler.measured_fps
+
+    @property
+    def playback_cache(self):
+        return self._playbackCache
 
     def start_animating(self):
-        self._animationTimer.start(self._animationFrameInterval)
+
+        if self._spriteObject.is_empty:
+            return
+
         self._playing = True
 
+        frame_index = self._spriteObject.display_frame_index
+
+        if frame_index < 0 or frame_index >= self._spriteObject.sprite.current_animation.frame_count:
+            frame_index = 0
+
+        self._scheduler.start(self._frame_durations(), frame_index, self._loopEnabled)
+
     def stop_animating(self):
-        self._animationTimer.stop()
+        self._scheduler.stop()
         self._playing = False
 
     def reset(self):
 
         self._playing = False
-        self._animationTimer.stop()
+        self._scheduler.stop()
         self._playPauseBtn.setChecked(False)
 
-    def _animate_event(self):
-        if self._spriteObject is not None and self._playing:
-            self._animate()
+    def _frame_durations(self):
+
+        # Frames without a duration of their own last as long as the frame rate says
+        frame_interval = 1000.0 / self._animationFrameRate
+
+        return [frame.duration if frame.duration is not None else frame_interval
+                for frame in self._spriteObject.sprite.current_animation.frames]
 
     def _on_animation_rate_changed(self, v):
 
         self._frameRateValueLabel.setText(str(v))
-        self._animationFrameInterval = int(math.floor((1 / v) * 1000))
+        self._animationFrameRate = v
 
         if self.is_playing:
-            self._animationTimer.stop()
-            self._animationTimer.start(self._animationFrameInterval)
+            self._scheduler.set_durations(self._frame_durations())
 
-    def _animate(self):
-        if self._spriteObject is None:
+    def _on_scheduled_frame(self, index):
+
+        if self._spriteObject.is_empty:
             return
 
-        self._spriteObject.display_frame_index += 1
+        # Frames were added or removed, or their durations changed, since playback started
+        durations = self._frame_durations()
 
-        frame_count = self._spriteObject.sprite.current_animation.frame_count
-
-        if self._spriteObject.display_frame_index > frame_count - 1:
+        if index >= len(durations):
+            self._scheduler.start(durations, 0, self._loopEnabled)
+            return
 
-            if self._loopEnabled:
-                self._spriteObject.display_frame_index = 0
-            else:
-                self._spriteObject.display_frame_index = frame_count - 1
-                self.pause()
+        self._spriteObject.display_frame_index = index
 
         self.scene().update()
 
@@ -223,8 +553,17 @@ class AnimationDisplay(Display):
 
         super(AnimationDisplay, self).unload_sprite()
 
+        self._playbackCache.clear()
+
         self.reset()
 
+    def paintEvent(self, e):
+
+        if not self._spriteObject.is_empty:
+            self._playbackCache.set_target(self._spriteObject.sprite.current_animation, self.zoom)
+
+        super(AnimationDisplay, self).paintEvent(e)
+
     def toggle_playing(self):
         if self._spriteObject is None:
             return
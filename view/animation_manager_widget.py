@@ -41,6 +41,8 @@ class FrameStrip(QWidget):
 
         self._horizontalShift = 0
 
+        self._thumbnailCache = None
+
         self._pen = QPen(QColor(0, 179, 255))
         self._pen.setCapStyle(Qt.SquareCap)
         self._pen.setJoinStyle(Qt.MiterJoin)
@@ -65,6 +67,14 @@ class FrameStrip(QWidget):
         self._maxFramesOnView = value
         self.update_strip_layout()
 
+    @property
+    def thumbnail_cache(self):
+        return self._thumbnailCache
+
+    @thumbnail_cache.setter
+    def thumbnail_cache(self, value):
+        self._thumbnailCache = value
+
     @property
     def sprite_frame_size(self):
 
@@ -106,16 +116,45 @@ class FrameStrip(QWidget):
 
         else:
 
-            current_frame_index = self._sprite.current_animation.current_frame_index
+            # Keeps the shift within the strip, which may have lost frames
+            self.scroll_to(self._horizontalShift)
 
-            if (current_frame_index + 1) > self._maxFramesOnView:
-                self._horizontalShift = ((current_frame_index + 1) - self._maxFramesOnView) * \
-                                        (self._frameSize + 2 * self._framePadding)
-            else:
-                self._horizontalShift = 0
+            self.scroll_to_frame(self._sprite.current_animation.current_frame_index)
 
         self.update()
 
+    def scroll_to(self, shift):
+
+        if self._sprite is None:
+            return
+
+        total_frame_size = self._frameSize + 2 * self._framePadding
+
+        excedent_frames = max(0, self._sprite.current_animation.frame_count -
+                              self._maxFramesOnView)
+
+        shift = min(max(0, shift), excedent_frames * total_frame_size)
+
+        if shift != self._horizontalShift:
+            self._horizontalShift = shift
+            self.update()
+
+    def scroll_to_frame(self, index):
+
+        # Scrolls just enough for the frame to be fully in view
+        total_frame_size = self._frameSize + 2 * self._framePadding
+
+        frame_left = index * total_frame_size
+        frame_right = frame_left + total_frame_size
+
+        view_width = self._maxFramesOnView * total_frame_size
+
+        if frame_left < self._horizontalShift:
+            self.scroll_to(frame_left)
+
+        elif frame_right > self._horizontalShift + view_width:
+            self.scroll_to(frame_right - view_width)
+
     def mousePressEvent(self, e):
 
         pos = e.pos()
@@ -124,42 +163,29 @@ class FrameStrip(QWidget):
             self._frameSize + self._framePadding * 2)))
         current_index = self._sprite.current_animation.current_frame_index
 
+        if clicked_index >= self._sprite.current_animation.frame_count:
+            return
+
         if clicked_index != current_index:
             self.frameSelectedChanged.emit(clicked_index)
 
     def wheelEvent(self, e):
 
-        delta = e.angleDelta().y()
-
-        excedent_frames = self._sprite.current_animation.frame_count - self._maxFramesOnView
+        if self._sprite is None:
+            return
 
-        if excedent_frames < 0:
-            excedent_frames = 0
+        # A frame per wheel notch, fast wheels and touchpads send several or fractions at once
+        delta = e.angleDelta().y()
 
         total_frame_size = self._frameSize + 2 * self._framePadding
 
-        if delta > 0:
-
-            self._horizontalShift += total_frame_size
-
-            if self._horizontalShift > excedent_frames * total_frame_size:
-                self._horizontalShift = excedent_frames * total_frame_size
-
-            self.update()
-
-        elif delta < 0:
-
-            self._horizontalShift -= self._frameSize + 2 * self._framePadding
-
-            if self._horizontalShift < -excedent_frames * total_frame_size + excedent_frames * \
-                    total_frame_size:
-                self._horizontalShift = -excedent_frames * total_frame_size + excedent_frames * \
-                    total_frame_size
-
-            self.update()
+        self.scroll_to(self._horizontalShift + delta * total_frame_size // 120)
 
     def paintEvent(self, e):
 
+        if self._sprite is None:
+            return
+
         p = QPainter(self)
 
         current_frame_index = self._sprite.current_animation.current_frame_index
@@ -174,7 +200,18 @@ class FrameStrip(QWidget):
         if self._horizontalShift != 0:
             p.translate(-self._horizontalShift, 0)
 
-        for frameIndex, frame in enumerate(frame_list):
+        # Only the frames reaching into the area being repainted are drawn
+        total_frame_size = frame_size + two_padding
+
+        paint_rect = e.rect()
+
+        first_index = max(0, (paint_rect.left() + self._horizontalShift) // total_frame_size)
+        last_index = min(len(frame_list) - 1,
+                         (paint_rect.right() + self._horizontalShift) // total_frame_size)
+
+        for frameIndex in range(first_index, last_index + 1):
+
+            frame = frame_list[frameIndex]
 
             surfaces = frame.surfaces
 
@@ -197,7 +234,7 @@ class FrameStrip(QWidget):
             p.drawTiledPixmap(frame_rect, self._checkerTile)
 
             for surface in surfaces:
-                p.drawImage(frame_rect, surface.image, surface.image.rect())
+                self._draw_surface(p, frame_rect, surface)
 
             p.setPen(Qt.black)
             p.drawText(frame_rect.left() + two_padding,
@@ -207,6 +244,18 @@ class FrameStrip(QWidget):
 
         return QSize(self._frameSize, self._frameSize)
 
+    def _draw_surface(self, painter, rect, surface):
+
+        if self._thumbnailCache is None:
+            painter.drawImage(rect, surface.image, surface.image.rect())
+            return
+
+        # Left blank until its thumbnail is ready
+        thumbnail = self._thumbnailCache.thumbnail(surface, rect.width(), rect.height())
+
+        if thumbnail is not None:
+            painter.drawPixmap(rect, thumbnail)
+
 
 class AnimationManager(QWidget):
     currentFrameChanged = pyqtSignal(int)
@@ -327,6 +376,14 @@ class AnimationManager(QWidget):
 
         self.setLayout(main_layout)
 
+    @property
+    def thumbnail_cache(self):
+        return self._frameStrip.thumbnail_cache
+
+    @thumbnail_cache.setter
+    def thumbnail_cache(self, value):
+        self._frameStrip.thumbnail_cache = value
+
     @property
     def animation_index(self):
         return self._sprite.current_animationIndex
@@ -358,6 +415,8 @@ class AnimationManager(QWidget):
 
         animation.set_frame(value)
 
+        self._frameStrip.scroll_to_frame(value)
+
         self.update()
 
         self.currentFrameChanged.emit(value)
@@ -464,6 +523,8 @@ class AnimationManager(QWidget):
 
         animation.go_to_next_frame()
 
+        self._frameStrip.scroll_to_frame(animation.current_frame_index)
+
         self.update()
 
         self.currentFrameChanged.emit(animation.current_frame_index)
@@ -480,6 +541,8 @@ class AnimationManager(QWidget):
 
         animation.go_to_previous_frame()
 
+        self._frameStrip.scroll_to_frame(animation.current_frame_index)
+
         self.update()
 
         self.currentFrameChanged.emit(animation.current_frame_index)
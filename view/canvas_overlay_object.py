@@ -1,5 +1,8 @@
-from PyQt5.QtCore import Qt, QRectF
-from PyQt5.QtGui import QPen, QPainter
+import bisect
+import math
+
+from PyQt5.QtCore import Qt, QRect, QRectF
+from PyQt5.QtGui import QPainter, QTransform
 from PyQt5.QtWidgets import QGraphicsItem
 
 
@@ -12,6 +15,17 @@ class CanvasOverlayObject(QGraphicsItem):
 
         self._canvas = canvas
 
+        # Makes option.exposedRect the area actually being repainted
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
+        # Grid lines covering the whole scene, rebuilt when the scene, the zoom or the grid size
+        # changes. Columns and rows hold their scene positions, the rects their device ones
+        self._gridKey = None
+        self._gridColumns = []
+        self._gridRows = []
+        self._gridColumnRects = []
+        self._gridRowRects = []
+
         self.update_bounding_rect()
 
     def boundingRect(self):
@@ -33,28 +47,77 @@ class CanvasOverlayObject(QGraphicsItem):
 
         if self._canvas.grid_enabled and self._canvas.zoom >= 8.0:
 
-            self._draw_grid(painter)
+            self._draw_grid(painter, option.exposedRect)
 
         if self._canvas.current_tool is not None:
             self._canvas.current_tool.draw_transformed(painter)
 
-    def _draw_grid(self, painter):
-        pen = QPen()
-        pen.setWidth(0)
-        pen.setColor(Qt.white)
-        painter.setPen(pen)
+    def _draw_grid(self, painter, exposed_rect):
+
+        scene_rect = self._canvas.sceneRect()
+
+        grid_delta = max(1, self._canvas.pixel_size)
+
+        transform = painter.transform()
+
+        # Lines are drawn as one pixel wide rects on the device, placed relative to the whole
+        # device pixel the scene origin falls on, so panning by whole pixels reuses them
+        origin_x = math.floor(transform.dx())
+        origin_y = math.floor(transform.dy())
+
+        grid_key = (scene_rect.getRect(), grid_delta, transform.m11(), transform.m22(),
+                    transform.dx() - origin_x, transform.dy() - origin_y)
+
+        if self._gridKey != grid_key:
+            self._build_grid(scene_rect, grid_delta, transform, origin_x, origin_y)
+            self._gridKey = grid_key
+
+        # Lines are sorted by position, so the ones crossing the exposed area are a slice
+        first_column = bisect.bisect_left(self._gridColumns, math.floor(exposed_rect.left()))
+        last_column = bisect.bisect_right(self._gridColumns, math.ceil(exposed_rect.right()))
+        first_row = bisect.bisect_left(self._gridRows, math.floor(exposed_rect.top()))
+        last_row = bisect.bisect_right(self._gridRows, math.ceil(exposed_rect.bottom()))
+
+        painter.save()
+
+        painter.setTransform(QTransform.fromTranslate(origin_x, origin_y))
+        painter.setClipRect(transform.mapRect(exposed_rect).toAlignedRect().translated(
+            -origin_x, -origin_y))
+
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(Qt.white)
         painter.setOpacity(0.2)
 
         painter.setCompositionMode(QPainter.CompositionMode_Difference)
 
-        scene_rect = self._canvas.sceneRect()
+        painter.drawRects(self._gridColumnRects[first_column:last_column] +
+                          self._gridRowRects[first_row:last_row])
+
+        painter.restore()
+
+    def _build_grid(self, scene_rect, grid_delta, transform, origin_x, origin_y):
+
+        left = int(scene_rect.left())
+        top = int(scene_rect.top())
+        right = int(scene_rect.right())
+        bottom = int(scene_rect.bottom())
+
+        self._gridColumns = list(range(left, right, grid_delta))
+        self._gridRows = list(range(top, bottom, grid_delta))
 
-        grid_delta = self._canvas.pixel_size
+        # Rounded the way a cosmetic line through the same transform would be
+        def to_device_x(x):
+            return int(math.floor(x * transform.m11() + transform.dx() - origin_x + 0.5))
 
-        for x in range(int(scene_rect.left()), int(scene_rect.right()), grid_delta):
-            painter.drawLine(int(x), int(scene_rect.top()), int(x), int(scene_rect.bottom()))
+        def to_device_y(y):
+            return int(math.floor(y * transform.m22() + transform.dy() - origin_y + 0.5))
 
-        for y in range(int(scene_rect.top()), int(scene_rect.bottom()), grid_delta):
-            painter.drawLine(int(scene_rect.left()), int(y), int(scene_rect.right()), int(y))
+        device_left = to_device_x(left)
+        device_top = to_device_y(top)
+        device_width = to_device_x(right) - device_left + 1
+        device_height = to_device_y(bottom) - device_top + 1
 
-        painter.setOpacity(1.0)
+        self._gridColumnRects = [QRect(to_device_x(x), device_top, 1, device_height)
+                                 for x in self._gridColumns]
+        self._gridRowRects = [QRect(device_left, to_device_y(y), device_width, 1)
+                              for y in self._gridRows]
@@ -9,7 +9,7 @@
 # Licence:     <your licence>
 # ------------------------------------------------------------------------------
 
-from PyQt5.QtCore import Qt, pyqtSignal, QPoint, QRect
+from PyQt5.QtCore import Qt, pyqtSignal, QPoint, QRect, QTimer
 from PyQt5.QtGui import QColor, QPainter
 from PyQt5.QtWidgets import QVBoxLayout
 
@@ -19,6 +19,7 @@ from view.display_base_widget import Display
 from view.display_sprite_object import DisplaySpriteObject
 import helpers.utils as utils
 from model import tools
+import model.appdata as appdata
 
 
 # ------------------------------------------------------------------------------
@@ -87,7 +88,7 @@ class CanvasMouseState(object):
 
 class Canvas(Display):
     surfaceChanged = pyqtSignal()
-    surfaceChanging = pyqtSignal()
+    surfaceChanging = pyqtSignal(QRect)  # Changed Sprite Rect, null for all of it
     viewportChanged = pyqtSignal()
     colorPicked = pyqtSignal(QColor, int)  # Color, Button Pressed
 
@@ -127,6 +128,20 @@ class Canvas(Display):
 
         self._mouseState = CanvasMouseState()
 
+        # Moves arriving faster than canvas_move_interval are held here and handed to the tool
+        # as one once the interval is up
+        self._pendingMovePos = None
+
+        self._moveTimer = QTimer(self)
+        self._moveTimer.setSingleShot(True)
+        self._moveTimer.setInterval(appdata.canvas_move_interval)
+        self._moveTimer.timeout.connect(self._on_move_timer_timeout)
+
+        # Sprite area changed by the tool move being handled, QRect() once the whole of it did
+        self._changedSpriteRect = None
+
+        self._lastPointerPos = QPoint()
+
         self._load_tools()
 
         self._load_inks()
@@ -135,6 +150,12 @@ class Canvas(Display):
 
         self.setAcceptDrops(True)
 
+        # Finished edits mark their surface dirty through the history, strokes in progress
+        # are marked as they go, with the region they touch
+        self.surfaceChanging.connect(self._on_surface_modified)
+
+        self.surfaceChanging.connect(self._on_surface_changing)
+
     @property
     def sprite_object(self):
         return self._spriteObject
@@ -148,6 +169,10 @@ class Canvas(Display):
         self._lastTool = self._currentTool
         self._currentTool = self.find_tool_by_name(value)
 
+    @property
+    def is_painting(self):
+        return self._currentTool is not None and self._currentTool.is_active
+
     @property
     def last_tool(self):
         return self._lastTool
@@ -248,6 +273,11 @@ class Canvas(Display):
 
         surface = self._spriteObject.active_surface
 
+        history = self._spriteObject.sprite.history
+
+        history.begin_edit(self._spriteObject.sprite.current_surface, 'Clear')
+        history.capture(0, 0, surface.width(), surface.height())
+
         painter = QPainter()
 
         painter.begin(surface)
@@ -257,12 +287,22 @@ class Canvas(Display):
 
         painter.end()
 
+        history.end_edit()
+
         self.update()
 
         self.surfaceChanged.emit()
 
         self.update()
 
+    def undo(self):
+
+        self._step_history(undo=True)
+
+    def redo(self):
+
+        self._step_history(undo=False)
+
     def draw_over_display(self, painter):
 
         painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
@@ -341,9 +381,10 @@ class Canvas(Display):
 
         # self._mouseState.sprite_pos.setY(
         #     self._mouseState.canvas_pos.y() - self._spriteObject.boundingRect().top())
-        self._mouseState.sprite_pos.setX(int(
-            self._mouseState.canvas_pos.x() - self._spriteObject.boundingRect().left()))
-                
+        self._mouseState.sprite_pos.setY(int(
+            self._mouseState.canvas_pos.y() - self._spriteObject.boundingRect().top()))
+
+        self._pendingMovePos = None
 
         self._mouseState.pressed_button = e.button()
 
@@ -372,31 +413,16 @@ class Canvas(Display):
             return
 
         if not self._currentTool.is_active:
-            self.update()
+            self._update_pointer()
             return
 
-        canvas_pos = self._mouseState.canvas_pos = self.mapToScene(e.pos())
-
-        # self._mouseState.sprite_pos.setX(canvas_pos.x() - self._spriteObject.boundingRect().left())
-        # self._mouseState.sprite_pos.setY(canvas_pos.y() - self._spriteObject.boundingRect().top())
-        self._mouseState.sprite_pos.setX(int(canvas_pos.x() - self._spriteObject.boundingRect().left()))
-        self._mouseState.sprite_pos.setY(int(canvas_pos.y() - self._spriteObject.boundingRect().top()))
-
-        if self._pixelSize > 1 and self._snapEnabled:
-            self._mouseState.sprite_pos = utils.snap_point(self._mouseState.sprite_pos,
-                                                           self._pixelSize)
-            self._mouseState.canvas_pos = utils.snap_point(self._mouseState.canvas_pos,
-                                                           self._pixelSize)
-
-        self._currentTool.on_mouse_move()
-
-        self._mouseState.last_canvas_pos.setX(int(canvas_pos.x()))
-        self._mouseState.last_canvas_pos.setY(int(canvas_pos.y()))
-
-        self._mouseState.last_sprite_pos.setX(self._mouseState.sprite_pos.x())
-        self._mouseState.last_sprite_pos.setY(self._mouseState.sprite_pos.y())
+        # The first move after a quiet interval goes through at once, later ones wait for the
+        # interval to end
+        if self._moveTimer.isActive():
+            self._pendingMovePos = QPoint(e.pos())
+            return
 
-        self.update()
+        self._move_tool(e.pos())
 
     def mouseReleaseEvent(self, e):
 
@@ -404,6 +430,14 @@ class Canvas(Display):
 
         super(Canvas, self).mouseReleaseEvent(e)
 
+        # A stroke ends where the mouse was released, not at the last move let through
+        if self._pendingMovePos is not None and self._currentTool.is_active and \
+                self.sprite_is_set() and not was_panning:
+            self._move_tool(self._pendingMovePos)
+
+        self._pendingMovePos = None
+        self._moveTimer.stop()
+
         if was_panning:
             self._currentTool.enable_pointer_draw = True
             self.setCursor(Qt.BlankCursor)
@@ -479,6 +513,111 @@ class Canvas(Display):
 
     # -------------------------------------------------------------------------
 
+    def _move_tool(self, pos):
+
+        self._moveTimer.start()
+
+        self._changedSpriteRect = None
+
+        canvas_pos = self._mouseState.canvas_pos = self.mapToScene(pos)
+
+        # self._mouseState.sprite_pos.setX(canvas_pos.x() - self._spriteObject.boundingRect().left())
+        # self._mouseState.sprite_pos.setY(canvas_pos.y() - self._spriteObject.boundingRect().top())
+        self._mouseState.sprite_pos.setX(int(canvas_pos.x() - self._spriteObject.boundingRect().left()))
+        self._mouseState.sprite_pos.setY(int(canvas_pos.y() - self._spriteObject.boundingRect().top()))
+
+        if self._pixelSize > 1 and self._snapEnabled:
+            self._mouseState.sprite_pos = utils.snap_point(self._mouseState.sprite_pos,
+                                                           self._pixelSize)
+            self._mouseState.canvas_pos = utils.snap_point(self._mouseState.canvas_pos,
+                                                           self._pixelSize)
+
+        self._currentTool.on_mouse_move()
+
+        self._mouseState.last_canvas_pos.setX(int(canvas_pos.x()))
+        self._mouseState.last_canvas_pos.setY(int(canvas_pos.y()))
+
+        self._mouseState.last_sprite_pos.setX(self._mouseState.sprite_pos.x())
+        self._mouseState.last_sprite_pos.setY(self._mouseState.sprite_pos.y())
+
+        changed_rect = self._changedSpriteRect
+
+        self._changedSpriteRect = None
+
+        # Moves that only changed some pixels repaint just those and the pointer, anything else
+        # a tool does while moving may show anywhere
+        if changed_rect is None or changed_rect.isNull():
+            self._lastPointerPos = QPoint(self.mouse_state.global_pos)
+            self.update()
+            return
+
+        self.update_sprite_rect(changed_rect)
+
+        self._update_pointer()
+
+    def _pointer_rect(self, pos):
+
+        # Room for the largest tool pointer: the pixel size square or a 32 px cursor around pos
+        half_size = int(max(self._pixelSize * self.zoom, 32) / 2) + 2
+
+        return QRect(pos.x() - half_size, pos.y() - half_size, half_size * 2, half_size * 2)
+
+    def _update_pointer(self):
+
+        pointer_pos = self.mouse_state.global_pos
+
+        self.viewport().update(self._pointer_rect(self._lastPointerPos))
+        self.viewport().update(self._pointer_rect(pointer_pos))
+
+        self._lastPointerPos = QPoint(pointer_pos)
+
+    def _step_history(self, undo):
+
+        if not self.sprite_is_set() or self._currentTool.is_active:
+            return
+
+        history = self._spriteObject.sprite.history
+
+        entry = history.undo() if undo else history.redo()
+
+        if entry is None:
+            return
+
+        self.update()
+
+        self.surfaceChanged.emit()
+
+    def _on_move_timer_timeout(self):
+
+        if self._pendingMovePos is None:
+            return
+
+        pos = self._pendingMovePos
+
+        self._pendingMovePos = None
+
+        if self.sprite_is_set() and not self.is_panning and self._currentTool.is_active:
+            self._move_tool(pos)
+
+    def _on_surface_changing(self, rect):
+
+        if self._changedSpriteRect is None:
+            self._changedSpriteRect = QRect(rect)
+
+        elif not self._changedSpriteRect.isNull():
+            self._changedSpriteRect = rect if rect.isNull() else self._changedSpriteRect.united(rect)
+
+    def _on_surface_modified(self, rect):
+
+        if not self.sprite_is_set():
+            return
+
+        surface = self._spriteObject.sprite.current_surface
+
+        if surface is not None:
+            surface.mark_dirty(None if rect.isNull() else
+                               (rect.x(), rect.y(), rect.width(), rect.height()))
+
     def _load_tools(self):
 
         # Default Tools
@@ -160,6 +160,22 @@ class Display(QGraphicsView):
         self.scale(scale_factor, scale_factor)
         self.setTransformationAnchor(QGraphicsView.AnchorViewCenter)
 
+    def map_sprite_rect_to_global_rect(self, rect):
+
+        # Sprite pixels to the viewport area showing them, with a pixel to spare for rounding
+        sprite_rect = QRectF(rect).translated(self._spriteObject.boundingRect().topLeft())
+
+        return self.mapFromScene(sprite_rect).boundingRect().adjusted(-1, -1, 1, 1)
+
+    def update_sprite_rect(self, rect):
+
+        # Repaints only what shows the given sprite area, or everything for a null rect
+        if rect.isNull() or self._spriteObject.is_empty:
+            self.update()
+            return
+
+        self.viewport().update(self.map_sprite_rect_to_global_rect(rect))
+
     def unload_sprite(self):
 
         self.reset_view()
@@ -32,6 +32,12 @@ class DisplaySpriteObject(QGraphicsItem):
 
         self._enableOnionSkin = True
 
+        # Pre-rendered frames to blit instead of compositing layers, when the display has them
+        self._playbackCache = None
+
+        # Makes option.exposedRect the area actually being repainted
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
     @property
     def sprite(self):
         return self._sprite
@@ -41,8 +47,8 @@ class DisplaySpriteObject(QGraphicsItem):
         return self._sprite.active_surface
 
     @property
-    def active_surface_pixel_data(self):
-        return self._sprite.active_surface_pixel_data
+    def active_surface_pixels(self):
+        return self._sprite.active_surface_pixels
 
     @property
     def display_frame_index(self):
@@ -87,6 +93,14 @@ class DisplaySpriteObject(QGraphicsItem):
     def height(self):
         return self.boundingRect().height()
 
+    @property
+    def playback_cache(self):
+        return self._playbackCache
+
+    @playback_cache.setter
+    def playback_cache(self, value):
+        self._playbackCache = value
+
     @property
     def enable_onion_skin(self):
         return self._enableOnionSkin
@@ -150,10 +164,22 @@ class DisplaySpriteObject(QGraphicsItem):
     #             painter.drawImage(option.rect, layer.image)
 
     def paint(self, painter, option, widget=None):
-        painter.setClipRect(option.exposedRect)
+
+        # Only the whole sprite pixels under the exposed area are drawn
+        exposed_rect = option.exposedRect.intersected(self._boundingRect)
+
+        if exposed_rect.isEmpty():
+            return
+
+        target_rect = QRectF(exposed_rect.toAlignedRect())
+
+        source_rect = target_rect.translated(-self._boundingRect.topLeft())
+
+        painter.setClipRect(target_rect)
 
         if self._backgroundPixmap is not None:
-            painter.drawTiledPixmap(option.rect, self._backgroundPixmap)
+            painter.drawTiledPixmap(target_rect, self._backgroundPixmap,
+                                    target_rect.topLeft() - self._boundingRect.topLeft())
 
         if self._sprite is not None:
             frame_count = len(self._sprite.current_animation.frames)
@@ -169,18 +195,50 @@ class DisplaySpriteObject(QGraphicsItem):
                     last_frame_index = frame_index - 1
 
                     if 0 <= last_frame_index < frame_count:
-                        last_frame_layers = self._sprite.current_animation.frame_at(
-                            last_frame_index
-                        ).surfaces
+                        last_frame = self._sprite.current_animation.frame_at(last_frame_index)
 
                         painter.setOpacity(0.2)
 
-                        for layer in last_frame_layers:
-                            painter.drawImage(option.rect, layer.image)
+                        painter.drawImage(target_rect, last_frame.composite, source_rect)
 
                         painter.setOpacity(1.0)
 
-                layers = self._sprite.current_animation.frame_at(frame_index).surfaces
+                frame = self._sprite.current_animation.frame_at(frame_index)
+
+                pixmap = self._playbackCache.pixmap(frame) \
+                    if self._playbackCache is not None else None
+
+                if pixmap is not None:
+                    self._blit_pixmap(painter, pixmap, target_rect, source_rect)
+                    return
+
+                # Layers other than the one being edited come flattened, so a paint costs the
+                # same however many layers there are
+                if frame_index == self._sprite.current_animation.current_frame_index and \
+                        frame.current_surface is not None:
+
+                    layers = [frame.composite_below, frame.current_surface.image,
+                              frame.composite_above]
+
+                else:
+
+                    layers = [frame.composite]
 
                 for layer in layers:
-                    painter.drawImage(option.rect, layer.image)
+                    if layer is not None:
+                        painter.drawImage(target_rect, layer, source_rect)
+
+    def _blit_pixmap(self, painter, pixmap, target_rect, source_rect):
+
+        # The pixmap is already at display scale, so it is drawn untransformed, pixel for pixel
+        zoom = pixmap.width() / self._boundingRect.width()
+
+        device_rect = painter.transform().mapRect(target_rect)
+
+        pixmap_rect = QRectF(source_rect.x() * zoom, source_rect.y() * zoom,
+                             device_rect.width(), device_rect.height())
+
+        painter.save()
+        painter.resetTransform()
+        painter.drawPixmap(device_rect, pixmap, pixmap_rect)
+        painter.restore()
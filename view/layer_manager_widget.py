@@ -19,20 +19,18 @@ import helpers.utils as utils
 # -------------------------------------------------------------------------------------------------
 
 class LayerListItem(ListItem):
-    def __init__(self, parent, layer):
+    def __init__(self, parent, layer, thumbnail_cache=None):
         super().__init__(parent, layer.name)
 
-        self._layerImage = layer.image
-
         self._layer = layer
 
+        self._thumbnailCache = thumbnail_cache
+
     def draw_content(self, painter, draw_area):
         painter.setPen(Qt.white)
 
         painter.drawText(20, self._top + 20, self._label)
 
-        icon = self._layer.image
-
         # Draw Icon
 
         # icon_draw_area = QRect(draw_area.right() - 55,
@@ -59,9 +57,18 @@ class LayerListItem(ListItem):
 
         painter.fillRect(icon_draw_area, Qt.white)
 
+        if self._thumbnailCache is None:
+            icon = self._layer.image
+
+            painter.drawImage(icon_draw_area, icon, QRect(0, 0, icon.width(), icon.height()))
+            return
+
+        # Left blank until its thumbnail is ready
+        icon = self._thumbnailCache.thumbnail(self._layer, icon_draw_area.width(),
+                                              icon_draw_area.height())
+
         if icon is not None:
-            painter.drawImage(icon_draw_area, icon,
-                              QRect(0, 0, icon.width(), icon.height()))
+            painter.drawPixmap(icon_draw_area, icon)
 
 
 class LayerManager(QWidget):
@@ -91,8 +98,18 @@ class LayerManager(QWidget):
 
         self._sprite = None
 
+        self._thumbnailCache = None
+
         self.setAcceptDrops(True)
 
+    @property
+    def thumbnail_cache(self):
+        return self._thumbnailCache
+
+    @thumbnail_cache.setter
+    def thumbnail_cache(self, value):
+        self._thumbnailCache = value
+
     def set_sprite(self, sprite):
 
         self._sprite = sprite
@@ -134,7 +151,7 @@ class LayerManager(QWidget):
             self._listWidget.clear()
 
             for surface in frame.surfaces:
-                layer_item = LayerListItem(self._listWidget, surface)
+                layer_item = LayerListItem(self._listWidget, surface, self._thumbnailCache)
                 self._listWidget.add_item(layer_item)
 
             self._listWidget.selected_index = frame.current_surface_index
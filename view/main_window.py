@@ -23,6 +23,7 @@ from view.color_picker_widget import ColorPicker
 from view.layer_manager_widget import LayerManager
 from view.new_sprite_dialog import NewSpriteDialog
 from view.animation_manager_widget import AnimationManager
+from view.thumbnail_cache import ThumbnailCache
 from model.resources_cache import ResourcesCache
 import model.appdata as app_data
 
@@ -60,14 +61,21 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self._animationDisplay = AnimationDisplay()
         self._animationDisplay.backlight_enabled = self._canvas.backlight_enabled
 
+        # Preview frames aren't rendered again for every step of a stroke
+        self._animationDisplay.playback_cache.is_busy = lambda: self._canvas.is_painting
+
         self._animationDisplayDock = QDockWidget()
         self._animationDisplayDock.setFeatures(QDockWidget.DockWidgetFloatable)
         self._animationDisplayDock.setWindowTitle("Animation Display")
         self._animationDisplayDock.setWidget(self._animationDisplay)
 
+        self._thumbnailCache = ThumbnailCache()
+
         self._animationManager = AnimationManager()
+        self._animationManager.thumbnail_cache = self._thumbnailCache
 
         self._layerManager = LayerManager()
+        self._layerManager.thumbnail_cache = self._thumbnailCache
 
         self._newSpriteDialog = NewSpriteDialog()
         self._newSpriteDialog.setWindowFlags(Qt.WindowTitleHint | Qt.WindowCloseButtonHint)
@@ -98,6 +106,10 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     def animation_manager(self):
         return self._animationManager
 
+    @property
+    def thumbnail_cache(self):
+        return self._thumbnailCache
+
     @property
     def toolbar_widget(self):
         return self.toolBar
@@ -265,6 +277,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self._layerManager.layerOrderChanged.connect(self._on_layer_order_changed)
         self._layerManager.layerImported.connect(self._on_layer_imported)
 
+        self._thumbnailCache.thumbnailsReady.connect(self._on_thumbnails_ready)
+
     def _init_toolbox(self):
 
         self._toolbar.register_tool(self._canvas.find_tool_by_name('Pen'), is_default=True)
@@ -298,9 +312,14 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self._animationManager.update()
         self._layerManager.update()
 
-    def _on_canvas_surface_changing(self):
+    def _on_thumbnails_ready(self):
 
-        self._animationDisplay.update()
+        self._animationManager.update()
+        self._layerManager.update()
+
+    def _on_canvas_surface_changing(self, rect):
+
+        self._animationDisplay.update_sprite_rect(rect)
 
     def _on_canvas_viewport_changed(self):
 
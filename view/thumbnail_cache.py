@@ -0,0 +1,195 @@
+# --------------------------------------------------------------------------------------------------
+# Name:        Thumbnail Cache
+# Purpose:     Downscaled pixmaps of Surfaces shared by the frame strip and the layer list,
+#              rendered off the GUI thread
+#
+# Created:     17/10/26
+#--------------------------------------------------------------------------------------------------
+
+from collections import OrderedDict
+import weakref
+
+import numpy
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+from PyQt5.QtGui import QPixmap
+
+import helpers.utils as utils
+from helpers.worker import Worker
+import model.appdata as appdata
+
+
+def _sample_pixels(pixels, width, height):
+
+    # Nearest pixel to the center of each thumbnail pixel, like a fast scaled draw would pick
+    source_height, source_width = pixels.shape[:2]
+
+    xs = ((numpy.arange(width) + 0.5) * source_width / width).astype(numpy.intp)
+    ys = ((numpy.arange(height) + 0.5) * source_height / height).astype(numpy.intp)
+
+    return numpy.ascontiguousarray(pixels[ys[:, None], xs])
+
+
+class _ThumbnailJob(object):
+
+    def __init__(self, key, version, surface):
+
+        self.key = key
+        self.version = version
+
+        # Shared with the surface until it is next written to, which copies them first
+        self.pixels = surface.share_pixels(self)
+
+    def render(self):
+
+        _, width, height = self.key
+
+        return utils.pixels_to_image(_sample_pixels(self.pixels, width, height))
+
+
+class ThumbnailCache(QObject):
+    """
+    Keeps Surfaces scaled down to the sizes they are shown at, keyed by the Surface version they
+    were made from. A thumbnail that is missing or out of date is rendered on a worker thread,
+    meanwhile the out of date one, if any, is handed out. thumbnailsReady is emitted once new
+    ones are in, the least recently used ones are dropped when over budget.
+
+    The worker samples Surfaces down from pixels they share copy on write, so it never reads
+    pixels still being painted on, and Surfaces are only weakly referenced, so thumbnails don't
+    keep deleted layers alive.
+    """
+
+    thumbnailsReady = pyqtSignal()
+
+    def __init__(self):
+
+        super(ThumbnailCache, self).__init__()
+
+        # (Surface Weak Reference, Width, Height) -> (Version, Pixmap), least recently used first
+        self._pixmaps = OrderedDict()
+
+        self._size = 0
+
+        # (Surface Weak Reference, Width, Height) -> Version being rendered or waiting to be
+        self._requested = {}
+
+        # Thumbnail jobs waiting for the worker
+        self._queue = []
+
+        self._worker = None
+
+        # Bumped on clear so renders started before it are thrown away
+        self._generation = 0
+
+    def thumbnail(self, surface, width, height):
+
+        key = (weakref.ref(surface), width, height)
+
+        entry = self._pixmaps.get(key)
+
+        version = surface.version
+
+        if (entry is None or entry[0] != version) and self._requested.get(key) != version:
+
+            self._requested[key] = version
+            self._queue.append(_ThumbnailJob(key, version, surface))
+
+            self._start_worker()
+
+        if entry is None:
+            return None
+
+        self._pixmaps.move_to_end(key)
+
+        return entry[1]
+
+    def clear(self):
+
+        self._pixmaps.clear()
+        self._size = 0
+
+        self._requested.clear()
+        self._queue.clear()
+
+        self._generation += 1
+
+    # ---------------------------------------------------------------------------------------------
+
+    def _start_worker(self):
+
+        if self._worker is not None or len(self._queue) == 0:
+            return
+
+        # Handed over to the worker alone, so the jobs and the pixels they share are let go as
+        # soon as it is done with them
+        batches = [self._queue]
+        self._queue = []
+
+        requests = [(job.key, job.version) for job in batches[0]]
+
+        def render(_):
+
+            return [(job.key, job.version, job.render()) for job in batches.pop()]
+
+        generation = self._generation
+
+        worker = Worker(render)
+
+        worker.succeeded.connect(lambda thumbnails: self._on_thumbnails_rendered(generation,
+                                                                                 thumbnails))
+        worker.failed.connect(lambda _: self._on_render_failed(generation, requests))
+        worker.released.connect(self._on_worker_finished)
+
+        self._worker = worker
+
+        worker.start(QThread.LowPriority)
+
+    def _on_thumbnails_rendered(self, generation, thumbnails):
+
+        if generation != self._generation:
+            return
+
+        for key, version, image in thumbnails:
+
+            if self._requested.get(key) == version:
+                del self._requested[key]
+
+            self._discard(key)
+
+            if key[0]() is None:
+                continue
+
+            self._pixmaps[key] = (version, QPixmap.fromImage(image))
+            self._size += image.width() * image.height() * 4
+
+        # Thumbnails of Surfaces deleted since
+        for key in [key for key in self._pixmaps if key[0]() is None]:
+            self._discard(key)
+
+        while self._size > appdata.thumbnail_cache_budget and len(self._pixmaps) > 1:
+            self._discard(next(iter(self._pixmaps)))
+
+        self.thumbnailsReady.emit()
+
+    def _on_render_failed(self, generation, requests):
+
+        if generation != self._generation:
+            return
+
+        # Asked for again on the next paint
+        for key, version in requests:
+            if self._requested.get(key) == version:
+                del self._requested[key]
+
+    def _on_worker_finished(self):
+
+        self._worker = None
+
+        self._start_worker()
+
+    def _discard(self, key):
+
+        entry = self._pixmaps.pop(key, None)
+
+        if entry is not None:
+            pixmap = entry[1]
+            self._size -= pixmap.width() * pixmap.height() * 4